@@ -0,0 +1,207 @@
+""" Times the stages of the FFD pipeline on synthetic plug nozzle meshes of
+increasing size and control point counts, and saves the timings as JSON, so
+scaling and regressions can be compared between versions.
+
+    python benchmark.py --sizes 40x16,80x32,160x64 --controls 5,10 --output bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import platform
+import argparse
+from collections import OrderedDict
+
+import numpy as np
+
+import instrument
+import kernels
+from stl import STL, parse_ascii_stl, parse_binary_stl
+from bspline import Bspline
+from ffd_axisymetric import Body, Shell
+from stl_group import STLGroup
+from synthetic import write_nozzle
+
+#folder the STL and b-spline classes keep their pickles in, relative to the cwd
+PKL_FOLDER = "pyBspline_pkl"
+
+
+def _clear_pickles():
+    shutil.rmtree(PKL_FOLDER, ignore_errors=True)
+
+def time_stage(func, repeat, setup=None):
+    """calls func(i) for i in range(repeat), after setup(i) if given, and
+    returns the best and mean wall time of the calls"""
+
+    times = []
+    for i in range(repeat):
+        if setup is not None:
+            setup(i)
+        start_time = time.time()
+        func(i)
+        times.append(time.time()-start_time)
+    return {'best': min(times), 'mean': sum(times)/len(times), 'repeat': repeat}
+
+def _time_weld(file_name, repeat):
+    #welding happens inside STL, so take its time from the instrument timer
+    was_enabled = instrument.enabled
+    instrument.enable()
+    times = []
+    try:
+        for i in range(repeat):
+            _clear_pickles()
+            instrument.reset()
+            STL(file_name)
+            times.append(instrument.stats()['timers']['stl.weld']['total'])
+    finally:
+        instrument.reset()
+        instrument.enable(was_enabled)
+    return {'best': min(times), 'mean': sum(times)/len(times), 'repeat': repeat}
+
+
+def _controls(points, n_controls):
+    X = points[:,0]
+    return np.array(zip(np.linspace(X.min(), X.max(), n_controls), np.zeros(n_controls)))
+
+def _mesh_stages(files, repeat):
+    """stages that only depend on the mesh"""
+
+    ascii_file, binary_file = files['centerbody']
+    stages = OrderedDict()
+
+    def parse_ascii(i):
+        with open(ascii_file) as f:
+            parse_ascii_stl(f)
+    stages['parse_ascii'] = time_stage(parse_ascii, repeat)
+
+    def parse_binary(i):
+        with open(binary_file, 'rb') as f:
+            parse_binary_stl(f)
+    stages['parse_binary'] = time_stage(parse_binary, repeat)
+
+    stages['weld'] = _time_weld(ascii_file, repeat)
+    return stages
+
+def _ffd_stages(surfaces, n_controls, repeat, out_folder):
+    """stages that depend on the mesh and the number of control points"""
+
+    stages = OrderedDict()
+    body_points = surfaces['centerbody'].points
+    body_controls = _controls(body_points, n_controls)
+    cowl_controls = _controls(surfaces['outer_cowl'].points, n_controls)
+
+    stages['bspline'] = time_stage(lambda i: Bspline(body_controls, body_points), repeat,
+                                   setup=lambda i: _clear_pickles())
+
+    _clear_pickles()
+    body = Body(surfaces['centerbody'], body_controls, name='plug')
+    cowl = Shell(surfaces['outer_cowl'], surfaces['inner_cowl'], cowl_controls, cowl_controls.copy(), name='cowl')
+    geom = STLGroup()
+    geom.add(body, name='plug')
+    geom.add(cowl, name='cowl')
+
+    rand = np.random.RandomState(0)
+    deltas = [0.01*rand.standard_normal((n_controls, 2)) for i in range(repeat)]
+    stages['deform_body'] = time_stage(lambda i: body.deform(deltas[i]), repeat)
+    stages['deform_shell'] = time_stage(lambda i: cowl.deform(deltas[i], deltas[-1-i]), repeat)
+
+    def provideJ(i):
+        geom._needs_linerize = True
+        geom.provideJ()
+    stages['provideJ'] = time_stage(provideJ, repeat)
+
+    n_points = len(geom.points)
+    names = geom.param_J_map.keys()
+    arg = dict((name, rand.standard_normal(len(geom.param_name_map[name]))) for name in names)
+    stages['apply_deriv'] = time_stage(
+        lambda i: geom.apply_deriv(arg, {'geom_out': np.zeros((n_points, 3))}), repeat)
+    seed = rand.standard_normal((n_points, 3))
+    def apply_derivT(i):
+        result = dict((name, np.zeros(len(geom.param_name_map[name]))) for name in names)
+        result['geom_out'] = seed
+        geom.apply_derivT({}, result)
+    stages['apply_derivT'] = time_stage(apply_derivT, repeat)
+
+    out = lambda ext: (lambda i: os.path.join(out_folder, "out_%d.%s"%(i, ext)))
+    stl_name, binary_name, fepoint_name = out('stl'), out('b.stl'), out('tec')
+    stages['write_stl_ascii'] = time_stage(lambda i: geom.writeSTL(stl_name(i), ascii=True), repeat)
+    stages['write_stl_binary'] = time_stage(lambda i: geom.writeSTL(binary_name(i)), repeat)
+    stages['write_fepoint'] = time_stage(lambda i: geom.writeFEPOINT(fepoint_name(i)), repeat)
+
+    return stages
+
+
+def run(sizes, controls, repeat=3, folder=None):
+    """runs the benchmark for every (n_x, n_theta) mesh size in sizes and
+    every number of control points in controls. Work is done in folder, or a
+    temporary folder that is removed afterwards. Returns the results as a
+    dictionary that can be saved as JSON"""
+
+    cleanup = folder is None
+    if cleanup:
+        folder = tempfile.mkdtemp(prefix="ffd_bench_")
+    elif not os.path.exists(folder):
+        os.makedirs(folder)
+    folder = os.path.abspath(folder)
+
+    cwd = os.getcwd()
+    os.chdir(folder) #keep the pickles out of the way of the real ones
+    try:
+        cases = []
+        for n_x, n_theta in sizes:
+            files = write_nozzle(os.path.join(folder, "meshes"), n_x, n_theta)
+            case = OrderedDict([('n_x', n_x), ('n_theta', n_theta)])
+            case['stages'] = _mesh_stages(files, repeat)
+
+            _clear_pickles()
+            surfaces = dict((name, STL(ascii_file)) for name, (ascii_file, _) in files.iteritems())
+            case['n_points'] = sum(len(s.points) for s in surfaces.itervalues())
+            case['n_facets'] = sum(len(s.facets) for s in surfaces.itervalues())
+            case['controls'] = OrderedDict((str(n), _ffd_stages(surfaces, n, repeat, folder)) for n in controls)
+            cases.append(case)
+    finally:
+        os.chdir(cwd)
+        if cleanup:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    return {'meta': {'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                     'python': sys.version.split()[0],
+                     'numpy': np.__version__,
+                     'platform': platform.platform(),
+                     'kernels': kernels.BACKEND,
+                     'repeat': repeat},
+            'cases': cases}
+
+
+def _sizes(text):
+    return [tuple(int(n) for n in size.split('x')) for size in text.split(',')]
+
+def _ints(text):
+    return [int(n) for n in text.split(',')]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="times the FFD pipeline on synthetic nozzle meshes")
+    parser.add_argument('--sizes', type=_sizes, default=_sizes("40x16,80x32,160x64"),
+                        help="mesh sizes, as stations x angles, separated by commas")
+    parser.add_argument('--controls', type=_ints, default=[5, 10],
+                        help="numbers of control points, separated by commas")
+    parser.add_argument('--repeat', type=int, default=3, help="times each stage is run")
+    parser.add_argument('--folder', default=None, help="folder to work in, a temporary one by default")
+    parser.add_argument('--output', default="benchmark.json", help="JSON file to save the results to")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.controls, args.repeat, args.folder)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    for case in results['cases']:
+        print "%dx%d: %d points, %d facets"%(case['n_x'], case['n_theta'], case['n_points'], case['n_facets'])
+        for stage, t in case['stages'].iteritems():
+            print "    %-18s %10.4f s"%(stage, t['best'])
+        for n, stages in case['controls'].iteritems():
+            print "  %s controls"%n
+            for stage, t in stages.iteritems():
+                print "    %-18s %10.4f s"%(stage, t['best'])
@@ -1,13 +1,118 @@
 import cPickle
 import os.path
+import hashlib
+import threading
+import weakref
 
 from numpy import linspace, hstack, dstack, less ,less_equal, logical_and, \
-    array, empty, matrix, dot
+    array, empty, zeros, eye, matrix, dot, asarray, around, unique, take, nonzero, \
+    searchsorted, abs as np_abs
     
 from scipy.optimize import fsolve, newton
 from scipy.sparse import csr_matrix
+from scipy.linalg import solve
+
+import instrument
+from kernels import basis_matrix
+from memory import tracks_construction, report
+
+#B matrices depend only on the order, the knots, the x of the control points
+#and the x of the points, so Bsplines with the same inputs share one
+#read-only copy. Entries go away once no Bspline is using them.
+_basis_registry = weakref.WeakValueDictionary()
+_registry_lock = threading.Lock()
+_BASIS_PARTS = ('B_stations','station_index','station_t')
+
+def basis_key(order,knots,controls,points): 
+    """returns a key identifying the B matrix for the given inputs"""
+    h = hashlib.sha1(str(order))
+    for a in (knots,controls[:,0],points[:,0]): 
+        a = array(a,dtype='float64')+0. #get rid of any -0
+        h.update(str(a.shape))
+        h.update(a.tostring())
+    return h.hexdigest()
+
+def load_pickle(file_name): 
+    """returns what is pickled in file_name, or None if there is no such file,
+    or only a broken one"""
+    if not os.path.exists(file_name): 
+        return None
+    try: 
+        with open(file_name,'rb') as f: 
+            return cPickle.load(f)
+    except (EOFError,ValueError,cPickle.UnpicklingError): #cut short by an older version
+        return None
+
+def dump_pickle(data,file_name): 
+    """pickles data to file_name. Workers pickling the same thing at once 
+    each write to a temp name first, then rename it, so no one ever loads 
+    half a file"""
+    tmp_name = '%s.%d.%d.tmp'%(file_name,os.getpid(),threading.current_thread().ident)
+    with open(tmp_name,'wb') as f: 
+        cPickle.dump(data,f)
+    os.rename(tmp_name,file_name)
+
+def basis_functions(knots,degree,t,derivative=0): 
+    """returns the values of all the b-spline basis functions of the given 
+    degree, or of their derivative of the given order, at each t, as a 
+    len(t) x n_basis array"""
+    knots = asarray(knots,dtype='float64')
+    t = asarray(t,dtype='float64')
+
+    #degree 0, with t at the end of the knots put in the last non-empty span
+    N = logical_and(less_equal(knots[:-1],t[:,None]),less(t[:,None],knots[1:])).astype('float64')
+    end = t==knots[-1]
+    last = searchsorted(knots,knots[-1])-1
+    N[end,last] = 1.
+
+    def ratio(a,b): 
+        #0/0 terms of the recursion are taken as 0
+        b = b.copy()
+        zero = b==0
+        b[zero] = 1.
+        a = a/b
+        a[...,zero] = 0.
+        return a
+
+    for q in range(1,degree+1): 
+        k_j,k_j1 = knots[:-q-1],knots[1:-q]
+        k_jq,k_jq1 = knots[q:-1],knots[q+1:]
+        if q <= degree-derivative: 
+            N = ratio(t[:,None]-k_j,k_jq-k_j)*N[:,:-1] + ratio(k_jq1-t[:,None],k_jq1-k_j1)*N[:,1:]
+        else: 
+            N = q*(ratio(N[:,:-1],k_jq-k_j) - ratio(N[:,1:],k_jq1-k_j1))
+    return N
+
+def insertion_matrix(knots,degree,u): 
+    """returns the knots with u inserted, and the (n+1) x n matrix that maps 
+    the control points of the b-spline onto those of the refined one"""
+    knots = asarray(knots,dtype='float64')
+    n = len(knots)-degree-1
+    k = searchsorted(knots,u,side='right')-1
+    k = min(k,n-1) #u at the end of the knots goes in the last span
+
+    A = zeros((n+1,n))
+    for i in range(n+1): 
+        if i <= k-degree: 
+            alpha = 1.
+        elif i > k: 
+            alpha = 0.
+        else: 
+            alpha = (u-knots[i])/(knots[i+degree]-knots[i])
+        if i < n: 
+            A[i,i] = alpha
+        if i > 0: 
+            A[i,i-1] = 1.-alpha
+    return hstack((knots[:k+1],[u],knots[k+1:])),A
+
 
 class Bspline(object): 
+
+    #points whose x differ by less than this, relative to the largest x, are 
+    #treated as being on the same axial station
+    station_tol = 1e-10
+
+    @tracks_construction
     def __init__(self,controls,points,order=3): #controls and points are 2-d arrays of points 
 
         self.controls = controls
@@ -19,46 +124,173 @@ class Bspline(object):
                              ))
         self.__b_cache = {} #uses for memoizing the b_jn function
         self.max_x = max(points[:,0]) 
+        self._support = None #points moved by each control point, built on first use
+
+        #see if another Bspline already has the same B matrix
+        self.basis_key = basis_key(self.order,self.knots,controls,points)
+        with _registry_lock: 
+            basis = [_basis_registry.get((self.basis_key,part)) for part in _BASIS_PARTS]
+        if not any(b is None for b in basis): 
+            instrument.count('bspline.registry_hits')
+            self.B_stations, self.station_index, self.station_t = basis
+            return
 
         #see if we can 
-        h1 = str(hash(tuple(points.flatten()))).replace("-","n")
-        h2 = str(hash(tuple(controls.flatten()))).replace("-","n")
-        pkl_file_name = "%s__%s.bspline_pkl"%(h1,h2)
+        pkl_file_name = "%s.stations_t.bspline_pkl"%self.basis_key
         pkl_folder = "pyBspline_pkl"
         pkl_file_name = os.path.join(pkl_folder,pkl_file_name)
         if not os.path.exists(pkl_folder): 
-            os.mkdir(pkl_folder)
-        if os.path.exists(pkl_file_name): 
-
-            self.B = cPickle.load(open(pkl_file_name))
+            try: 
+                os.mkdir(pkl_folder)
+            except OSError: #made by another process in the meantime
+                pass
+        basis = load_pickle(pkl_file_name)
+        if basis is not None: 
+            instrument.count('bspline.pickle_hits')
+            self.B_stations, self.station_index, self.station_t = basis
         else: 
-            self.B = self._calc_jacobian(points)
-            cPickle.dump(self.B,open(pkl_file_name,'w'))
+            instrument.count('bspline.builds')
+            self._calc_jacobian(points)
+            dump_pickle((self.B_stations,self.station_index,self.station_t),pkl_file_name)
+
+        self._share_basis()
+
+    def _share_basis(self): 
+        #hands the basis to the registry, or takes the one already there
+        with _registry_lock: 
+            for part in _BASIS_PARTS: 
+                b = getattr(self,part)
+                b.flags.writeable = False #shared, so nobody gets to change it
+                setattr(self,part,_basis_registry.setdefault((self.basis_key,part),b))
 
    
+    @instrument.timed('bspline.basis')
     def _calc_jacobian(self,points):                       
         #pre-calculate the B matrix
-        n_p = points.shape[0]
-        B = matrix(empty((n_p,self.n))) #1 row per point, one column per control_point
-        
-        r = range(0,self.n)
-        for i,p in enumerate(points): 
-            t = self.find(p[0])
-            for j in r: 
-                B[i,j] = self.b_jn_wrapper(j,self.degree,t)    
-                
+        #surfaces of revolution have lots of points on each axial station, so 
+        #only invert and evaluate the basis once per station. Only that is
+        #kept, the row of each point is B_stations[station_index]
+        X = points[:,0]
+        scale = max(np_abs(X).max(),1.)
+        _,first,self.station_index = unique(around(X/(self.station_tol*scale)),
+                                            return_index=True,return_inverse=True)
+        station_x = X[first]
+
+        #kept so the basis can be refined without find
+        self.station_t = array([self.find(x)[0] for x in station_x])
+
+        #1 row per station, one column per control_point
+        B = basis_matrix(self.knots,self.degree,self.station_t)
+        if B is None: 
+            B = basis_functions(self.knots,self.degree,self.station_t)
+        B = matrix(B)
+
         #self.B = csr_matrix(B)
-        self.B = B
-        return self.B
+        self.B_stations = B
+        return self.B_stations
+
+    @property
+    def B(self): 
+        """the full n_points x n basis matrix. It is expanded from B_stations
+        on every access and never kept, so products should go through 
+        B_stations and station_index instead"""
+        return self.B_stations[self.station_index]
                     
+    @instrument.timed('bspline.evaluate')
     def calc(self,C,points=None):
         self.controls = C
         if points: 
-            self.B = self._calc_jacobian(points)
+            self._calc_jacobian(points)
             
-        return array(self.B.dot(C))     
+        return array(self.B_stations.dot(self._cast(C)))[self.station_index]
+
+    def _cast(self,C): 
+        #products with a float32 basis are done in float32, instead of having
+        #numpy upcast the whole basis to float64 for each of them
+        return asarray(C,dtype=self.B_stations.dtype)
+
+    def _refined(self,knots,order,A): 
+        """returns a Bspline with the given knots and order, whose control 
+        points are A times these. The points keep their t, so the new B is 
+        evaluated straight at station_t, and B_new.A equals B"""
+        bs = Bspline.__new__(Bspline)
+        bs.controls = dot(A,self.controls)
+        bs.order = order
+        bs.degree = order-1
+        bs.n = len(bs.controls)
+        bs.knots = knots
+        bs._Bspline__b_cache = {}
+        bs.max_x = self.max_x
+        bs._support = None
+
+        h = hashlib.sha1(self.basis_key)
+        h.update(str(order))
+        h.update(array(knots,dtype='float64').tostring())
+        bs.basis_key = h.hexdigest()
+
+        bs.station_index = self.station_index
+        bs.station_t = self.station_t
+        bs.B_stations = matrix(basis_functions(knots,bs.degree,self.station_t))
+        for part in _BASIS_PARTS: 
+            getattr(bs,part).flags.writeable = False
+        return bs
+
+    def insert_knots(self,knots): 
+        """returns a Bspline of the same shape with the given knots inserted,
+        one control point more for each, and the matrix that maps these control
+        points onto the new ones"""
+        new_knots = self.knots
+        A = eye(self.n)
+        for u in knots: 
+            new_knots,A_u = insertion_matrix(new_knots,self.degree,u)
+            A = dot(A_u,A)
+        return self._refined(new_knots,self.order,A),A
+
+    def elevate_degree(self,times=1): 
+        """returns a Bspline of the same shape with the degree raised by 
+        times, and the matrix that maps these control points onto the new 
+        ones. Every distinct knot gets times more multiplicity"""
+        distinct = unique(self.knots)
+        new_knots = sorted(hstack((self.knots,)+(distinct,)*times))
+        new_knots = array(new_knots)
+        degree = self.degree+times
+
+        #the old basis is in the space of the new one, so A is exactly found by
+        #matching both at the greville points of the new basis
+        n = len(new_knots)-degree-1
+        greville = array([new_knots[i+1:i+degree+1].mean() for i in range(n)])
+        A = solve(basis_functions(new_knots,degree,greville),
+                  basis_functions(self.knots,self.degree,greville))
+        return self._refined(new_knots,self.order+times,A),A
+
+    def memory_report(self): 
+        """returns the bytes held by each array and by the memo of b_jn, see
+        memory.report. B matrices shared with other Bsplines are counted too"""
+        return report(self)
+
+    def support(self,controls): 
+        """returns the sorted indices of the points moved by any of the given
+        control points. Each control point only reaches the points whose t is 
+        in its order knot spans, so this is usually a small part of the mesh"""
+        if self._support is None: 
+            moved = asarray(self.B_stations) != 0
+            self._support = [nonzero(moved[self.station_index,j])[0] for j in range(self.n)]
+        if len(controls) == 1: 
+            return self._support[controls[0]]
+        return unique(hstack([self._support[j] for j in controls]))
+
+    def evaluate_rows(self,C,rows): 
+        """returns B.C for the given control points on the given rows only"""
+        return dot(asarray(self.B_stations)[self.station_index[rows]],self._cast(C))
+
+    @instrument.timed('bspline.evaluate')
+    def evaluate(self,C,out=None):
+        """returns B.C for the given control points, without changing the state
+        of the Bspline. The result is written to out, if given"""
+        return take(dot(asarray(self.B_stations),self._cast(C)),self.station_index,axis=0,out=out)
                     
      
+    @instrument.timed('bspline.inversion')
     def find(self,X):
         """returns the parametric coordinate that matches the given x location""" 
         
@@ -106,6 +338,18 @@ class Bspline(object):
             self.__b_cache[(j,n,tuple_t)] = B         
             return B 
         
+    def basis(self,t,derivative=0): 
+        """returns the basis functions, or their derivative of the given 
+        order, at each t as a len(t) x n array"""
+        return basis_functions(self.knots,self.degree,t,derivative)
+
+    def derivative(self,t,order=1,C=None): 
+        """returns the derivative of the given order of the curve at each t,
+        for the control points C, or the current ones if not given"""
+        if C is None: 
+            C = self.controls
+        return dot(self.basis(t,order),C)
+
     def __call__(self,t): 
         rng = range(0,self.n)
         b = [self.b_jn_wrapper(i,self.degree,t) for i in rng]
@@ -0,0 +1,125 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def digest(*arrays):
+    """returns a hex digest of the float64 values in the given arrays, and of
+    any strings among them"""
+
+    h = hashlib.sha1()
+    for a in arrays:
+        if isinstance(a, basestring):
+            h.update(a)
+            continue
+        #adding 0.0 turns -0.0 into 0.0, so they hash the same
+        a = np.ascontiguousarray(a, dtype=np.float64) + 0.0
+        h.update(str(a.shape))
+        h.update(a.tostring())
+    return h.hexdigest()
+
+
+class DeformationCache(object):
+    """LRU cache of deformed point buffers, key'd by a digest of the
+    parameters that produced them. An optional folder can be given to keep
+    a second, unbounded, tier of the cache on disk."""
+
+    def __init__(self, max_entries=64, cache_dir=None):
+
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        if cache_dir is not None and not os.path.exists(cache_dir):
+            try:
+                os.makedirs(cache_dir)
+            except OSError: #someone else made it first
+                pass
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock() #components may be deformed from several threads
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _disk_file(self, key):
+        return os.path.join(self.cache_dir, '%s.npy'%key)
+
+    def _remember(self, key, points):
+        self._entries[key] = points
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        """returns the cached points for key, or None if they are not cached"""
+
+        with self._lock:
+            return self._get(key)
+
+    def _get(self, key):
+        try:
+            points = self._entries.pop(key)
+        except KeyError:
+            pass
+        else:
+            self._entries[key] = points #move to the most recently used end
+            self.hits += 1
+            return points
+
+        if self.cache_dir is not None:
+            file_name = self._disk_file(key)
+            if os.path.exists(file_name):
+                points = np.load(file_name)
+                points.flags.writeable = False
+                self._remember(key, points)
+                self.disk_hits += 1
+                return points
+
+        self.misses += 1
+        return None
+
+    def put(self, key, points):
+        """stores a copy of points under key"""
+
+        points = np.array(points, dtype=np.float64)
+        points.flags.writeable = False
+        with self._lock:
+            self._remember(key, points)
+
+        if self.cache_dir is not None:
+            file_name = self._disk_file(key)
+            if not os.path.exists(file_name):
+                #write to a temp name first, so a reader never sees half a file
+                tmp_name = '%s.%d.%d.tmp'%(file_name, os.getpid(), threading.current_thread().ident)
+                with open(tmp_name, 'wb') as f:
+                    np.save(f, points)
+                os.rename(tmp_name, file_name)
+
+    def clear(self):
+        """empties the in-memory tier and resets the statistics"""
+
+        with self._lock:
+            self._entries.clear()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """returns a dictionary of hit-rate statistics"""
+
+        lookups = self.hits + self.disk_hits + self.misses
+        if lookups:
+            hit_rate = float(self.hits + self.disk_hits)/lookups
+        else:
+            hit_rate = 0.0
+        return {'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'lookups': lookups,
+                'hit_rate': hit_rate,
+                'entries': len(self._entries)}
+
+    def __len__(self):
+        return len(self._entries)
@@ -3,6 +3,8 @@ import copy
 import numpy as np
 
 from bspline import Bspline
+from deform_cache import digest
+from memory import tracks_construction, report
 
 
 class Coordinates(object): 
@@ -30,9 +32,114 @@ class Coordinates(object):
             self.cartesian = np.nan_to_num(np.vstack((X,Y,Z)).T)
 
 
+def revolve(X, R, sin_theta, cos_theta, out=None): 
+    """returns the cartesian points for the given axial and radial coordinates,
+    revolved to the angles given by their sin and cos. The result is written to
+    out, if given"""
+
+    if out is None: 
+        out = np.empty((len(X),3))
+    out[:,0] = X
+    np.multiply(R,sin_theta,out[:,1])
+    np.multiply(R,cos_theta,out[:,2])
+    return np.nan_to_num(out,copy=False)
+
+
+def _refine_spline(bs,knots,elevate): 
+    """returns a b-spline refined by knot insertion then degree elevation,
+    and the matrix that maps its control points onto the new ones"""
+    A = np.eye(bs.n)
+    if len(knots): 
+        bs,A_k = bs.insert_knots(knots)
+        A = np.dot(A_k,A)
+    if elevate: 
+        bs,A_e = bs.elevate_degree(elevate)
+        A = np.dot(A_e,A)
+    return bs,A
+
+def _cast_spline(bs,dtype): 
+    """returns a copy of bs with its basis stored in dtype. The basis of bs 
+    may be shared with other Bsplines, so it is left alone"""
+    bs = copy.copy(bs)
+    bs.B_stations = bs.B_stations.astype(dtype)
+    return bs
+
+#attributes that change when a component is deformed, which each clone gets
+#its own copy of
+_BODY_STATE = ('delta_C','C_bar','P_bar','P_bar_cart','coords')
+_SHELL_STATE = ('delta_Cc','delta_Ct','Cc_bar','Ct_bar','Po_bar','Pi_bar','Po_bar_cart','Pi_bar_cart',
+                'outer_coords','inner_coords')
+
+def _clone(comp,state,stls,splines): 
+    """returns a copy of comp with its own copies of the attributes in state,
+    clones of its stls and shallow copies of its b-splines, which keep their
+    bases but get their own controls. Everything else is shared, with arrays
+    made read-only, so neither copy can change them under the other"""
+    memo = {}
+    for attr,value in comp.__dict__.iteritems(): 
+        if attr in state: 
+            continue
+        if attr in stls: 
+            memo[id(value)] = value.clone()
+        elif attr in splines: 
+            memo[id(value)] = copy.copy(value)
+        else: 
+            if isinstance(value,np.ndarray): 
+                value.flags.writeable = False
+            memo[id(value)] = value
+    return copy.deepcopy(comp,memo)
+
+def _curve_constraints(Dx,x,Dy,y,x_scale,y_scale): 
+    """returns the slope dy/dx and the curvature of the curve whose first and
+    second derivatives along t are Dx[0].x, Dx[1].x and Dy[0].y, Dy[1].y, 
+    with y scaled by y_scale, and the exact derivatives of both with respect
+    to x/x_scale and y, as (slope, dslope_dx, dslope_dy, curvature, 
+    dcurvature_dx, dcurvature_dy)"""
+    dx,ddx = np.dot(Dx[0],x),np.dot(Dx[1],x)
+    dy,ddy = y_scale*np.dot(Dy[0],y),y_scale*np.dot(Dy[1],y)
+
+    slope = dy/dx
+    dslope_dx = (-dy/dx**2)[:,np.newaxis]*Dx[0]*x_scale
+    dslope_dy = (1./dx)[:,np.newaxis]*Dy[0]*y_scale
+
+    speed2 = dx**2+dy**2
+    den = speed2**1.5
+    num = dx*ddy-dy*ddx
+    curvature = num/den
+    dk_ddx = ddy/den-3*num*dx/speed2**2.5
+    dk_dddx = -dy/den
+    dk_ddy = -ddx/den-3*num*dy/speed2**2.5
+    dk_dddy = dx/den
+    dcurvature_dx = (dk_ddx[:,np.newaxis]*Dx[0]+dk_dddx[:,np.newaxis]*Dx[1])*x_scale
+    dcurvature_dy = (dk_ddy[:,np.newaxis]*Dy[0]+dk_dddy[:,np.newaxis]*Dy[1])*y_scale
+
+    return slope,dslope_dx,dslope_dy,curvature,dcurvature_dx,dcurvature_dy
+
+def _changed_controls(delta_C,old_delta_C): 
+    """returns the indices of the control points that moved"""
+    return np.nonzero(np.any(delta_C!=old_delta_C,axis=1))[0]
+
+def _support_rows(splines,changed): 
+    """returns the points moved by the changed control points of each of the
+    given b-splines, which are all on the same points"""
+    rows = [bs.support(c) for bs,c in zip(splines,changed) if len(c)]
+    return rows[0] if len(rows) == 1 else np.unique(np.hstack(rows))
+
+def _update_rows(P_bar,P_bar_cart,rows,X,R,sin_theta,cos_theta): 
+    """sets the deformed coordinates of some of the points of a surface"""
+    P_bar[rows,0] = X
+    P_bar[rows,1] = R
+    P_bar_cart[rows] = revolve(X,R,sin_theta[rows],cos_theta[rows])
+
+
 class Body(object): 
     """FFD class for solid bodies which only have one surface""" 
+
+    #storage type of the points, basis and derivatives, see set_precision
+    dtype = np.dtype(np.float64)
+    _fingerprint = None #memo of fingerprint
     
+    @tracks_construction
     def __init__(self,stl,controls,name="body", r_ref=None, x_ref=None): 
         """stl must be an STL object"""
 
@@ -59,6 +166,7 @@ class Body(object):
             self.n_controls = len(controls)
         self.C_bar = self.C.copy()
         self.delta_C = np.zeros(self.C.shape)
+
         self.bs = Bspline(self.C,geom_points)
 
         self.name = name
@@ -81,34 +189,121 @@ class Body(object):
 
         #sgrab the theta values from the points 
         self.Theta = self.P[:,2]
-        #this is too complex. shouldn't need to tile, then flatten later.
-        self.sin_theta = np.tile(np.sin(self.Theta),(self.n_controls,1)).T.flatten()
-        self.cos_theta = np.tile(np.cos(self.Theta),(self.n_controls,1)).T.flatten()
-        # self.sin_theta = np.tile(np.sin(self.Theta),self.n_controls)
-        # self.cos_theta = np.tile(np.cos(self.Theta),self.n_controls)
+        self.sin_Theta = np.sin(self.Theta)
+        self.cos_Theta = np.cos(self.Theta)
 
-        #calculate derivatives
-        #in polar coordinates
-        self.dP_bar_xqdC = np.array(self.x_mag*self.bs.B.flatten())
-        self.dP_bar_rqdC = np.array(self.r_mag*self.bs.B.flatten())
+        self._calc_derivatives()
 
-        #Project Polar derivatives into revolved cartisian coordinates
-        self.dXqdC = self.dP_bar_xqdC.reshape(-1,self.n_controls)
-        self.dYqdC = (self.dP_bar_rqdC*self.sin_theta).reshape(-1,self.n_controls)
-        self.dZqdC = (self.dP_bar_rqdC*self.cos_theta).reshape(-1,self.n_controls)
+    def _calc_derivatives(self): 
+        #calculate derivatives
+        #in polar coordinates, one row per axial station of the b-spline. They
+        #are only expanded to the points, and projected into revolved cartesian
+        #coordinates, when jacobians is called
+        self.dP_bar_xqdC = np.array(self.x_mag*self.bs.B_stations,dtype=self.dtype)
+        self.dP_bar_rqdC = np.array(self.r_mag*self.bs.B_stations,dtype=self.dtype)
+
+    def set_precision(self,dtype=np.float32): 
+        """stores the undeformed points, the b-spline basis and the derivatives
+        in dtype, which with float32 halves their memory and the bandwidth of 
+        the products with them. The products of the basis with the control 
+        points, and the radial motion of the points, are done in dtype too; 
+        each product only sums over the few control points that reach a 
+        point, so that costs no more accuracy than the storage does. The 
+        deformed points, and their revolution to cartesian coordinates, are 
+        kept in float64. Going back to float64 does not bring back the digits
+        that were dropped"""
+        self.dtype = np.dtype(dtype)
+        self._fingerprint = None
+        self.bs = _cast_spline(self.bs,dtype)
+        self.P = self.P.astype(dtype)
+        self.P_cart = self.P_cart.astype(dtype)
+        self.Theta = self.P[:,2]
+        self.sin_Theta = self.sin_Theta.astype(dtype)
+        self.cos_Theta = self.cos_Theta.astype(dtype)
+        self._calc_derivatives()
+        #the deformed points are from the old basis, so deform_local has to
+        #start over with a full deform
+        self.P_bar_cart = None
+
+    def refine(self,knots=(),elevate=0): 
+        """adds control points without changing the shape of the body, by 
+        inserting the given knots and raising the degree of the b-spline by 
+        elevate. The new basis comes from the old one, so nothing is solved 
+        for the points again. Returns the matrix that maps the old control 
+        points onto the new ones"""
+        self._fingerprint = None
+        self.bs,A = _refine_spline(self.bs,knots,elevate)
+        if self.dtype != np.float64: 
+            self.bs = _cast_spline(self.bs,self.dtype)
+        self.C = np.dot(A,self.C)
+        self.n_controls = len(self.C)
+        self.delta_C = np.dot(A,self.delta_C)
+        self.C_bar = self.C+self.delta_C
+        self._calc_derivatives()
+        return A
+
+    def displacement_constraints(self,delta_C=None,t=None): 
+        """returns the slope and the curvature of the radial displacement 
+        curve of the FFD: r_mag times the r of the b-spline through the moved
+        control points, against its x, which is the deformed x of the points.
+        This is not the slope of the deformed surface profile, which adds the 
+        slope of the undeformed surface to it, but a smooth displacement keeps
+        a smooth surface smooth. They are taken at the parameters t of the 
+        b-spline, or at its axial stations if t is not given, for the motion 
+        delta_C of the control points, or the current one if not given. Each 
+        comes in a (values, jacobian) pair under 'displacement_slope' and 
+        'displacement_curvature', with the jacobian taken with respect to the
+        X then the R parameters"""
+        if delta_C is None: 
+            C_bar = self.C_bar
+        else: 
+            C_bar = self.C+delta_C*(self.x_mag,1.)
+        if t is None: 
+            t = np.sort(self.bs.station_t)
+
+        D = (self.bs.basis(t,1),self.bs.basis(t,2))
+        slope,dsdx,dsdr,curvature,dkdx,dkdr = _curve_constraints(D,C_bar[:,0],D,C_bar[:,1],
+                                                                 self.x_mag,self.r_mag)
+        return {'displacement_slope': (slope,np.hstack((dsdx,dsdr))),
+                'displacement_curvature': (curvature,np.hstack((dkdx,dkdr)))}
+
+    def jacobians(self): 
+        """returns the derivatives of the x,y,z coordinates of every point
+        with respect to the control points, as three new n_points x n_controls 
+        arrays, expanded from the per-station derivatives"""
+        rows = self.bs.station_index
+        dR = self.dP_bar_rqdC[rows]
+        return self.dP_bar_xqdC[rows],dR*self.sin_Theta[:,np.newaxis],dR*self.cos_Theta[:,np.newaxis]
+
+    def memory_report(self): 
+        """returns the bytes held by each array of this component and of its
+        stl and b-spline objects, see memory.report"""
+        return report(self)
 
     def copy(self): 
         return copy.deepcopy(self)
 
+    def clone(self): 
+        """returns a copy that shares everything but the deformed state with
+        this body, read-only: the undeformed points, the b-spline basis, the 
+        angles and the derivatives. The stl is cloned too. Much cheaper than 
+        copy, for keeping many design variants of one body"""
+        new = _clone(self,_BODY_STATE,('stl',),('bs',))
+        if getattr(self,'P_bar_cart',None) is not None: 
+            new.Xo,new.Yo,new.Zo = new.P_bar_cart.T
+            if self.stl.points is self.P_bar_cart: 
+                new.stl.points = new.P_bar_cart
+        return new
+
     def deform(self,delta_C): 
         """returns new point locations for the given motion of the control 
         points""" 
-        self.delta_C = delta_C  
+        self.delta_C = delta_C.copy()
         self.delta_C[:,0] = self.delta_C[:,0]*self.x_mag
         self.C_bar = self.C+self.delta_C
         delta_P = self.bs.calc(self.C_bar)
 
-        self.P_bar = self.P.copy()
+        self.P_bar = self.P.astype(np.float64)
         self.P_bar[:,0] = delta_P[:,0]
         self.P_bar[:,1] = self.P[:,1]+self.r_mag*delta_P[:,1]
 
@@ -124,14 +319,87 @@ class Body(object):
 
         return self.P_bar
 
+    def deform_local(self,delta_C): 
+        """same as deform, but only re-evaluates the points in the support of
+        the control points that moved since the last deform, so moving one 
+        control point costs in proportion to the points it reaches. The 
+        deformed points are updated in place"""
+        if getattr(self,'P_bar_cart',None) is None: 
+            return self.deform(delta_C)
+
+        delta_C = delta_C*(self.x_mag,1.)
+        changed = _changed_controls(delta_C,self.delta_C)
+        self.delta_C = delta_C
+        self.C_bar = self.C+self.delta_C
+        if not len(changed): 
+            return self.P_bar
+
+        rows = _support_rows((self.bs,),(changed,))
+        delta_P = self.bs.evaluate_rows(self.C_bar,rows)
+        _update_rows(self.P_bar,self.P_bar_cart,rows,delta_P[:,0],
+                     self.P[rows,1]+self.r_mag*delta_P[:,1],self.sin_Theta,self.cos_Theta)
+
+        return self.P_bar
+
+    def evaluate(self,delta_C,out=None): 
+        """returns the cartesian point locations for the given motion of the
+        control points, without changing delta_C, the body or its stl. The result
+        is written to out, if given, so many designs can be evaluated at once
+        from one body"""
+        C_bar = self.C+delta_C*(self.x_mag,1.)
+        delta_P = self.bs.evaluate(C_bar)
+
+        R = self.P[:,1]+self.r_mag*delta_P[:,1]
+        return revolve(delta_P[:,0],R,self.sin_Theta,self.cos_Theta,out)
+
+    def fingerprint(self): 
+        """returns a digest of everything the deformed points depend on, other
+        than the motion of the control points: the undeformed points, the 
+        control points, the scales, the b-spline basis and the storage dtype. 
+        Deformed states are only interchangeable between components with the
+        same fingerprint"""
+        if self._fingerprint is None: 
+            self._fingerprint = digest(str(self.dtype),self.bs.basis_key,self.P,self.C,
+                                       [self.x_mag,self.r_mag])
+        return self._fingerprint
+
+    def deformed_state(self):
+        """returns the deformed points, cylindrical and cartesian, stacked into
+        one (2,n_points,3) array"""
+        return np.array((self.P_bar, self.P_bar_cart))
+
+    def restore(self, delta_C, state):
+        """sets the deformed geometry for the given motion of the control
+        points from a state returned by deformed_state, without re-evaluating
+        the b-spline"""
+        self.delta_C = delta_C.copy()
+        self.delta_C[:,0] = self.delta_C[:,0]*self.x_mag
+        self.C_bar = self.C+self.delta_C
+
+        self.P_bar = state[0].copy()
+        self.P_bar_cart = state[1].copy()
+        self.Xo = self.P_bar_cart[:,0]
+        self.Yo = self.P_bar_cart[:,1]
+        self.Zo = self.P_bar_cart[:,2]
+
+        self.stl.update_points(self.P_bar_cart)
+
+        return self.P_bar
+
 
                     
         
 class Shell(object): 
     """FFD class for shell bodies which have two connected surfaces"""
+
+    #storage type of the points, basis and derivatives, see set_precision
+    dtype = np.dtype(np.float64)
+    _fingerprint = None #memo of fingerprint
     
+    @tracks_construction
     def __init__(self, outer_stl, inner_stl, center_line_controls,
         thickness_controls, name='shell', r_ref=None, x_ref=None): 
+        """outer_stl and inner_stl must be STL objects"""
 
         self.outer_stl = outer_stl
         self.inner_stl = inner_stl
@@ -208,45 +476,143 @@ class Shell(object):
 
 
         self.outer_theta = self.Po[:,2]
-        self.sin_outer_c_theta = np.tile(np.sin(self.outer_theta),(self.n_c_controls,1)).T.flatten()
-        self.cos_outer_c_theta = np.tile(np.cos(self.outer_theta),(self.n_c_controls,1)).T.flatten()
-        self.sin_outer_t_theta = np.tile(np.sin(self.outer_theta),(self.n_t_controls,1)).T.flatten()
-        self.cos_outer_t_theta = np.tile(np.cos(self.outer_theta),(self.n_t_controls,1)).T.flatten()
-
+        self.sin_outer_theta = np.sin(self.outer_theta)
+        self.cos_outer_theta = np.cos(self.outer_theta)
         self.inner_theta = self.Pi[:,2]
-        self.sin_inner_c_theta = np.tile(np.sin(self.inner_theta),(self.n_c_controls,1)).T.flatten()
-        self.cos_inner_c_theta = np.tile(np.cos(self.inner_theta),(self.n_c_controls,1)).T.flatten()
-        self.sin_inner_t_theta = np.tile(np.sin(self.inner_theta),(self.n_t_controls,1)).T.flatten()
-        self.cos_inner_t_theta = np.tile(np.cos(self.inner_theta),(self.n_t_controls,1)).T.flatten()
-
-        #calculate derivatives
-        #in polar coordinates
-        self.dPo_bar_xqdCc = np.array(self.x_mag*self.bsc_o.B.flatten())
-        self.dPo_bar_rqdCc = np.array(self.r_mag*self.bsc_o.B.flatten())
-
-        self.dPi_bar_xqdCc = np.array(self.x_mag*self.bsc_i.B.flatten())
-        self.dPi_bar_rqdCc = np.array(self.r_mag*self.bsc_i.B.flatten())
+        self.sin_inner_theta = np.sin(self.inner_theta)
+        self.cos_inner_theta = np.cos(self.inner_theta)
 
-        self.dPo_bar_rqdCt = np.array(self.r_mag*self.bst_o.B.flatten())
-        self.dPi_bar_rqdCt = -1*np.array(self.r_mag*self.bst_i.B.flatten())
+        self._calc_derivatives()
 
-        #Project Polar derivatives into revolved cartisian coordinates
-        self.dXoqdCc = self.dPo_bar_xqdCc.reshape(-1,self.n_c_controls)
-        self.dYoqdCc = (self.dPo_bar_rqdCc*self.sin_outer_c_theta).reshape(-1,self.n_c_controls)
-        self.dZoqdCc = (self.dPo_bar_rqdCc*self.cos_outer_c_theta).reshape(-1,self.n_c_controls)
+    def _calc_derivatives(self): 
+        #calculate derivatives
+        #in polar coordinates, one row per axial station, see Body._calc_derivatives
+        self.dPo_bar_xqdCc = np.array(self.x_mag*self.bsc_o.B_stations,dtype=self.dtype)
+        self.dPo_bar_rqdCc = np.array(self.r_mag*self.bsc_o.B_stations,dtype=self.dtype)
+
+        self.dPi_bar_xqdCc = np.array(self.x_mag*self.bsc_i.B_stations,dtype=self.dtype)
+        self.dPi_bar_rqdCc = np.array(self.r_mag*self.bsc_i.B_stations,dtype=self.dtype)
+
+        self.dPo_bar_rqdCt = np.array(self.r_mag*self.bst_o.B_stations,dtype=self.dtype)
+        self.dPi_bar_rqdCt = -1*np.array(self.r_mag*self.bst_i.B_stations,dtype=self.dtype)
+
+    def set_precision(self,dtype=np.float32): 
+        """stores the undeformed points, the b-spline bases and the derivatives
+        in dtype, see Body.set_precision"""
+        self.dtype = np.dtype(dtype)
+        self._fingerprint = None
+        self.bsc_o = _cast_spline(self.bsc_o,dtype)
+        self.bsc_i = _cast_spline(self.bsc_i,dtype)
+        self.bst_o = _cast_spline(self.bst_o,dtype)
+        self.bst_i = _cast_spline(self.bst_i,dtype)
+        self.Po,self.Pi = self.Po.astype(dtype),self.Pi.astype(dtype)
+        self.Po_cart,self.Pi_cart = self.Po_cart.astype(dtype),self.Pi_cart.astype(dtype)
+        self.outer_theta = self.Po[:,2]
+        self.inner_theta = self.Pi[:,2]
+        self.sin_outer_theta = self.sin_outer_theta.astype(dtype)
+        self.cos_outer_theta = self.cos_outer_theta.astype(dtype)
+        self.sin_inner_theta = self.sin_inner_theta.astype(dtype)
+        self.cos_inner_theta = self.cos_inner_theta.astype(dtype)
+        self._calc_derivatives()
+        self.Po_bar_cart = None #see Body.set_precision
+
+    def refine(self,knots=(),elevate=0): 
+        """adds control points to both the center-line and the thickness 
+        b-splines without changing the shape of the shell, by inserting the
+        given knots and raising their degree by elevate. Returns the matrices 
+        that map the old center-line and thickness control points onto the 
+        new ones"""
+        self._fingerprint = None
+        self.bsc_o,Ac = _refine_spline(self.bsc_o,knots,elevate)
+        self.bsc_i,_ = _refine_spline(self.bsc_i,knots,elevate)
+        self.bst_o,At = _refine_spline(self.bst_o,knots,elevate)
+        self.bst_i,_ = _refine_spline(self.bst_i,knots,elevate)
+        if self.dtype != np.float64: 
+            for attr in ('bsc_o','bsc_i','bst_o','bst_i'): 
+                setattr(self,attr,_cast_spline(getattr(self,attr),self.dtype))
+
+        self.Cc = np.dot(Ac,self.Cc)
+        self.n_c_controls = len(self.Cc)
+        self.delta_Cc = np.dot(Ac,self.delta_Cc)
+        self.Cc_bar = self.Cc+self.delta_Cc
 
-        self.dXiqdCc = self.dPi_bar_xqdCc.reshape(-1,self.n_c_controls)
-        self.dYiqdCc = (self.dPi_bar_rqdCc*self.sin_inner_c_theta).reshape(-1,self.n_c_controls)
-        self.dZiqdCc = (self.dPi_bar_rqdCc*self.cos_inner_c_theta).reshape(-1,self.n_c_controls)
+        self.Ct = np.dot(At,self.Ct)
+        self.n_t_controls = len(self.Ct)
+        self.delta_Ct = np.dot(At,self.delta_Ct)
+        self.Ct_bar = self.Ct+self.delta_Ct
 
-        self.dYoqdCt = (self.dPo_bar_rqdCt*self.sin_outer_t_theta).reshape(-1,self.n_t_controls)
-        self.dZoqdCt = (self.dPo_bar_rqdCt*self.cos_outer_t_theta).reshape(-1,self.n_t_controls)
-        self.dYiqdCt = (self.dPi_bar_rqdCt*self.sin_inner_t_theta).reshape(-1,self.n_t_controls)
-        self.dZiqdCt = (self.dPi_bar_rqdCt*self.cos_inner_t_theta).reshape(-1,self.n_t_controls)
+        self._calc_derivatives()
+        return Ac,At
+
+    def displacement_constraints(self,delta_Cc=None,delta_Ct=None,t=None): 
+        """returns the slope and the curvature of the radial displacement 
+        curves of the center-line and of the thickness, see 
+        Body.displacement_constraints, not of the deformed surface profiles. 
+        They are taken at the parameters t of the b-splines, or at the axial
+        stations of the outer surface if t is not given, for the given motion
+        of the control points, or the current one if not given. The thickness
+        is taken along the axial coordinate of the center-line, which is what
+        the points follow. Each comes in a (values, jacobian) pair, under 
+        'displacement_slope', 'displacement_curvature', 'thickness_slope' and
+        'thickness_curvature', with the jacobian taken with respect to the X,
+        R, then thickness parameters"""
+        Cc_bar = self.Cc_bar if delta_Cc is None else self.Cc+delta_Cc*(self.x_mag,1.)
+        Ct_bar = self.Ct_bar if delta_Ct is None else self.Ct+delta_Ct
+        if t is None: 
+            t = np.sort(self.bsc_o.station_t)
+
+        Dc = (self.bsc_o.basis(t,1),self.bsc_o.basis(t,2))
+        slope,dsdx,dsdr,curvature,dkdx,dkdr = _curve_constraints(Dc,Cc_bar[:,0],Dc,Cc_bar[:,1],
+                                                                 self.x_mag,self.r_mag)
+        zeros = np.zeros((len(t),self.n_t_controls))
+        constraints = {'displacement_slope': (slope,np.hstack((dsdx,dsdr,zeros))),
+                       'displacement_curvature': (curvature,np.hstack((dkdx,dkdr,zeros)))}
+
+        #thickness along the center-line x, so the x derivatives come from the
+        #center-line basis and the thickness ones from the thickness basis
+        Dt = (self.bst_o.basis(t,1),self.bst_o.basis(t,2))
+        slope,dsdx,dsdt,curvature,dkdx,dkdt = _curve_constraints(Dc,Cc_bar[:,0],Dt,Ct_bar[:,1],
+                                                                 self.x_mag,self.r_mag)
+        zeros = np.zeros((len(t),self.n_c_controls))
+        constraints['thickness_slope'] = (slope,np.hstack((dsdx,zeros,dsdt)))
+        constraints['thickness_curvature'] = (curvature,np.hstack((dkdx,zeros,dkdt)))
+        return constraints
+
+    def jacobians(self): 
+        """returns the derivatives of the x,y,z coordinates of every point,
+        outer surface then inner surface, with respect to the center-line 
+        control points (x,y,z) and the thickness control points (y,z), 
+        expanded from the per-station derivatives"""
+        def expand(dP_o,bs_o,dP_i,bs_i): 
+            return np.vstack((dP_o[bs_o.station_index],dP_i[bs_i.station_index]))
+        dXc = expand(self.dPo_bar_xqdCc,self.bsc_o,self.dPi_bar_xqdCc,self.bsc_i)
+        dRc = expand(self.dPo_bar_rqdCc,self.bsc_o,self.dPi_bar_rqdCc,self.bsc_i)
+        dRt = expand(self.dPo_bar_rqdCt,self.bst_o,self.dPi_bar_rqdCt,self.bst_i)
+        sin_theta = np.hstack((self.sin_outer_theta,self.sin_inner_theta))[:,np.newaxis]
+        cos_theta = np.hstack((self.cos_outer_theta,self.cos_inner_theta))[:,np.newaxis]
+        return dXc,dRc*sin_theta,dRc*cos_theta,dRt*sin_theta,dRt*cos_theta
+
+    def memory_report(self): 
+        """returns the bytes held by each array of this component and of its
+        stl and b-spline objects, see memory.report"""
+        return report(self)
 
     def copy(self): 
         return copy.deepcopy(self)
 
+    def clone(self): 
+        """returns a copy that shares everything but the deformed state with
+        this shell, read-only, see Body.clone"""
+        new = _clone(self,_SHELL_STATE,('outer_stl','inner_stl'),('bsc_o','bsc_i','bst_o','bst_i'))
+        if getattr(self,'Po_bar_cart',None) is not None: 
+            new.Xo,new.Yo,new.Zo = new.Po_bar_cart.T
+            new.Xi,new.Yi,new.Zi = new.Pi_bar_cart.T
+            if self.outer_stl.points is self.Po_bar_cart: 
+                new.outer_stl.points = new.Po_bar_cart
+            if self.inner_stl.points is self.Pi_bar_cart: 
+                new.inner_stl.points = new.Pi_bar_cart
+        return new
+
     def plot_geom(self,ax,initial_color='g',ffd_color='k'):
         if initial_color: 
             ax.scatter(self.Po[:,0],self.Po[:,1],c=initial_color,s=50,label="%s initial geom"%self.name)
@@ -274,19 +640,19 @@ class Shell(object):
         """returns new point locations for the given motion of the control 
         points for center-line and thickness"""      
         
-        self.delta_Cc = delta_Cc
+        self.delta_Cc = delta_Cc.copy()
         self.delta_Cc[:,0]*=self.x_mag
         self.Cc_bar = self.Cc+self.delta_Cc
         delta_Pc_o = self.bsc_o.calc(self.Cc_bar)
         delta_Pc_i = self.bsc_i.calc(self.Cc_bar)
         
-        self.delta_Ct = delta_Ct
+        self.delta_Ct = delta_Ct.copy()
         self.Ct_bar = self.Ct+self.delta_Ct
         delta_Pt_o = self.bst_o.calc(self.Ct_bar)
         delta_Pt_i = self.bst_i.calc(self.Ct_bar)
 
-        self.Po_bar = self.Po.copy()
-        self.Pi_bar = self.Pi.copy()
+        self.Po_bar = self.Po.astype(np.float64)
+        self.Pi_bar = self.Pi.astype(np.float64)
         
         self.Po_bar[:,0] = delta_Pc_o[:,0]
         self.Po_bar[:,1] = self.Po[:,1]+self.r_mag*(delta_Pc_o[:,1]+delta_Pt_o[:,1])
@@ -309,10 +675,111 @@ class Shell(object):
 
         #inner surface
         self.Pi_bar_cart = self.inner_coords.cartesian
-        self.Xi = self.Po_bar_cart[:,0]
-        self.Yi = self.Po_bar_cart[:,1]
-        self.Zi = self.Po_bar_cart[:,2]
+        self.Xi = self.Pi_bar_cart[:,0]
+        self.Yi = self.Pi_bar_cart[:,1]
+        self.Zi = self.Pi_bar_cart[:,2]
+
+        self.inner_stl.update_points(self.Pi_bar_cart)
+
+        return self.Po_bar,self.Pi_bar
+
+    def deform_local(self,delta_Cc,delta_Ct): 
+        """same as deform, but only re-evaluates the points in the support of
+        the control points that moved since the last deform. The deformed
+        points are updated in place"""
+        if getattr(self,'Po_bar_cart',None) is None: 
+            return self.deform(delta_Cc,delta_Ct)
+
+        delta_Cc = delta_Cc*(self.x_mag,1.)
+        changed = (_changed_controls(delta_Cc,self.delta_Cc),_changed_controls(delta_Ct,self.delta_Ct))
+        self.delta_Cc = delta_Cc
+        self.Cc_bar = self.Cc+self.delta_Cc
+        self.delta_Ct = delta_Ct.copy()
+        self.Ct_bar = self.Ct+self.delta_Ct
+        if not (len(changed[0]) or len(changed[1])): 
+            return self.Po_bar,self.Pi_bar
+
+        #outer surface
+        rows = _support_rows((self.bsc_o,self.bst_o),changed)
+        delta_Pc = self.bsc_o.evaluate_rows(self.Cc_bar,rows)
+        delta_Pt = self.bst_o.evaluate_rows(self.Ct_bar,rows)
+        _update_rows(self.Po_bar,self.Po_bar_cart,rows,delta_Pc[:,0],
+                     self.Po[rows,1]+self.r_mag*(delta_Pc[:,1]+delta_Pt[:,1]),
+                     self.sin_outer_theta,self.cos_outer_theta)
+
+        #inner surface
+        rows = _support_rows((self.bsc_i,self.bst_i),changed)
+        delta_Pc = self.bsc_i.evaluate_rows(self.Cc_bar,rows)
+        delta_Pt = self.bst_i.evaluate_rows(self.Ct_bar,rows)
+        _update_rows(self.Pi_bar,self.Pi_bar_cart,rows,delta_Pc[:,0],
+                     self.Pi[rows,1]+self.r_mag*(delta_Pc[:,1]-delta_Pt[:,1]),
+                     self.sin_inner_theta,self.cos_inner_theta)
+
+        return self.Po_bar,self.Pi_bar
+
+    def evaluate(self,delta_Cc,delta_Ct,out=None): 
+        """returns the cartesian point locations of the outer surface followed
+        by the inner surface, for the given motion of the center-line and
+        thickness control points. Nothing passed in, and nothing on the shell or
+        its stls, is changed. The result is written to out, if given"""
+        if out is None: 
+            out = np.empty((self.n_outer+self.n_inner,3))
+
+        Cc_bar = self.Cc+delta_Cc*(self.x_mag,1.)
+        Ct_bar = self.Ct+delta_Ct
+        
+        delta_Pc_o = self.bsc_o.evaluate(Cc_bar)
+        delta_Pt_o = self.bst_o.evaluate(Ct_bar)
+        R = self.Po[:,1]+self.r_mag*(delta_Pc_o[:,1]+delta_Pt_o[:,1])
+        revolve(delta_Pc_o[:,0],R,self.sin_outer_theta,self.cos_outer_theta,out[:self.n_outer])
+
+        delta_Pc_i = self.bsc_i.evaluate(Cc_bar)
+        delta_Pt_i = self.bst_i.evaluate(Ct_bar)
+        R = self.Pi[:,1]+self.r_mag*(delta_Pc_i[:,1]-delta_Pt_i[:,1])
+        revolve(delta_Pc_i[:,0],R,self.sin_inner_theta,self.cos_inner_theta,out[self.n_outer:])
+
+        return out
+
+    def fingerprint(self): 
+        """returns a digest of everything the deformed points depend on, other
+        than the motion of the control points, see Body.fingerprint"""
+        if self._fingerprint is None: 
+            keys = [bs.basis_key for bs in (self.bsc_o,self.bsc_i,self.bst_o,self.bst_i)]
+            self._fingerprint = digest(str(self.dtype),*(keys+[self.Po,self.Pi,self.Cc,self.Ct,
+                                                              [self.x_mag,self.r_mag]]))
+        return self._fingerprint
+
+    def deformed_state(self):
+        """returns the deformed points, cylindrical and cartesian, stacked into
+        one (2,n_outer+n_inner,3) array"""
+        return np.array((np.vstack((self.Po_bar, self.Pi_bar)),
+                         np.vstack((self.Po_bar_cart, self.Pi_bar_cart))))
+
+    def restore(self, delta_Cc, delta_Ct, state):
+        """sets the deformed geometry for the given motion of the center-line
+        and thickness control points from a state returned by deformed_state,
+        without re-evaluating the b-splines"""
+        self.delta_Cc = delta_Cc.copy()
+        self.delta_Cc[:,0]*=self.x_mag
+        self.Cc_bar = self.Cc+self.delta_Cc
+
+        self.delta_Ct = delta_Ct.copy()
+        self.Ct_bar = self.Ct+self.delta_Ct
+
+        n = self.n_outer
+        self.Po_bar = state[0,:n].copy()
+        self.Pi_bar = state[0,n:].copy()
+
+        self.Po_bar_cart = state[1,:n].copy()
+        self.Xo = self.Po_bar_cart[:,0]
+        self.Yo = self.Po_bar_cart[:,1]
+        self.Zo = self.Po_bar_cart[:,2]
+        self.outer_stl.update_points(self.Po_bar_cart)
 
+        self.Pi_bar_cart = state[1,n:].copy()
+        self.Xi = self.Pi_bar_cart[:,0]
+        self.Yi = self.Pi_bar_cart[:,1]
+        self.Zi = self.Pi_bar_cart[:,2]
         self.inner_stl.update_points(self.Pi_bar_cart)
 
         return self.Po_bar,self.Pi_bar
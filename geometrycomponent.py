@@ -22,8 +22,12 @@ from openmdao.lib.datatypes.api import Float
 
 # --- Local imports
 import stl as stl
+import snapshot
 from ffd_axisymetric import Body, Shell
 from stl_group import STLGroup
+from startup import build_components
+from results_store import ResultsStore
+from output_writer import OutputWriter
 
 class GeometryComp(Component):
     ''' OpenMDAO component for Geometry Handling '''
@@ -80,6 +84,20 @@ class GeometryComp(Component):
     dC4C_T = Float(0.0, low = 0.0, high = 0.0, iotype ='in', desc ='r position cowl thickness control point 5') 
     
     geom = STLGroup()
+
+    # --- Optional ResultsStore that each case is appended to, see store_results
+    results = None
+
+    # --- Optional OutputWriter that writes the output files in the background, see write_in_background
+    writer = None
+
+    # --- Storage precision of the geometry, see STLGroup.set_precision
+    precision = np.float64
+
+    # --- Design parameters, in the order of the flat parameter vector of geom
+    design_vars = ['dC%dP_X'%i for i in range(5)] + ['dC%dP_R'%i for i in range(5)] + \
+                  ['dC%dC_X'%i for i in range(5)] + ['dC%dC_R'%i for i in range(5)] + ['dC%dC_T'%i for i in range(5)] + \
+                  ['dC%dS_X'%i for i in range(5)] + ['dC%dS_R'%i for i in range(5)] + ['dC%dS_T'%i for i in range(5)]
     
     def __init__(self, *args, **kwargs):
 
@@ -92,115 +110,120 @@ class GeometryComp(Component):
 
         this_dir, this_filename = os.path.split(__file__)
         centerbody_file = os.path.join(this_dir, 'Centerbody_ASCII.stl')      
-        centerbody = stl.STL(centerbody_file)
-
         outer_cowl_file = os.path.join(this_dir, 'OuterCowl_ASCII.stl')        
-        outer_cowl = stl.STL(outer_cowl_file)
-
         inner_cowl_file = os.path.join(this_dir, 'InnerCowl_ASCII.stl')        
-        inner_cowl = stl.STL(inner_cowl_file)
-
         outer_shroud_file = os.path.join(this_dir, 'OuterShroud_ASCII.stl')
-        outer_shroud = stl.STL(outer_shroud_file)
-
         inner_shroud_file = os.path.join(this_dir, 'InnerShroud_ASCII.stl')
-        inner_shroud = stl.STL(inner_shroud_file)
-
-        print "STL Load Time: ", time.time()-start_time
-        start_time = time.time()        
-
-        n_c = 5
+        sources = [centerbody_file, outer_cowl_file, inner_cowl_file, outer_shroud_file, inner_shroud_file]
 
         C_x = np.array([0.0, 1.27, 2.54, 3.81, 8.09743]) 
         C_r = np.zeros((len(C_x),))
-        control_points = np.array(zip(C_x,C_r))
-
-        plug = Body(centerbody, controls=control_points, x_ref=0.15, r_ref=0.025)
+        plug_controls = np.array(zip(C_x,C_r))
 
         C_x = np.array([0.726, 300.0, 1.524, 2.54, 4.16007])
         C_r = np.zeros((len(C_x),))
-        control_points = np.array(zip(C_x,C_r))
-
-        cowl = Shell(outer_cowl, inner_cowl, center_line_controls=control_points, thickness_controls=control_points, x_ref=0.15, r_ref=0.02)
+        cowl_controls = np.array(zip(C_x,C_r))
 
         C_x = np.array([0.0, 0.762, 1.524, 2.54, 3.80468])
         C_r = np.zeros((len(C_x),))
-        control_points = np.array(zip(C_x,C_r))        
-        
-        shroud = Shell(outer_shroud, inner_shroud, center_line_controls=control_points, thickness_controls=control_points, x_ref=0.15, r_ref=0.02)
-
-        print "Bspline Compute Time: ", time.time()-start_time
+        shroud_controls = np.array(zip(C_x,C_r))        
+
+        specs = [
+            ('plug', Body, [centerbody_file], 
+                dict(controls=plug_controls, x_ref=0.15, r_ref=0.025)),
+            ('cowl', Shell, [outer_cowl_file, inner_cowl_file], 
+                dict(center_line_controls=cowl_controls, thickness_controls=cowl_controls, x_ref=0.15, r_ref=0.02)),
+            ('shroud', Shell, [outer_shroud_file, inner_shroud_file], 
+                dict(center_line_controls=shroud_controls, thickness_controls=shroud_controls, x_ref=0.15, r_ref=0.02)),
+        ]
+        build = (specs, np.dtype(self.precision).name)
+
+        # --- Warm start from a snapshot of the fully built geometry, if it is up to date
+        # --- with both the STL files and the way the components are built here
+        snapshot_dir = os.path.join(this_dir, 'geometry.snapshot')
+        if snapshot.is_current(snapshot_dir, sources, build):
+            snapshot.load_snapshot(snapshot_dir, self.geom)
+            print "Snapshot Load Time: ", time.time()-start_time
+            return
+
+        # --- Parse the STL files and build the b-spline bases of each component concurrently
+        comps, timings = build_components(specs)
+
+        for stage, stage_time in timings.iteritems():
+            print "%s Time: "%stage, stage_time
         start_time = time.time()
 
-        self.geom.add(plug, name="plug")
-        self.geom.add(cowl, name="cowl")
-        self.geom.add(shroud, name="shroud")
+        for name, comp in comps.iteritems():
+            self.geom.add(comp, name=name)
+        if np.dtype(self.precision) != np.float64:
+            self.geom.set_precision(self.precision)
 
         print "Geometry Object Building: ", time.time()-start_time
         start_time = time.time()
-        
-    def execute(self):
-    
-        n_c = 5
-        
-        # --- Move centerbody control points
-        dCP_X = array([self.dC0P_X, self.dC1P_X, self.dC2P_X, self.dC3P_X, self.dC4P_X])
-        dCP_R = array([self.dC0P_R, self.dC1P_R, self.dC2P_R, self.dC3P_R, self.dC4P_R])
-        dCP_C = array(zip(dCP_X, dCP_R))
 
-        # --- Move shroud centerline control points
-        dCS_X = array([self.dC0S_X, self.dC1S_X, self.dC2S_X, self.dC3S_X, self.dC4S_X])
-        dCS_R = array([self.dC0S_R, self.dC1S_R, self.dC2S_R, self.dC3S_R, self.dC4S_R])
-        dCS_C = array(zip(dCS_X, dCS_R))
+        # --- The snapshot only speeds up the next start, so a read-only install goes without
+        try:
+            snapshot.save_snapshot(self.geom, snapshot_dir, sources, build)
+        except (IOError, OSError) as error:
+            print "Snapshot Not Saved: ", error
 
-        # --- Move shroud thickness control points (only in r direction)
-        dCS_X = np.zeros((n_c,))
-        dCS_R = array([self.dC0S_T, self.dC1S_T, self.dC2S_T, self.dC3S_T, self.dC4S_T])
-        dCS_T = array(zip(dCS_X, dCS_R))
+        print "Snapshot Save Time: ", time.time()-start_time
+        start_time = time.time()
+        
+    def execute(self):
+        ''' Deforms geom to the current design variables, then writes the deformed
+        STL and FEPOINT files, or appends the case to the results store if one is
+        set. Each run deforms the geometry, so the files hold the deformed shape,
+        not the undeformed one '''
 
-        # --- Move cowl centerline control points
-        dCC_X = array([self.dC0C_X, self.dC1C_X, self.dC2C_X, self.dC3C_X, self.dC4C_X])
-        dCC_R = array([self.dC0C_R, self.dC1C_R, self.dC2C_R, self.dC3C_R, self.dC4C_R])
-        dCC_C = array(zip(dCC_X, dCC_R))
+        # --- Gather the control point motions into the flat parameter vector of geom
+        dvec = np.fromiter((getattr(self, name) for name in self.design_vars),
+                           dtype=np.float64, count=len(self.design_vars))
 
-        # --- Move cowl thickness control points (only in r direction)
-        dCC_X = np.zeros((n_c,))
-        dCC_R = array([self.dC0C_T, self.dC1C_T, self.dC2C_T, self.dC3C_T, self.dC4C_T])
-        dCC_T = array(zip(dCC_X, dCC_R))
+        start_time = time.time()
 
-        # baseline_profile = self.geom.project_profile()
+        self.geom.deform_vector(dvec)
 
+        print "Run Time: ", time.time()-start_time
         start_time = time.time()
 
-        # self.geom.deform(plug=dCP_C, shroud=(dCS_C, dCS_T),cowl=(dCC_C, dCC_T))
+        if self.results is not None:
+            # --- One bulk append per case, instead of overwriting the output files
+            self.results.append(dvec, self.geom.points)
+            print "Results Store Time: ", time.time()-start_time
+            return
 
-        # print "Run Time: ", time.time()-start_time
-        # start_time = time.time()
-
-        # profile = self.geom.project_profile()        
-            
-        self.geom.writeSTL('deformed_geom.stl', ascii=True)
+        self.geom.writeSTL('deformed_geom.stl', ascii=True, writer=self.writer)
 
         print "STL Write Time: ", time.time()-start_time
         start_time = time.time()
 
-        self.geom.writeFEPOINT('model.tec.1.sd1')
+        self.geom.writeFEPOINT('model.tec.1.sd1', writer=self.writer)
 
         print "FEPOINT Write Time: ", time.time()-start_time
         start_time = time.time()
 
-        # for point_set in profile:
-        #     X = point_set[:,0]
-        #     Y = point_set[:,1]
+    def store_results(self, folder, chunk_size=64, compress=True):
+        ''' Appends every case to a ResultsStore in folder from now on, instead of
+        writing the deformed STL and FEPOINT files. Returns the store '''
+
+        self.results = ResultsStore(folder, self.geom, chunk_size, compress)
+        return self.results
+
+    def write_in_background(self, max_pending=2, processes=False):
+        ''' Writes the deformed STL and FEPOINT files on a background OutputWriter
+        from now on, so the next case can start while they are written. The files
+        are only up to date after flush_output. Returns the writer '''
 
-        #     print 'max X = ', np.max(X)
+        self.writer = OutputWriter(max_pending, processes)
+        return self.writer
 
-        #     with open('designs.txt', 'a') as f:
+    def flush_output(self):
+        ''' Waits for any output files still being written in the background '''
 
-        #         f.writelines(["%s " % item  for item in X])
-        #         f.writelines("\n")
-        #         f.writelines(["%s " % item  for item in Y])
-        #         f.writelines("\n")
+        if self.writer is not None:
+            self.writer.flush()
+            print "Output Writer Stats: ", self.writer.stats()
 
         
 if __name__ == "__main__":
@@ -0,0 +1,131 @@
+""" Named timers and counters for the stages of the FFD pipeline. Everything
+is off by default, and then costs one global check per call. Set the
+FFD_INSTRUMENT environment variable to a file name to turn it on for a whole
+run and dump the results there as JSON when the run ends """
+
+import os
+import json
+import time
+import atexit
+import threading
+from functools import wraps
+
+enabled = False
+
+_lock = threading.Lock()
+_timers = {} #name: [calls, total, min, max]
+_counters = {}
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+def disable():
+    enable(False)
+
+def reset():
+    """forgets everything recorded so far"""
+
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+
+def _record(name, elapsed):
+    with _lock:
+        try:
+            t = _timers[name]
+        except KeyError:
+            _timers[name] = [1, elapsed, elapsed, elapsed]
+        else:
+            t[0] += 1
+            t[1] += elapsed
+            if elapsed < t[2]:
+                t[2] = elapsed
+            if elapsed > t[3]:
+                t[3] = elapsed
+
+
+class _Timer(object):
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        _record(self.name, time.time()-self.start)
+        return False
+
+
+class _NullTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(name):
+    """returns a context manager that adds the time spent in it to the timer
+    called name"""
+
+    if enabled:
+        return _Timer(name)
+    return _NULL_TIMER
+
+def timed(name):
+    """decorator that adds the time spent in every call to the timer called
+    name"""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _record(name, time.time()-start)
+        return wrapper
+    return decorator
+
+def count(name, n=1):
+    """adds n to the counter called name"""
+
+    if enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0)+n
+
+
+def stats():
+    """returns a dictionary of every timer, with its number of calls and its
+    total, mean, min and max time, and of every counter"""
+
+    with _lock:
+        timers = dict((name, {'calls': calls, 'total': total, 'mean': total/calls,
+                              'min': t_min, 'max': t_max})
+                      for name, (calls, total, t_min, t_max) in _timers.iteritems())
+        counters = dict(_counters)
+    return {'timers': timers, 'counters': counters}
+
+def dump(file_name):
+    """writes stats to file_name as JSON"""
+
+    with open(file_name, 'w') as f:
+        json.dump(stats(), f, indent=2, sort_keys=True)
+
+
+_env_file = os.environ.get('FFD_INSTRUMENT')
+if _env_file:
+    enable()
+    atexit.register(dump, _env_file)
@@ -0,0 +1,183 @@
+""" Kernels for the loops that don't vectorize well: the span search and basis
+recursion of the b-splines, welding the vertices of an STL file into points,
+and remapping triangles onto the points written to an FEPOINT file.
+
+They are compiled with numba when it is installed, and the NumPy versions
+next to them are used otherwise. BACKEND says which ones are in use. Setting
+the FFD_KERNELS environment variable to numpy turns the compiled ones off """
+
+import os
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def _basis_loop(knots, degree, t, out):
+    #span search and triangular basis recursion, per t
+    n = len(knots)-degree-1
+    left = np.empty(degree+1)
+    right = np.empty(degree+1)
+    N = np.empty(degree+1)
+    for i in range(len(t)):
+        u = t[i]
+        for j in range(n):
+            out[i, j] = 0.
+        #t outside the knots has no basis functions, and t at the end of the
+        #knots goes in the last non-empty span
+        if u < knots[degree] or u > knots[n]:
+            continue
+        if u == knots[n]:
+            span = n-1
+        else:
+            lo, hi = degree, n
+            while hi-lo > 1:
+                mid = (lo+hi)//2
+                if u < knots[mid]:
+                    hi = mid
+                else:
+                    lo = mid
+            span = lo
+        N[0] = 1.
+        for j in range(1, degree+1):
+            left[j] = u-knots[span+1-j]
+            right[j] = knots[span+j]-u
+            saved = 0.
+            for r in range(j):
+                temp = N[r]/(right[r+1]+left[j-r])
+                N[r] = saved+right[r+1]*temp
+                saved = left[j-r]*temp
+            N[j] = saved
+        for r in range(degree+1):
+            out[i, span-degree+r] = N[r]
+
+def _weld_loop(keys, index, first):
+    #open addressing hash table over the bits of each vertex, so vertices are
+    #numbered in the order they are first seen
+    n = keys.shape[0]
+    size = 1
+    while size < 2*n:
+        size *= 2
+    table = np.empty(size, dtype=np.int64)
+    table[:] = -1
+    n_points = 0
+    for i in range(n):
+        h = (keys[i, 0]*1000003) ^ (keys[i, 1]*999983) ^ (keys[i, 2]*998927)
+        slot = h & (size-1)
+        while True:
+            j = table[slot]
+            if j < 0:
+                table[slot] = n_points
+                first[n_points] = i
+                index[i] = n_points
+                n_points += 1
+                break
+            k = first[j]
+            if keys[k, 0] == keys[i, 0] and keys[k, 1] == keys[i, 1] and keys[k, 2] == keys[i, 2]:
+                index[i] = j
+                break
+            slot = (slot+1) & (size-1)
+    return n_points
+
+def _remap_loop(point_ids, triangles, rows, corrected):
+    #ids index a table of where the first point with each id was written
+    table = np.empty(point_ids.max()-point_ids.min()+1, dtype=np.int64)
+    table[:] = -1
+    offset = point_ids.min()
+    new_index = np.empty(len(point_ids), dtype=np.int64)
+    n_rows = 0
+    for i in range(len(point_ids)):
+        k = point_ids[i]-offset
+        if table[k] < 0:
+            table[k] = n_rows
+            rows[n_rows] = i
+            n_rows += 1
+        new_index[i] = table[k]
+    for i in range(triangles.shape[0]):
+        for j in range(triangles.shape[1]):
+            corrected[i, j] = new_index[triangles[i, j]]
+    return n_rows
+
+
+def _weld_numpy(vertices):
+    _, first, inverse = np.unique(vertices+0., axis=0, return_index=True, return_inverse=True)
+    #number the points in the order they are first seen
+    order = np.argsort(first)
+    rank = np.empty(len(first), dtype=np.int)
+    rank[order] = np.arange(len(first))
+    return rank[inverse], first[order]
+
+def _remap_numpy(point_ids, triangles):
+    _, first, inverse = np.unique(point_ids, return_index=True, return_inverse=True)
+    written = np.zeros((len(point_ids),), dtype=bool)
+    written[first] = True
+    new_index = np.cumsum(written)-1
+    # --- Every point goes to where the first occurence of its id was written
+    return np.nonzero(written)[0], new_index[first[inverse]][triangles]
+
+
+BACKEND = 'numpy'
+_jit = {}
+
+def set_backend(name):
+    """selects the kernels to use, 'numba' or 'numpy'. Asking for numba when
+    it is not installed raises ImportError"""
+
+    global BACKEND
+    if name == 'numba':
+        if numba is None:
+            raise ImportError("the numba backend needs numba, which is not installed")
+        if not _jit:
+            for func in (_basis_loop, _weld_loop, _remap_loop):
+                _jit[func.__name__] = numba.njit(cache=True)(func)
+    elif name != 'numpy':
+        raise ValueError("unknown kernel backend '%s', use 'numba' or 'numpy'"%name)
+    BACKEND = name
+
+if numba is not None and os.environ.get('FFD_KERNELS', 'numba') != 'numpy':
+    set_backend('numba')
+
+
+def basis_matrix(knots, degree, t):
+    """returns the values of all the b-spline basis functions of the given
+    degree at each t as a len(t) x n_basis array, or None with the numpy
+    backend, where bspline.basis_functions does the work"""
+
+    if BACKEND != 'numba':
+        return None
+    knots = np.ascontiguousarray(knots, dtype=np.float64)
+    t = np.ascontiguousarray(t, dtype=np.float64)
+    out = np.empty((len(t), len(knots)-degree-1))
+    _jit['_basis_loop'](knots, degree, t, out)
+    return out
+
+def weld(vertices):
+    """numbers the distinct vertices, an n x 3 array, in the order they are
+    first seen. Returns the number of each vertex, and the row of the first
+    vertex with each number"""
+
+    vertices = np.asarray(vertices, dtype=np.float64)
+    if BACKEND != 'numba':
+        return _weld_numpy(vertices)
+    keys = np.ascontiguousarray(vertices+0.).view(np.int64) #+0. makes -0. equal to 0.
+    index = np.empty(len(vertices), dtype=np.int64)
+    first = np.empty(len(vertices), dtype=np.int64)
+    n_points = _jit['_weld_loop'](keys, index, first)
+    return index, first[:n_points]
+
+def remap(point_ids, triangles):
+    """returns the rows of the first point with each id, and the triangles
+    re-indexed to those rows"""
+
+    point_ids = np.asarray(point_ids)
+    triangles = np.asarray(triangles, dtype=np.int)
+    if BACKEND != 'numba' or not len(point_ids):
+        return _remap_numpy(point_ids, triangles)
+    rows = np.empty(len(point_ids), dtype=np.int64)
+    corrected = np.empty(triangles.shape, dtype=np.int64)
+    n_rows = _jit['_remap_loop'](np.ascontiguousarray(point_ids, dtype=np.int64),
+                                 np.ascontiguousarray(triangles, dtype=np.int64), rows, corrected)
+    return rows[:n_rows], corrected
@@ -0,0 +1,53 @@
+""" Decimated levels of detail of a surface mesh, made by vertex clustering on
+a uniform grid, for streaming a light version of the geometry to a viewer """
+
+import numpy as np
+
+
+class MeshLevel(object):
+    """one decimated level of a mesh. Points are clustered by the grid cell of
+    size cell_size they fall in, and each cluster becomes one point, at the
+    mean of its members. Triangles that collapse are dropped, and triangles
+    that end up on the same three clusters are only kept once.
+
+    The clusters come from the points the level is built with, and map any
+    later (deformed) version of those points onto the level with points()"""
+
+    def __init__(self, points, triangles, cell_size):
+
+        points = np.asarray(points, dtype=np.float64)
+        triangles = np.asarray(triangles, dtype=np.int)
+
+        self.cell_size = cell_size
+        cells = np.floor((points-points.min(axis=0))/cell_size).astype(np.int64)
+        _, self.cluster, counts = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+        self.n_points = len(counts)
+        self._counts = counts.astype(np.float64)
+
+        tris = self.cluster[triangles]
+        keep = (tris[:,0] != tris[:,1]) & (tris[:,1] != tris[:,2]) & (tris[:,2] != tris[:,0])
+        tris = tris[keep]
+        _, first = np.unique(np.sort(tris, axis=1), axis=0, return_index=True)
+        self.triangles = tris[np.sort(first)]
+
+    def points(self, points, out=None):
+        """returns the points of this level for the given full resolution
+        points, in the same order as the ones it was built with. The result
+        is written to out, if given"""
+
+        if out is None:
+            out = np.empty((self.n_points, 3))
+        for k in range(3):
+            out[:,k] = np.bincount(self.cluster, points[:,k], self.n_points)/self._counts
+        return out
+
+
+def build_levels(points, triangles, n_levels=3, coarsest=16):
+    """returns n_levels MeshLevels of a mesh, coarsest first. The coarsest has
+    cells of 1/coarsest of the largest side of the bounding box of the points,
+    and each level after it has cells half that size"""
+
+    points = np.asarray(points, dtype=np.float64)
+    extent = (points.max(axis=0)-points.min(axis=0)).max() if len(points) else 1.
+    extent = extent or 1.
+    return [MeshLevel(points, triangles, extent/(coarsest*2**i)) for i in range(n_levels)]
@@ -0,0 +1,241 @@
+""" Reports the memory held by the geometry objects, array by array and
+component by component, and the peak memory use while they were built
+when that is tracked, see track """
+
+import sys
+import mmap
+import threading
+from functools import wraps
+from contextlib import contextmanager
+from collections import OrderedDict
+
+import numpy as np
+
+#objects that are reported as parts of the object that holds them
+_PARTS = ('STL', 'Bspline', 'Body', 'Shell', 'Coordinates', 'DeformationCache')
+
+_tracking = [False] #construction memory is only tracked when asked for, see track
+_local = threading.local() #constructions in progress in each thread, so nested ones don't reset the peak
+
+
+def _process_memory():
+    """returns the current and the peak resident set size of the process in
+    bytes. The current size is None where /proc is not available"""
+
+    try:
+        sizes = {}
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(('VmRSS:', 'VmHWM:')):
+                    key, value, _ = line.split()
+                    sizes[key] = int(value)*1024
+        return sizes['VmRSS:'], sizes['VmHWM:']
+    except (IOError, KeyError):
+        import resource
+        return None, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+def _reset_peak():
+    #only Linux lets the peak be reset, elsewhere it stays the process peak
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except IOError:
+        pass
+
+
+def track(enabled=True):
+    """turns tracking of construction memory on or off for the whole process,
+    and returns whether it was on. It is off by default, since tracking resets
+    the peak resident set size of the process, which anything else reading it
+    would then see too"""
+
+    previous = _tracking[0]
+    _tracking[0] = enabled
+    return previous
+
+@contextmanager
+def tracking():
+    """tracks construction memory for the objects built in the with block"""
+
+    previous = track(True)
+    try:
+        yield
+    finally:
+        track(previous)
+
+
+def tracks_construction(init):
+    """decorator for __init__ that, while tracking is on, keeps the resident
+    memory before and after construction, and its peak during it, in
+    _construction_memory, all in bytes. The peak is only kept for the
+    outermost construction of a thread, since the ones nested in it can't tell
+    their own peak apart from it. Constructions running in other threads
+    share the process peak, so theirs overlap"""
+
+    @wraps(init)
+    def wrapper(self, *args, **kwargs):
+        if not _tracking[0]:
+            return init(self, *args, **kwargs)
+        depth = getattr(_local, 'depth', 0)
+        outermost = not depth
+        if outermost:
+            _reset_peak()
+        before, _ = _process_memory()
+        _local.depth = depth+1
+        try:
+            init(self, *args, **kwargs)
+        finally:
+            _local.depth = depth
+        after, peak = _process_memory()
+        if not outermost:
+            peak = None
+        self._construction_memory = {'before': before, 'after': after, 'peak': peak,
+                                     'peak_increase': None if peak is None or before is None else peak-before}
+    return wrapper
+
+
+def _root(a):
+    #the array that owns the memory a is a view of
+    while isinstance(a.base, np.ndarray):
+        a = a.base
+    return a
+
+def _is_mapped(a):
+    return isinstance(a, np.memmap) or isinstance(a.base, mmap.mmap)
+
+def _attr_name(obj, attr):
+    #report name mangled memos by the name they have in the class
+    prefix = "_%s__"%type(obj).__name__
+    if attr.startswith(prefix):
+        return attr[len(prefix)-2:]
+    return attr
+
+
+class _Counter(object):
+    """counts each buffer once, however many arrays and objects share it"""
+
+    def __init__(self):
+        self.seen = set()
+        self.seen_objects = set()
+        self.mapped = 0
+
+    def array(self, a):
+        root = _root(a)
+        if id(root) in self.seen:
+            return 0
+        self.seen.add(id(root))
+        if _is_mapped(root):
+            self.mapped += root.nbytes
+            return 0
+        return root.nbytes
+
+    def deep(self, value):
+        """bytes held by a container and everything in it"""
+        if isinstance(value, np.ndarray):
+            return self.array(value)
+        if id(value) in self.seen:
+            return 0
+        self.seen.add(id(value))
+        size = sys.getsizeof(value)
+        if isinstance(value, dict):
+            for k, v in value.iteritems():
+                size += self.deep(k)+self.deep(v)
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            for v in value:
+                size += self.deep(v)
+        return size
+
+
+def _is_part(value):
+    return type(value).__name__ in _PARTS and hasattr(value, '__dict__')
+
+def _report(obj, counter, skip=()):
+    if id(obj) in counter.seen_objects:
+        return {'type': type(obj).__name__, 'shared': True, 'total': 0}
+    counter.seen_objects.add(id(obj))
+
+    arrays = OrderedDict()
+    memos = OrderedDict()
+    parts = OrderedDict()
+    mapped = counter.mapped
+
+    items = [(attr, value) for attr, value in obj.__dict__.iteritems()
+             if attr not in skip and attr != '_construction_memory']
+    #owners first, so a view only counts memory that no attribute owns
+    items.sort(key=lambda item: (not isinstance(item[1], np.ndarray) or item[1].base is not None, item[0]))
+
+    for attr, value in items:
+        name = _attr_name(obj, attr)
+        if isinstance(value, np.ndarray):
+            arrays[name] = counter.array(value)
+        elif _is_part(value):
+            parts[name] = _report(value, counter)
+        elif isinstance(value, (dict, list, tuple, set)):
+            size = counter.deep(value)
+            if size:
+                memos[name] = size
+
+    total = sum(arrays.itervalues())+sum(memos.itervalues())+sum(p['total'] for p in parts.itervalues())
+    return {'type': type(obj).__name__,
+            'arrays': arrays,
+            'memos': memos,
+            'parts': parts,
+            'mapped': counter.mapped-mapped,
+            'total': total,
+            'construction': getattr(obj, '_construction_memory', None)}
+
+
+def report(obj):
+    """returns the memory held by obj, as a nested dictionary with the bytes
+    of each array and of each memo (dict or list attribute), a report for each
+    part (b-splines, stl objects, ...), and the total. Memory shared between
+    arrays or objects is only counted once, where it is first found, and memory
+    mapped arrays are counted in mapped instead of the total, since they are
+    only read in from their files as needed"""
+
+    return _report(obj, _Counter())
+
+def group_report(group):
+    """returns the report of an STLGroup, with one report per component in
+    components, and the largest construction peak of any of them, or None if
+    they were not built while tracking, see track"""
+
+    counter = _Counter()
+    components = OrderedDict((comp.name, _report(comp, counter)) for comp in group._comps)
+    result = _report(group, counter, skip=('_comps', '_i_comps'))
+    result['components'] = components
+    result['total'] += sum(c['total'] for c in components.itervalues())
+    result['mapped'] = counter.mapped
+    peaks = [peak for peak in _peaks(result) if peak is not None]
+    result['construction_peak'] = max(peaks) if peaks else None
+    return result
+
+def _peaks(result):
+    if result.get('construction'):
+        yield result['construction']['peak']
+    for child in result.get('parts', {}).values()+result.get('components', {}).values():
+        for peak in _peaks(child):
+            yield peak
+
+
+def largest(result, n=10, path=''):
+    """returns the n largest arrays and memos in a report, as (path, bytes)
+    pairs, largest first"""
+
+    entries = []
+    for kind in ('arrays', 'memos'):
+        entries.extend(("%s%s"%(path, name), size) for name, size in result.get(kind, {}).iteritems())
+    for kind in ('parts', 'components'):
+        for name, child in result.get(kind, {}).iteritems():
+            entries.extend(largest(child, None, "%s%s."%(path, name)))
+    entries.sort(key=lambda entry: -entry[1])
+    return entries[:n] if n is not None else entries
+
+def check_budget(result, max_bytes):
+    """raises MemoryError, naming the largest arrays, if a report holds more
+    than max_bytes"""
+
+    if result['total'] > max_bytes:
+        worst = ", ".join("%s: %d"%entry for entry in largest(result, 5))
+        raise MemoryError("geometry holds %d bytes, which is over the budget of %d bytes (largest are %s)"%
+                          (result['total'], max_bytes, worst))
@@ -0,0 +1,112 @@
+""" Writes output files in the background, so the next case can be deformed
+while the last one is being formatted and written """
+
+import sys
+import time
+import threading
+import Queue
+from multiprocessing import Pool
+
+import instrument
+
+
+class OutputWriterError(Exception):
+    pass
+
+
+class OutputWriter(object):
+    """runs write jobs one at a time, in the order they were submitted, on a
+    background thread. With processes, the jobs themselves run in a separate
+    process, so formatting does not compete with the caller for the GIL; the
+    jobs and their arguments then have to be picklable.
+
+    At most max_pending jobs wait in the queue. Submitting more blocks until
+    one is done, and the time spent blocked is kept in stats. An error in a
+    job is raised from the next call to submit, flush or close"""
+
+    def __init__(self, max_pending=2, processes=False):
+
+        self.max_pending = max_pending
+        self._queue = Queue.Queue(max_pending)
+        self._pool = Pool(1) if processes else None
+        self._error = None
+
+        self.n_written = 0
+        self.blocked_time = 0.0
+        self.write_time = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="OutputWriter")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                if self._error is not None: #drop the rest after a failure
+                    continue
+                func, args = job
+                start_time = time.time()
+                try:
+                    if self._pool is None:
+                        func(*args)
+                    else:
+                        self._pool.apply(func, args)
+                except Exception:
+                    self._error = sys.exc_info()
+                else:
+                    self.n_written += 1
+                    self.write_time += time.time()-start_time
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            exc_type, exc_value, tb = self._error
+            self._error = None
+            raise OutputWriterError, "%s in output writer: %s"%(exc_type.__name__, exc_value), tb
+
+    def submit(self, func, *args):
+        """queues func(*args) to run in the background. The arguments must not
+        change after this call, so pass copies of anything that will"""
+
+        self._raise_error()
+        if not self._thread.is_alive():
+            raise OutputWriterError("output writer is closed")
+
+        start_time = time.time()
+        with instrument.timer('writer.blocked'):
+            self._queue.put((func, args)) #blocks while max_pending jobs are waiting
+        self.blocked_time += time.time()-start_time
+
+    def pending(self):
+        """returns the number of jobs not finished yet"""
+        return self._queue.unfinished_tasks
+
+    def flush(self):
+        """waits for every queued job to finish"""
+
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """finishes the queued jobs and stops the writer"""
+
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        self._raise_error()
+
+    def stats(self):
+        """returns a dictionary of the work done so far"""
+
+        return {'written': self.n_written,
+                'pending': self.pending(),
+                'blocked_time': self.blocked_time,
+                'write_time': self.write_time}
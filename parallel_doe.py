@@ -0,0 +1,166 @@
+""" Runs DOE cases of an STLGroup on a pool of processes that all share one
+copy of the read-only geometry data through memory mapped files """
+
+import os
+import shutil
+import tempfile
+import cPickle
+from multiprocessing import Pool
+
+import numpy as np
+
+from bspline import Bspline
+from ffd_axisymetric import Body, Shell
+from stl_group import STLGroup, sort_profiles
+
+MANIFEST = "manifest.pkl"
+
+#attributes needed by Body.evaluate, Shell.evaluate and Bspline.evaluate
+_EVAL_ATTRS = {
+    Body: ('name', 'x_mag', 'r_mag', 'C', 'delta_C', 'P', 'sin_Theta', 'cos_Theta'),
+    Shell: ('name', 'x_mag', 'r_mag', 'n_outer', 'n_inner', 'Cc', 'Ct', 'delta_Cc', 'delta_Ct',
+            'Po', 'Pi', 'sin_outer_theta', 'cos_outer_theta', 'sin_inner_theta', 'cos_inner_theta'),
+}
+_BSPLINE_ATTRS = {
+    Body: ('bs',),
+    Shell: ('bsc_o', 'bsc_i', 'bst_o', 'bst_i'),
+}
+
+#layout of the group, needed by STLGroup.evaluate_vector
+_GROUP_ATTRS = ('param_slices', '_comp_slices', '_comp_point_slices', '_n_layout_points',
+                '_profile_rows', '_profile_splits')
+
+
+def share_geometry(geom, folder=None):
+    """writes the read-only data needed to evaluate geom into folder, one .npy
+    file per array, so worker processes can memory map it. A temporary folder
+    is made if none is given. Returns the folder"""
+
+    if folder is None:
+        folder = tempfile.mkdtemp(prefix="ffd_shared_")
+    elif not os.path.exists(folder):
+        os.makedirs(folder)
+
+    arrays = {} #b-spline bases can be shared, so only write them once
+
+    def dump(value, key):
+        if isinstance(value, np.ndarray):
+            if id(value) not in arrays:
+                file_name = "%s.npy"%key
+                np.save(os.path.join(folder, file_name), np.asarray(value))
+                arrays[id(value)] = (value, file_name)
+            return ('array', arrays[id(value)][1])
+        return ('value', value)
+
+    comps = []
+    for i, comp in enumerate(geom._comps):
+        comp_type = type(comp)
+        attrs = dict((attr, dump(getattr(comp, attr), "c%d_%s"%(i, attr)))
+                     for attr in _EVAL_ATTRS[comp_type])
+        #b-splines only keep their basis per station, and that is all evaluate needs
+        splines = dict((attr, (dump(getattr(comp, attr).B_stations, "c%d_%s_B_stations"%(i, attr)),
+                               dump(getattr(comp, attr).station_index, "c%d_%s_station_index"%(i, attr))))
+                       for attr in _BSPLINE_ATTRS[comp_type])
+        comps.append((comp_type.__name__, attrs, splines))
+
+    group = dict((attr, getattr(geom, attr)) for attr in _GROUP_ATTRS)
+    group['n_params'] = len(geom.param_vector)
+
+    with open(os.path.join(folder, MANIFEST), 'wb') as f:
+        cPickle.dump({'comps': comps, 'group': group}, f, cPickle.HIGHEST_PROTOCOL)
+
+    return folder
+
+
+def attach_geometry(folder):
+    """returns an STLGroup, with the arrays in folder memory mapped read-only,
+    that can only be used through evaluate_vector"""
+
+    with open(os.path.join(folder, MANIFEST), 'rb') as f:
+        manifest = cPickle.load(f)
+
+    arrays = {}
+
+    def load(entry):
+        kind, value = entry
+        if kind == 'array':
+            if value not in arrays:
+                arrays[value] = np.load(os.path.join(folder, value), mmap_mode='r')
+            return arrays[value]
+        return value
+
+    comp_types = {'Body': Body, 'Shell': Shell}
+    comps = []
+    for type_name, attrs, splines in manifest['comps']:
+        comp = comp_types[type_name].__new__(comp_types[type_name])
+        for attr, entry in attrs.iteritems():
+            setattr(comp, attr, load(entry))
+        for attr, (stations, index) in splines.iteritems():
+            bs = Bspline.__new__(Bspline)
+            bs.B_stations = load(stations)
+            bs.station_index = load(index)
+            setattr(comp, attr, bs)
+        comps.append(comp)
+
+    geom = STLGroup()
+    geom._comps = comps
+    geom._n_comps = len(comps)
+    geom._i_comps = dict((comp.name, i) for i, comp in enumerate(comps))
+    group = manifest['group']
+    for attr in _GROUP_ATTRS:
+        setattr(geom, attr, group[attr])
+    geom.param_vector = np.zeros((group['n_params'],))
+
+    return geom
+
+
+_worker_geom = None
+_worker_post = None
+
+def _init_worker(folder, post):
+    global _worker_geom, _worker_post
+    _worker_geom = attach_geometry(folder)
+    _worker_post = post
+
+def _run_case(vector):
+    points = _worker_geom.evaluate_vector(vector)
+    if _worker_post is None:
+        return points
+    return _worker_post(_worker_geom, points)
+
+
+def profile_post(geom, points):
+    """post for run_cases that keeps only the profile points of each case, in
+    the layout of STLGroup.project_profiles"""
+    return sort_profiles(points[geom._profile_rows], geom._profile_splits)
+
+
+def run_cases(geom, cases, n_procs=None, post=None, folder=None, chunksize=1):
+    """evaluates every parameter vector in cases on a pool of n_procs processes
+    and returns the results in case order.
+
+    geom is either an STLGroup, which gets shared for the duration of the run,
+    or a folder that was already written by share_geometry. Each result is the
+    deformed points, or post(geom, points) if post is given. post must be a
+    module level function, so it can be sent to the workers"""
+
+    cleanup = False
+    if isinstance(geom, basestring):
+        folder = geom
+    else:
+        cleanup = folder is None
+        folder = share_geometry(geom, folder)
+
+    pool = Pool(n_procs, initializer=_init_worker, initargs=(folder, post))
+    try:
+        results = pool.map(_run_case, [np.asarray(case, dtype=np.float64) for case in cases], chunksize)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        if cleanup:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    return results
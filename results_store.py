@@ -0,0 +1,169 @@
+""" Appendable store for the results of many geometry cases. The base mesh is
+kept once, and each case adds its parameter vector, the displacement of every
+point from the base mesh and the extracted profiles, in chunks of cases """
+
+import os
+import cPickle
+
+import numpy as np
+
+import instrument
+from stl_group import sort_profiles
+
+STORE_VERSION = 1
+
+MANIFEST = "manifest.pkl"
+BASE = "base.npz"
+
+COLUMNS = ('params', 'displacements', 'profiles')
+
+
+class ResultsStore(object):
+    """columnar store of DOE results in a folder. Cases are buffered in memory
+    and written out chunk_size at a time, each chunk as one shard. Compressed
+    shards are npz files, which are read a whole shard at a time. Uncompressed
+    shards are one .npy file per column, which are memory mapped on read, so
+    any case can be read without touching the others.
+
+    A folder that already holds a store is re-opened, and new cases are
+    appended after the ones in it. geom is only needed for a new store, to
+    keep its base mesh"""
+
+    def __init__(self, folder, geom=None, chunk_size=64, compress=True):
+
+        self.folder = folder
+        self.chunk_size = chunk_size
+        self.compress = compress
+
+        if os.path.exists(os.path.join(folder, MANIFEST)):
+            with open(os.path.join(folder, MANIFEST), 'rb') as f:
+                manifest = cPickle.load(f)
+            if manifest['version'] != STORE_VERSION:
+                raise ValueError("results store in '%s' has version %s, but version %d is needed"%
+                                 (folder, manifest['version'], STORE_VERSION))
+            self.shards = manifest['shards']
+        elif geom is None:
+            raise ValueError("there is no results store in '%s', and no geometry was given to start one"%folder)
+        else:
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            np.savez_compressed(os.path.join(folder, BASE),
+                                points=geom.points,
+                                triangles=np.asarray(geom.triangles),
+                                point_ids=geom.point_ids,
+                                profile_rows=geom._profile_rows,
+                                profile_splits=np.asarray(geom._profile_splits, dtype=np.int))
+            self.shards = [] #(name, number of cases, compressed)
+            self._write_manifest()
+
+        base = np.load(os.path.join(folder, BASE))
+        self.base_points = base['points']
+        self.triangles = base['triangles']
+        self.point_ids = base['point_ids']
+        self.profile_rows = base['profile_rows']
+        self.profile_splits = list(base['profile_splits'])
+
+        self._offsets = np.cumsum([0]+[n for _, n, _ in self.shards])
+        self._buffers = None
+        self._n_buffered = 0
+        self._open_shard = (None, None) #last shard read, as (name, columns)
+
+    def _write_manifest(self):
+        #write to a temp name first, so a reader never sees half a manifest
+        file_name = os.path.join(self.folder, MANIFEST)
+        with open(file_name+'.tmp', 'wb') as f:
+            cPickle.dump({'version': STORE_VERSION, 'shards': self.shards}, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(file_name+'.tmp', file_name)
+
+    def append(self, params, points):
+        """adds one case, from its parameter vector and its deformed points"""
+
+        points = np.asarray(points)
+        if points.shape != self.base_points.shape:
+            raise ValueError("expected points of shape %s, but got %s"%
+                             (self.base_points.shape, points.shape))
+        params = np.asarray(params, dtype=np.float64)
+
+        if self._buffers is None:
+            shapes = (params.shape, points.shape, (len(self.profile_rows), 3))
+            self._buffers = [np.empty((self.chunk_size,)+shape) for shape in shapes]
+
+        i = self._n_buffered
+        self._buffers[0][i] = params
+        np.subtract(points, self.base_points, self._buffers[1][i])
+        np.take(points, self.profile_rows, axis=0, out=self._buffers[2][i])
+        sort_profiles(self._buffers[2][i], self.profile_splits)
+        self._n_buffered += 1
+
+        if self._n_buffered == self.chunk_size:
+            self.flush()
+
+    @instrument.timed('write.results')
+    def flush(self):
+        """writes out the cases buffered so far as a new shard"""
+
+        n = self._n_buffered
+        if not n:
+            return
+
+        name = "shard_%05d"%len(self.shards)
+        columns = dict((column, buf[:n]) for column, buf in zip(COLUMNS, self._buffers))
+        if self.compress:
+            np.savez_compressed(os.path.join(self.folder, name+'.npz'), **columns)
+        else:
+            shard_folder = os.path.join(self.folder, name)
+            os.makedirs(shard_folder)
+            for column, values in columns.iteritems():
+                np.save(os.path.join(shard_folder, column+'.npy'), values)
+
+        self.shards.append((name, n, self.compress))
+        self._write_manifest()
+        self._offsets = np.append(self._offsets, self._offsets[-1]+n)
+        self._n_buffered = 0
+
+    close = flush
+
+    def __len__(self):
+        return int(self._offsets[-1])+self._n_buffered
+
+    def _shard(self, i_shard):
+        name, n, compressed = self.shards[i_shard]
+        if self._open_shard[0] != name:
+            if compressed:
+                shard = np.load(os.path.join(self.folder, name+'.npz'))
+                columns = dict((column, shard[column]) for column in COLUMNS)
+            else:
+                columns = dict((column, np.load(os.path.join(self.folder, name, column+'.npy'), mmap_mode='r'))
+                               for column in COLUMNS)
+            self._open_shard = (name, columns)
+        return self._open_shard[1]
+
+    def _row(self, column, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("case %d is not in the store, which has %d cases"%(i, len(self)))
+        if i >= self._offsets[-1]: #still in the buffer
+            return self._buffers[COLUMNS.index(column)][i-self._offsets[-1]]
+        i_shard = np.searchsorted(self._offsets, i, side='right')-1
+        return self._shard(i_shard)[column][i-self._offsets[i_shard]]
+
+    def params(self, i):
+        """returns the parameter vector of case i"""
+        return np.array(self._row('params', i))
+
+    def points(self, i):
+        """returns the deformed points of case i"""
+        return self.base_points+self._row('displacements', i)
+
+    def profiles(self, i):
+        """returns the profiles of case i, split by surface as in
+        STLGroup.project_profile"""
+        return np.split(np.array(self._row('profiles', i)), self.profile_splits)
+
+    def column(self, column, cases=None):
+        """returns one of params, displacements or profiles for the given
+        cases, or all of them, stacked into one array"""
+        if cases is None:
+            cases = range(len(self))
+        return np.array([self._row(column, i) for i in cases])
@@ -13,8 +13,23 @@ import pylab as p
 
 # --- OpenMDAO component imports
 from geometrycomponent import GeometryComp
+from parallel_doe import run_cases
+from results_store import ResultsStore
 
 DOE_OUT_DB = 'DOE_Output.db'
+DOE_RESULTS = 'DOE_results'
+
+# --- Geometry parameters varied by the DOE
+DOE_PARAMETERS = [
+    'dC1P_X', 'dC2P_X', 'dC3P_X', 'dC4P_X',
+    'dC1P_R', 'dC2P_R', 'dC3P_R', 'dC4P_R',
+    'dC1S_X', 'dC2S_X', 'dC3S_X', 'dC4S_X',
+    'dC1S_R', 'dC2S_R', 'dC3S_R', 'dC4S_R',
+    'dC1S_T', 'dC2S_T', 'dC3S_T',
+    'dC1C_X', 'dC2C_X', 'dC3C_X', 'dC4C_X',
+    'dC1C_R', 'dC2C_R', 'dC3C_R', 'dC4C_R',
+    'dC1C_T', 'dC2C_T', 'dC3C_T',
+]
 
 class Analysis(Assembly):
 
@@ -32,6 +47,7 @@ class Analysis(Assembly):
         # --- Instantiate Geometry Component
         # --------------------------------------------------------------------------- #  
         self.add('geometry', GeometryComp()) 
+        self.geometry.store_results(DOE_RESULTS)
 
         # 1--- Top Level Workflow
         self.driver.workflow.add(['doe_driver']) 
@@ -40,43 +56,42 @@ class Analysis(Assembly):
         # --------------------------------------------------------------------------- #
         # --- Add parameters to DOE driver 
         # --------------------------------------------------------------------------- #         
-        self.doe_driver.add_parameter('geometry.dC1P_X')
-        self.doe_driver.add_parameter('geometry.dC2P_X')
-        self.doe_driver.add_parameter('geometry.dC3P_X')
-        self.doe_driver.add_parameter('geometry.dC4P_X')
-
-        self.doe_driver.add_parameter('geometry.dC1P_R')
-        self.doe_driver.add_parameter('geometry.dC2P_R')
-        self.doe_driver.add_parameter('geometry.dC3P_R')
-        self.doe_driver.add_parameter('geometry.dC4P_R')
-
-        self.doe_driver.add_parameter('geometry.dC1S_X')
-        self.doe_driver.add_parameter('geometry.dC2S_X')
-        self.doe_driver.add_parameter('geometry.dC3S_X')
-        self.doe_driver.add_parameter('geometry.dC4S_X')
-
-        self.doe_driver.add_parameter('geometry.dC1S_R')
-        self.doe_driver.add_parameter('geometry.dC2S_R')
-        self.doe_driver.add_parameter('geometry.dC3S_R')
-        self.doe_driver.add_parameter('geometry.dC4S_R')
-       
-        self.doe_driver.add_parameter('geometry.dC1S_T')
-        self.doe_driver.add_parameter('geometry.dC2S_T')
-        self.doe_driver.add_parameter('geometry.dC3S_T')
-
-        self.doe_driver.add_parameter('geometry.dC1C_X')
-        self.doe_driver.add_parameter('geometry.dC2C_X')
-        self.doe_driver.add_parameter('geometry.dC3C_X')
-        self.doe_driver.add_parameter('geometry.dC4C_X')
-
-        self.doe_driver.add_parameter('geometry.dC1C_R')
-        self.doe_driver.add_parameter('geometry.dC2C_R')
-        self.doe_driver.add_parameter('geometry.dC3C_R')
-        self.doe_driver.add_parameter('geometry.dC4C_R')
-       
-        self.doe_driver.add_parameter('geometry.dC1C_T')
-        self.doe_driver.add_parameter('geometry.dC2C_T')
-        self.doe_driver.add_parameter('geometry.dC3C_T')        
+        for name in DOE_PARAMETERS:
+            self.doe_driver.add_parameter('geometry.%s'%name)
+
+
+def run_parallel(num_samples=5, n_procs=None, post=None, store=None):
+    ''' Runs the same DOE as Analysis, with the geometry cases evaluated on a
+    pool of n_procs processes. Returns the cases and their results in order.
+    Without post, the deformed points of each case can also be appended to a
+    ResultsStore in the folder store '''
+
+    geometry = GeometryComp()
+
+    doe = Uniform(num_samples = num_samples)
+    doe.num_parameters = len(DOE_PARAMETERS)
+
+    base = np.array([getattr(geometry, name) for name in geometry.design_vars])
+    index = [geometry.design_vars.index(name) for name in DOE_PARAMETERS]
+    low = np.array([geometry.trait(name).low for name in DOE_PARAMETERS])
+    high = np.array([geometry.trait(name).high for name in DOE_PARAMETERS])
+
+    cases = []
+    for sample in doe:
+        case = base.copy()
+        case[index] = low + np.asarray(sample)*(high-low)
+        cases.append(case)
+
+    results = run_cases(geometry.geom, cases, n_procs, post)
+
+    if store is not None and post is None:
+        store = ResultsStore(store, geometry.geom)
+        for case, points in zip(cases, results):
+            store.append(case, points)
+        store.close()
+
+    return cases, results
+
        
 if __name__ == '__main__':
     
@@ -84,34 +99,22 @@ if __name__ == '__main__':
     top_level_analysis = set_as_top(Analysis())  
     top_level_analysis.run()    
 
-    X = []
-    Y = []
+    top_level_analysis.geometry.results.close()
 
+    print 'opening results'
 
-    print 'opening file'
+    results = ResultsStore(DOE_RESULTS)
 
-    lines = [line.strip() for line in open('designs.txt')]
+    for i in range(len(results)):
+        for point_set in results.profiles(i):
+            X = point_set[:,0]
+            Y = point_set[:,1]
 
-    # print 'lines', lines
-    count = 0
-
-    for line in lines:
-        data = []
-        for i in line.split():
-            data.append(float(i))
-        
-        if count % 2 == 0:
-            X = np.array(data)
-        else:
-            Y = np.array(data)
-            
-            if count < 100*10:
+            if i < 100*10:
                 p.scatter(X,Y, c = np.random.rand(3,1), linewidth = 0.5)
             else:
                 p.plot(X,Y,c = np.random.rand(3,1), linewidth = 0.5)                
 
-        count+=1
-
 
     p.show()
 
@@ -0,0 +1,208 @@
+""" Saves a fully constructed STLGroup to a folder, and re-opens it later by
+memory mapping, to skip parsing the STL files and building the b-splines """
+
+import os
+import shutil
+import cPickle
+
+import numpy as np
+
+from stl import STL
+from bspline import Bspline
+from ffd_axisymetric import Body, Shell
+from stl_group import STLGroup
+from deform_cache import digest
+
+#bump this whenever the layout of the saved objects changes
+SNAPSHOT_VERSION = 7
+
+MANIFEST = "manifest.pkl"
+
+_CLASSES = dict((cls.__name__, cls) for cls in (STL, Bspline, Body, Shell))
+
+#memos that are cheaper to rebuild on demand than to save
+_SKIP = {'_Bspline__b_cache': dict}
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def build_digest(build):
+    """returns a digest of a description of how a geometry is built, e.g. the
+    specs given to startup.build_components, made of lists, tuples and dicts
+    of arrays, classes, strings and numbers"""
+
+    parts = []
+    def flatten(value):
+        if isinstance(value, dict):
+            for key in sorted(value):
+                parts.append(repr(key))
+                flatten(value[key])
+        elif isinstance(value, (list, tuple)):
+            parts.append("(%d"%len(value))
+            for v in value:
+                flatten(v)
+            parts.append(")")
+        elif isinstance(value, np.ndarray):
+            parts.append(value)
+        elif isinstance(value, type):
+            parts.append(value.__name__)
+        else:
+            parts.append(repr(value))
+    flatten(build)
+    return digest(*parts)
+
+
+def save_snapshot(geom, folder, sources=(), build=None):
+    """saves every component of geom, including its stl and b-spline objects,
+    into folder. The modification times of the files in sources, and a digest
+    of build, the description of how geom was built, are kept, so is_current
+    can tell when the snapshot is out of date. Raises IOError or OSError if
+    folder can't be written, without leaving anything behind"""
+
+    tmp_folder = folder.rstrip(os.sep)+'.tmp'
+    if os.path.exists(tmp_folder):
+        shutil.rmtree(tmp_folder)
+    os.makedirs(tmp_folder)
+    try:
+        _save(geom, tmp_folder, sources, build)
+    except:
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+        raise
+
+    #swap the finished snapshot in, so a reader never sees half of one
+    if os.path.exists(folder):
+        shutil.rmtree(folder)
+    os.rename(tmp_folder, folder)
+
+def _save(geom, tmp_folder, sources, build):
+    """writes the arrays and the manifest of a snapshot of geom to tmp_folder"""
+
+    objects = [] #(class name, packed __dict__), in the order they were found
+    ids = {}
+    arrays = {} #arrays shared between objects, like b-spline bases, are saved once
+
+    def pack_value(value, key):
+        if isinstance(value, list) and value and np.asarray(value).dtype.kind in 'iuf':
+            value = np.asarray(value) #index lists are saved, and re-opened, as arrays
+        if isinstance(value, np.ndarray):
+            kind = 'matrix' if isinstance(value, np.matrix) else 'array'
+            if id(value) not in arrays:
+                file_name = "%s.npy"%key
+                np.save(os.path.join(tmp_folder, file_name), np.asarray(value))
+                arrays[id(value)] = (value, file_name) #keep value alive, so its id stays unique
+            return (kind, arrays[id(value)][1])
+        if type(value).__name__ in _CLASSES:
+            return ('object', pack_object(value))
+        return ('value', value)
+
+    def pack_object(obj):
+        try:
+            return ids[id(obj)]
+        except KeyError:
+            pass
+        i = len(objects)
+        ids[id(obj)] = i
+        objects.append(None)
+
+        packed = {}
+        for attr, value in obj.__dict__.iteritems():
+            if attr in _SKIP:
+                packed[attr] = ('memo', None)
+            else:
+                packed[attr] = pack_value(value, "o%d_%s"%(i, attr))
+        objects[i] = (type(obj).__name__, packed)
+        return i
+
+    comps = [(comp.name, pack_object(comp)) for comp in geom._comps]
+
+    manifest = {
+        'version': SNAPSHOT_VERSION,
+        'objects': objects,
+        'comps': comps,
+        'param_vector': geom.param_vector.copy(),
+        'sources': dict((os.path.abspath(f), os.path.getmtime(f)) for f in sources),
+        'build': None if build is None else build_digest(build),
+    }
+    with open(os.path.join(tmp_folder, MANIFEST), 'wb') as f:
+        cPickle.dump(manifest, f, cPickle.HIGHEST_PROTOCOL)
+
+def _read_manifest(folder):
+    with open(os.path.join(folder, MANIFEST), 'rb') as f:
+        manifest = cPickle.load(f)
+    if manifest.get('version') != SNAPSHOT_VERSION:
+        raise SnapshotError("snapshot in '%s' has version %s, but version %d is needed"%
+                            (folder, manifest.get('version'), SNAPSHOT_VERSION))
+    return manifest
+
+def is_current(folder, sources=(), build=None):
+    """returns True if folder holds a snapshot of this version that was made
+    from the current versions of the files in sources, and, if build is
+    given, was built the same way, see save_snapshot"""
+
+    try:
+        manifest = _read_manifest(folder)
+    except (IOError, OSError, SnapshotError):
+        return False
+
+    if build is not None and manifest.get('build') != build_digest(build):
+        return False
+
+    saved = manifest['sources']
+    for f in sources:
+        f = os.path.abspath(f)
+        if f not in saved or not os.path.exists(f) or os.path.getmtime(f) != saved[f]:
+            return False
+    return True
+
+def load_snapshot(folder, geom=None, mmap=True):
+    """re-opens a snapshot saved by save_snapshot, adding its components to
+    geom, or to a new STLGroup if geom is not given. Returns the group.
+
+    With mmap, arrays are memory mapped copy-on-write, so they load lazily and
+    are shared between processes until one of them writes to them"""
+
+    manifest = _read_manifest(folder)
+    mmap_mode = 'c' if mmap else None
+
+    objects = [None]*len(manifest['objects'])
+    arrays = {}
+
+    def load_array(file_name):
+        if file_name not in arrays:
+            arrays[file_name] = np.load(os.path.join(folder, file_name), mmap_mode=mmap_mode)
+        return arrays[file_name]
+
+    def unpack_value(attr, entry):
+        kind, value = entry
+        if kind == 'memo':
+            return _SKIP[attr]()
+        if kind == 'array':
+            return load_array(value)
+        if kind == 'matrix':
+            return np.asmatrix(load_array(value))
+        if kind == 'object':
+            return unpack_object(value)
+        return value
+
+    def unpack_object(i):
+        if objects[i] is not None:
+            return objects[i]
+        cls_name, packed = manifest['objects'][i]
+        cls = _CLASSES[cls_name]
+        obj = cls.__new__(cls)
+        objects[i] = obj
+        for attr, entry in packed.iteritems():
+            setattr(obj, attr, unpack_value(attr, entry))
+        return obj
+
+    if geom is None:
+        geom = STLGroup()
+    fresh = not geom._comps
+    for name, i in manifest['comps']:
+        geom.add(unpack_object(i), name=name)
+    if fresh:
+        geom.set_vector(manifest['param_vector'])
+
+    return geom
@@ -0,0 +1,86 @@
+""" Builds the components of a geometry on a pool of workers. The STL files
+are all parsed concurrently, and each component's b-spline bases are built as
+soon as the surfaces it needs are loaded """
+
+import time
+from collections import OrderedDict
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+from stl import STL
+from bspline import Bspline
+
+
+def _load_stl(file_name):
+    start_time = time.time()
+    surface = STL(file_name)
+    return surface, time.time()-start_time
+
+def _share_bases(comp):
+    #an unpickled Bspline has its own, writeable, copy of its basis
+    for value in vars(comp).values():
+        if isinstance(value, Bspline):
+            value._share_basis()
+
+def _build_comp(comp_class, surfaces, kwargs):
+    start_time = time.time()
+    comp = comp_class(*surfaces, **kwargs)
+    return comp, time.time()-start_time
+
+
+def build_components(specs, n_workers=None, processes=False, poll=0.005):
+    """builds components from a list of specs, each one a tuple of
+    (name, component class, list of stl files, dict of keyword arguments).
+    The class is called with the loaded STL objects, in the order of the
+    files, followed by the keyword arguments, e.g.
+
+        ('cowl', Shell, ['OuterCowl.stl', 'InnerCowl.stl'], {'center_line_controls': C, ...})
+
+    Work runs on a thread pool, or on a process pool if processes is True.
+    Components built in other processes come back pickled, so their b-spline
+    bases are handed to the shared registry again, read-only.
+    Returns an OrderedDict of the components, in the order of specs, and an
+    OrderedDict of timings, with the time each file took to load, each
+    component took to build, and the total wall time"""
+
+    start_time = time.time()
+    pool = Pool(n_workers) if processes else ThreadPool(n_workers)
+    try:
+        loads = OrderedDict()
+        for name, comp_class, stl_files, kwargs in specs:
+            for file_name in stl_files:
+                if file_name not in loads:
+                    loads[file_name] = pool.apply_async(_load_stl, (file_name,))
+
+        #start building each component once all of its surfaces are in
+        builds = {}
+        pending = list(specs)
+        while pending:
+            for spec in list(pending):
+                name, comp_class, stl_files, kwargs = spec
+                if all(loads[f].ready() for f in stl_files):
+                    surfaces = [loads[f].get()[0] for f in stl_files]
+                    builds[name] = pool.apply_async(_build_comp, (comp_class, surfaces, kwargs))
+                    pending.remove(spec)
+            if pending:
+                time.sleep(poll)
+
+        timings = OrderedDict()
+        for file_name, result in loads.iteritems():
+            timings['load %s'%file_name] = result.get()[1]
+
+        comps = OrderedDict()
+        for name, comp_class, stl_files, kwargs in specs:
+            comps[name], timings['build %s'%name] = builds[name].get()
+            if processes:
+                _share_bases(comps[name])
+
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    timings['total'] = time.time()-start_time
+    return comps, timings
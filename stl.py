@@ -1,11 +1,15 @@
 import struct
 import copy
 import time
-import cPickle
 import os
 
 import numpy as np
 
+import instrument
+from bspline import load_pickle, dump_pickle
+from kernels import weld
+from memory import tracks_construction, report
+
 
 try:
     # Note: STLSender needs to be importable from this file for our binpub
@@ -81,6 +85,10 @@ def parse_binary_stl(f):
 class STL(object):
     """Manages the points extracted from an STL file"""
 
+    #facets shared with a clone are copied before they are written to
+    _facets_shared = False
+
+    @tracks_construction
     def __init__(self,stl_file):
         """given an stl file object, imports points and reshapes array to an
         array of n_facetsx3 points."""
@@ -99,12 +107,17 @@ class STL(object):
         pkl_folder = "pyBspline_pkl"
         pkl_file_name = os.path.join(pkl_folder,pkl_file_name)
         if not os.path.exists(pkl_folder):
-            os.mkdir(pkl_folder)
-
-        if os.path.exists(pkl_file_name):
+            try:
+                os.mkdir(pkl_folder)
+            except OSError: #made by another process in the meantime
+                pass
+
+        pkl_data = load_pickle(pkl_file_name)
+        if pkl_data is not None:
+            instrument.count('stl.pickle_loads')
             self.facets, self.stl_i0, self.stl_i1, self.p_count, self.stl_indices, \
             self.stl_i0, self.points, self.point_indices, \
-            self.triangles, self.point_ids = cPickle.load(open(pkl_file_name))
+            self.triangles, self.point_ids = pkl_data
             return
 
         ascii_stl = (stl_file.readline().strip().split()[0] == 'solid')
@@ -115,65 +128,41 @@ class STL(object):
         stl_file.seek(0)
 
         print 'Reading MASSOUD Surface File ...'
-        if ascii_stl:
-            self.facets, IDs = parse_ascii_stl(stl_file)
-        elif ascii_fepoint:
-            self.facets = parse_ascii_fepoint(stl_file)
-        else:
-            self.facets = parse_binary_stl(stl_file)
-
-        #list of points and the associated index from the facet array
-        points = []
-        stl_indices = []
-        point_indices = [] #same size as stl_indices, but points to locations in the points data
-        point_ids = []
-
-        #stl files have duplicate points, which we don't want to compute on
-        #so instead we keep a mapping between duplicates and their index in
-        #the point array
-        point_locations = {}
-        triangles = [] #used to track connectivity information
-
-        #extract the 9 points from each facet into one 3*n_facets set of (x,y,z)
-        #    points and keep track of the original indices at the same time so
-        #    I can reconstruct the stl file later
-        column = np.arange(3,12, dtype=np.int)
-        row_base = np.ones(9, dtype=np.int)
-        p_count = 0 #I'm using this to avoid calling len(points) a lot
-
-
-        for i, (facet, ids) in enumerate(zip(self.facets, IDs)):
-            row = row_base*i
-            ps = facet[3:].reshape((3,3))
-            triangle = []
-            for p,id  in zip(ps,ids):
-                t_p = tuple(p)
-                try:
-                    p_index = point_locations[t_p]
-                    point_indices.append(p_index) # --- We already have that point, so just point back to it
-                    triangle.append(p_index)
-                except KeyError:
-                    points.append(p)
-                    point_locations[t_p] = p_count
-                    point_ids.append(id)
-                    point_indices.append(p_count)
-                    triangle.append(p_count)
-                    p_count += 1
-
-            triangles.append(tuple(triangle))
-            index = np.vstack((row_base*i,column)).T.reshape((3,3,2))
-            stl_indices.extend(index)
-            
-        self.p_count = p_count
-        self.stl_indices = np.array(stl_indices)
-        self.point_ids = np.array(point_ids)
+        with instrument.timer('stl.parse'):
+            if ascii_stl:
+                self.facets, IDs = parse_ascii_stl(stl_file)
+            elif ascii_fepoint:
+                self.facets = parse_ascii_fepoint(stl_file)
+            else:
+                self.facets = parse_binary_stl(stl_file)
+        instrument.count('stl.facets', len(self.facets))
+
+        with instrument.timer('stl.weld'):
+            #stl files have duplicate points, which we don't want to compute on
+            #so instead we keep a mapping between duplicates and their index in
+            #the point array, numbering points in the order they are first seen
+            vertices = self.facets[:,3:].reshape((-1,3))
+            point_indices, first = weld(vertices)
+            points = vertices[first]
+
+            #keep track of the original (row, column) of each vertex in the
+            #facet array, so I can reconstruct the stl file later
+            n_facets = len(self.facets)
+            stl_indices = np.empty((3*n_facets,3,2), dtype=np.int)
+            stl_indices[:,:,0] = np.repeat(np.arange(n_facets), 3)[:,np.newaxis]
+            stl_indices[:,:,1] = np.tile(np.arange(3,12).reshape((3,3)), (n_facets,1))
+            triangles = point_indices.reshape((-1,3)) #used to track connectivity information
+
+        self.p_count = len(first)
+        self.stl_indices = stl_indices
+        self.point_ids = np.asarray(IDs).ravel()[first]
 
         #just need to re-shape these for the assignment call later
         self.stl_i0 = self.stl_indices[:,:,0]
         self.stl_i1 = self.stl_indices[:,:,1]
-        self.points = np.array(points)
+        self.points = points
         self.point_indices = point_indices
-        self.triangles = np.array(triangles)
+        self.triangles = triangles
 
         #pickle for efficiency, instead of re-doing the load every time
         pkl_data = (self.facets,
@@ -187,12 +176,27 @@ class STL(object):
             self.triangles,
             self.point_ids)
 
-        cPickle.dump(pkl_data,open(pkl_file_name,'w'))
+        dump_pickle(pkl_data,pkl_file_name)
 
 
     def copy(self):
         return copy.deepcopy(self)
 
+    def clone(self):
+        """returns a copy that shares the facets and the index arrays with this
+        one. The index arrays are made read-only, and the facets are copied by
+        whichever of the two calls get_facets first"""
+        for a in (self.stl_indices, self.stl_i0, self.stl_i1, self.point_indices,
+                  self.triangles, self.point_ids):
+            if isinstance(a, np.ndarray): #older pickles have some of these as lists
+                a.flags.writeable = False
+        self._facets_shared = True
+        return copy.copy(self)
+
+    def memory_report(self):
+        """returns the bytes held by each array, see memory.report"""
+        return report(self)
+
     def update_points(self,points):
         """updates the points in the object with the new set"""
 
@@ -223,6 +227,9 @@ class STL(object):
 
     def get_facets(self):
         """returns a n,3 array of facets with the x,y,z coordinates of each vertex"""
+        if self._facets_shared:
+            self.facets = self.facets.copy()
+            self._facets_shared = False
         self.facets[self.stl_i0,self.stl_i1] = self.points[self.point_indices]
         return self.facets
 
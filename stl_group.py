@@ -1,11 +1,20 @@
+import os
 import struct
 import string
+import time
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
 
+import instrument
+import kernels
+import memory
+from lod import build_levels
 from stl import ASCII_FACET, BINARY_HEADER, BINARY_FACET
 
 from ffd_axisymetric import Body, Shell
+from deform_cache import DeformationCache, digest
 
 try:
     from pyV3D.stl import STLSender
@@ -22,21 +31,142 @@ def remove_duplicates(seq):
     seen_add = seen.add
     return np.array([ x for x in seq if x not in seen and not seen_add(x)])
 
+def _file_stamp(file_name):
+    #size and modification time of a file, or None if it is not there
+    try:
+        stat = os.stat(file_name)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime
+
 def _block_diag(arrays):
     """ Create block-diagonal matrix from `arrays`. """
     result = None
     for arr in arrays:
-        arr[arr == -0] = 0  # Clean -0 for compatibilty with scipy version.
+        arr = arr+0.  # Clean -0 for compatibilty with scipy version, without changing the component's array.
         if result is None:
             result = arr
         else:
             r_rows, r_cols = result.shape
             a_rows, a_cols = arr.shape
-            result = np.vstack((np.hstack((result, np.zeros((r_rows, a_cols)))),
-                                np.hstack((np.zeros((a_rows, r_cols)), arr))))
+            result = np.vstack((np.hstack((result, np.zeros((r_rows, a_cols), dtype=result.dtype))),
+                                np.hstack((np.zeros((a_rows, r_cols), dtype=arr.dtype), arr))))
     return result
 
 
+def _ascii_stl_lines(facets):
+    """returns a list of ascii lines for the stl file """
+
+    lines = ['solid ffd_geom',]
+    for facet in facets:
+        lines.append(ASCII_FACET.format(face=facet))
+    lines.append('endsolid ffd_geom')
+    return lines
+
+def _binary_stl_data(facets):
+    """returns a string of binary binary data for the stl file"""
+
+    lines = [struct.pack(BINARY_HEADER,b'Binary STL Writer',len(facets)),]
+    for facet in facets:
+        facet = list(facet)
+        facet.append(0) #need to pad the end with a unsigned short byte
+        lines.append(struct.pack(BINARY_FACET,*facet))
+    return lines
+
+def sort_profiles(profiles, splits):
+    """sorts the points of the profile of each surface by x, in place.
+    profiles is an (n_profile_points, 3) array, or a stack of them, one per
+    design, split into surfaces at splits as in STLGroup.project_profile.
+    Returns profiles"""
+
+    for p in np.split(profiles, splits, axis=-2): #views into profiles
+        order = p[...,0].argsort(axis=-1)
+        p[...] = np.take_along_axis(p, order[...,np.newaxis], axis=-2)
+    return profiles
+
+def render_stl(facets, ascii=False):
+    """returns the STL text, or bytes, of the given facets, without the
+    header and footer of the file"""
+
+    if ascii:
+        return "\n".join([ASCII_FACET.format(face=facet) for facet in facets])
+    return "".join([struct.pack(BINARY_FACET, *(list(facet)+[0])) for facet in facets])
+
+@instrument.timed('write.stl')
+def write_stl(file_name, parts, n_facets, ascii=False):
+    """writes an STL file of n_facets facets from parts, each one either an
+    array of facets or facets already rendered by render_stl"""
+
+    parts = [part if isinstance(part, str) else render_stl(part, ascii) for part in parts]
+    parts = [part for part in parts if part]
+
+    f = open(file_name,'w')
+    if ascii:
+        f.write("\n".join(['solid ffd_geom',]+parts+['endsolid ffd_geom',]))
+    else:
+        f.write(struct.pack(BINARY_HEADER,b'Binary STL Writer',n_facets))
+        f.write("".join(parts))
+
+    f.close()
+
+def fepoint_layout(point_ids, triangles):
+    """returns the rows of the points that get written to an FEPOINT file,
+    which are the first ones with each id, and the triangles with their
+    indices corrected to the written points"""
+
+    return kernels.remap(point_ids, triangles)
+
+def render_fepoint_rows(points, point_ids, rows, jacobians):
+    """returns the FEPOINT lines of the given rows of points, with the
+    derivatives of each one from jacobians, which are (dXqdC, dYqdCr, dZqdCr,
+    dYqdCt, dZqdCt), all indexed by row"""
+
+    dXqdC, dYqdCr, dZqdCr, dYqdCt, dZqdCt = jacobians
+
+    #xyz for each parameter
+    nx = 3*dXqdC.shape[1]
+    nr = 3*dYqdCr.shape[1]
+    nt = 3*dYqdCt.shape[1]
+    j_cols =  (nx+nr+nt)
+
+    lines = []
+    for i in rows:
+        p = points[i]
+        line = "%.16f %.16f %.16f %d "%(p[0],p[1],p[2],point_ids[i]) # x,y,z,index coordinates of point
+
+        deriv_values = np.zeros((j_cols,))
+        deriv_values[:nx:3] = dXqdC[i]
+
+        #leave x as zero
+        deriv_values[nx+1:nx+nr:3] = dYqdCr[i]
+        deriv_values[nx+2:nx+nr:3] = dZqdCr[i]
+
+        #leave x as zero
+        deriv_values[nx+nr+1::3] = dYqdCt[i]
+        deriv_values[nx+nr+2::3] = dZqdCt[i]
+
+        line += " ".join(np.char.mod('%.16f',deriv_values))
+        lines.append(line)
+    return "\n".join(lines)
+
+@instrument.timed('write.fepoint')
+def write_fepoint(stream, parts):
+    """writes an FEPOINT file from parts, each one either text or a tuple of
+    the arguments of render_fepoint_rows"""
+
+    parts = [part if isinstance(part, str) else render_fepoint_rows(*part) for part in parts]
+    parts = [part for part in parts if part]
+
+    needs_close = False
+    if isinstance(stream, basestring):
+        stream = open(stream,'w')
+        needs_close = True
+
+    print >> stream, "\n".join(parts)
+    if(needs_close):
+        stream.close()
+
+
 class STLGroup(object):
 
 
@@ -53,10 +183,224 @@ class STLGroup(object):
         self.param_vals = {}
         self.param_name_map = {}
 
+        #all parameters live in one flat vector, param_name_map holds views into it
+        self.param_vector = np.zeros((0,))
+        self.param_slices = OrderedDict()
+        self._comp_slices = {}
+        self.comp_param_count = {}
+
         self._callbacks = []
 
         self._needs_linerize = True
 
+        #optional memoizing of deformed points, see enable_cache
+        self._cache = None
+        self._comp_keys = {}
+        self._written = {}
+
+        #output of frozen and undeformed components is rendered once, see freeze
+        self._frozen = set()
+        self._rendered = {}
+        self._fepoint_layout = None
+
+        #optional concurrent deformation of the components, see set_threads
+        self.n_threads = 1
+        self._pool = None
+        self.deform_timings = OrderedDict()
+
+        #only re-evaluate the points moved by the control points that changed,
+        #see set_incremental
+        self.incremental = False
+
+        #float32/int32 buffers for the viewer, and the components deformed
+        #since they were last filled, see visualization_buffers
+        self._vis_buffers = None
+        self._vis_dirty = set()
+
+        #decimated levels of each component, see build_lod
+        self._lod = None
+
+    def set_incremental(self, incremental=True):
+        """turns on incremental deformation. Each component then keeps its
+        deformed points, and only updates the ones in the support of the
+        control points that moved since the last regen, which makes optimizers
+        that move a few control points at a time much cheaper"""
+
+        self.incremental = incremental
+
+    def set_threads(self, n_threads):
+        """sets the number of threads used to deform the components
+        concurrently. With 1 thread they are deformed one after the other.
+        The components share no state, and the heavy lifting is done in numpy
+        kernels that release the GIL, so they can run side by side"""
+
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+        self.n_threads = max(1, int(n_threads))
+        if self.n_threads > 1:
+            self._pool = ThreadPool(self.n_threads)
+
+    def _timed_deform(self, task):
+        comp, deltas = task
+        start_time = time.time()
+        with instrument.timer('deform.%s'%comp.name):
+            self._deform_comp(comp, *deltas)
+        return comp.name, time.time()-start_time
+
+    @instrument.timed('deform.total')
+    def _deform_comps(self, tasks):
+        """deforms each (comp, deltas) pair in tasks, concurrently if more than
+        one thread is set. Timings are stored in deform_timings, in the order of
+        tasks regardless of which one finished first"""
+
+        start_time = time.time()
+        if self._pool is None or len(tasks) < 2:
+            timings = map(self._timed_deform, tasks)
+        else:
+            timings = self._pool.map(self._timed_deform, tasks, chunksize=1)
+
+        self.deform_timings = OrderedDict(timings)
+        self.deform_timings['total'] = time.time()-start_time
+        self._vis_dirty.update(comp.name for comp, _ in tasks)
+
+    def enable_cache(self, max_entries=64, cache_dir=None):
+        """turns on memoizing of the deformed geometry. Each component's
+        deformed points are cached by a digest of its parameters, keeping the
+        max_entries most recently used ones in memory, and all of them in
+        cache_dir if one is given"""
+
+        self._cache = DeformationCache(max_entries, cache_dir)
+        return self._cache
+
+    def disable_cache(self):
+        self._cache = None
+        self._comp_keys = {}
+        self._written = {}
+
+    def set_precision(self, dtype=np.float32):
+        """stores the points, b-spline bases and derivatives of every
+        component in dtype, see Body.set_precision, and regenerates the
+        geometry. check_precision tells what that costs in accuracy"""
+
+        for comp in self._comps:
+            comp.set_precision(dtype)
+        #cached states are keyed on the dtype too, so only the record of what
+        #was written last has to go
+        self._comp_keys = {}
+        self._written = {}
+        self._rendered = {}
+        self._needs_linerize = True
+        self.regen_model()
+
+    def check_precision(self, dtype=np.float32, vectors=None):
+        """returns the largest absolute and relative errors of the points and
+        of the jacobians of the components stored in dtype, compared to the
+        float64 ones, for each parameter vector in vectors, or the current one.
+        The group is not changed"""
+
+        if vectors is None:
+            vectors = [self.param_vector]
+
+        errors = dict.fromkeys(('points', 'points_relative', 'jacobian', 'jacobian_relative'), 0.)
+        def compare(kind, ref, test):
+            error = abs(test-ref).max()
+            errors[kind] = max(errors[kind], error)
+            errors[kind+'_relative'] = max(errors[kind+'_relative'], error/max(abs(ref).max(), 1e-300))
+
+        for comp in self._comps:
+            if comp.dtype != np.float64:
+                raise ValueError("component '%s' is already stored in %s, so there is no float64 "
+                                 "result to check against"%(comp.name, comp.dtype))
+            single = comp.copy()
+            single.set_precision(dtype)
+            for vector in vectors:
+                deltas = self._comp_deltas(comp, np.asarray(vector, dtype=np.float64))
+                compare('points', comp.evaluate(*deltas), single.evaluate(*deltas))
+            for ref, test in zip(comp.jacobians(), single.jacobians()):
+                compare('jacobian', ref, test)
+
+        return errors
+
+    def memory_report(self, max_bytes=None):
+        """returns the bytes held by each array of the group and of each of its
+        components, with the largest peak memory use seen while building them
+        if they were built while tracking, see memory.group_report. If
+        max_bytes is given, MemoryError is raised when the group holds more
+        than that"""
+
+        result = memory.group_report(self)
+        if max_bytes is not None:
+            memory.check_budget(result, max_bytes)
+        return result
+
+    def cache_stats(self):
+        """returns the hit-rate statistics of the deformation cache"""
+
+        if self._cache is None:
+            return None
+        return self._cache.stats()
+
+    def _deform_comp(self, comp, *deltas):
+        """deforms a single component, going through the cache if it is on"""
+
+        deform = comp.deform_local if self.incremental else comp.deform
+        if self._cache is None:
+            deform(*deltas)
+            return
+
+        #the fingerprint keeps apart components that share a name, but not a
+        #geometry or a storage dtype, e.g. with a cache_dir shared between runs
+        key = "%s_%s"%(comp.name, digest(comp.fingerprint(), *deltas))
+        self._comp_keys[comp.name] = key
+        state = self._cache.get(key)
+        if state is not None:
+            comp.restore(*(deltas+(state,)))
+        else:
+            deform(*deltas)
+            self._cache.put(key, comp.deformed_state())
+
+    def _state_key(self):
+        """returns a key for the current design, or None if it is not known"""
+
+        keys = []
+        for comp in self._comps:
+            try:
+                keys.append(self._comp_keys[comp.name])
+            except KeyError:
+                return None
+        return "|".join(keys)
+
+    def _already_written(self, file_name, fmt):
+        """checks if file_name still holds the current design, as left there by
+        the last write that finished, see _mark_written. Otherwise the record
+        of that write is dropped, so a write that fails, or that is left to an
+        OutputWriter, is never taken for a finished one"""
+
+        record = self._written.pop(file_name, None)
+        if record is None or self._cache is None:
+            return False
+
+        key = self._state_key()
+        if key is None or record != (key, fmt, _file_stamp(file_name)):
+            return False
+        self._written[file_name] = record
+        return True
+
+    def _mark_written(self, file_name, fmt):
+        """remembers that file_name holds the current design, and the size and
+        time of the file, so _already_written can tell when something else
+        changes or deletes it"""
+
+        if self._cache is None or not isinstance(file_name, basestring):
+            return
+
+        key = self._state_key()
+        if key is not None:
+            self._written[file_name] = (key, fmt, _file_stamp(file_name))
+
     def add(self, comp ,name=None):
         """ addes a new component to the geometry"""
 
@@ -67,186 +411,254 @@ class STLGroup(object):
         self._comps.append(comp)
         self._n_comps += 1
 
-        #rebuild the param_name_map with new comp
+        #rebuild the parameter layout and param_name_map with new comp
+        self._build_param_layout()
+        self._build_profile_layout()
+        self.list_parameters()
+        self._invoke_callbacks()
+        self._needs_linerize = True
+
+    def refine(self, name, knots=(), elevate=0):
+        """adds control points to a component without changing its shape,
+        see Body.refine and Shell.refine. The parameters of the component are
+        carried over to the new control points, and the parameter layout grows
+        to fit them"""
+
+        comp = self._comps[self._i_comps[name]]
+        deltas = self._comp_deltas(comp, self.param_vector)
+
+        maps = comp.refine(knots, elevate)
+        self._comp_keys.pop(name, None) #the refined component has a new fingerprint
+        if isinstance(comp, Body):
+            maps = (maps,)
+        deltas = [np.dot(A, delta) for A, delta in zip(maps, deltas)]
+
+        for var in ('X', 'R', 'thickness'):
+            self.param_slices.pop('%s.%s'%(name, var), None)
+        self._build_param_layout()
+        self._store_deltas(comp, *deltas)
+
         self.list_parameters()
         self._invoke_callbacks()
         self._needs_linerize = True
 
     def deform(self,**kwargs):
         """ deforms the geometry applying the new locations for the control points, given by body name"""
+        tasks = []
         for name,delta_C in kwargs.iteritems():
+            if name in self._frozen:
+                raise ValueError("component '%s' is frozen, and can not be deformed"%name)
             i = self._i_comps[name]
             comp = self._comps[i]
             if isinstance(comp,Body):
-                comp.deform(delta_C)
-            else:
-                comp.deform(*delta_C)
-            self.list_parameters()
+                delta_C = (delta_C,)
+            self._store_deltas(comp, *delta_C)
+            tasks.append((comp, tuple(delta_C)))
+        self._deform_comps(tasks)
+        self._update_points()
+
+    def _store_deltas(self, comp, *deltas):
+        """copies the control point motion of a component into the parameter vector"""
+
+        slices = self._comp_slices[comp.name]
+        self.param_vector[slices[0]] = deltas[0][:,0]
+        self.param_vector[slices[1]] = deltas[0][:,1]
+        if isinstance(comp, Shell):
+            self.param_vector[slices[2]] = deltas[1][:,1]
 
     def _build_ascii_stl(self, facets):
         """returns a list of ascii lines for the stl file """
 
-        lines = ['solid ffd_geom',]
-        for facet in facets:
-            lines.append(ASCII_FACET.format(face=facet))
-        lines.append('endsolid ffd_geom')
-        return lines
+        return _ascii_stl_lines(facets)
 
     def _build_binary_stl(self, facets):
         """returns a string of binary binary data for the stl file"""
 
-        lines = [struct.pack(BINARY_HEADER,b'Binary STL Writer',len(facets)),]
-        for facet in facets:
-            facet = list(facet)
-            facet.append(0) #need to pad the end with a unsigned short byte
-            lines.append(struct.pack(BINARY_FACET,*facet))
-        return lines
+        return _binary_stl_data(facets)
 
-    def writeSTL(self, file_name, ascii=False):
-        """outputs an STL file"""
+    def freeze(self, name, frozen=True):
+        """freezes a component in its current shape. regen_model then skips it,
+        whatever its parameters are, and its part of the output files is only
+        rendered once. Call with frozen=False to thaw it again"""
 
-        facets = []
+        if frozen:
+            self._frozen.add(name)
+        else:
+            self._frozen.discard(name)
+            for key in self._rendered.keys():
+                if key[0] == name:
+                    del self._rendered[key]
+
+    def _render_state(self, comp):
+        """returns a digest of the points of comp if its output is worth
+        keeping across cases, because it is frozen or undeformed, or None if
+        it has to be rendered every time. Undeformed points depend on what was
+        deformed before, e.g. B.C differs from the raw stl points in the last
+        digits, so a render is only reused for the very same points"""
+
+        if comp.name not in self._frozen:
+            if isinstance(comp, Body):
+                deltas = (comp.delta_C,)
+            else:
+                deltas = (comp.delta_Cc, comp.delta_Ct)
+            if any(np.any(delta) for delta in deltas):
+                return None
+        return digest(self.points[self._comp_point_slices[comp.name]])
+
+    def _rendered_part(self, comp, fmt, render, *args):
+        """returns the part of an output file for comp in the format fmt,
+        rendered once and reused while the component keeps the same state.
+        Returns None if comp has to be rendered"""
+
+        state = self._render_state(comp)
+        if state is None:
+            return None
+        key = (comp.name, fmt)
+        cached = self._rendered.get(key)
+        if cached is None or cached[0] != state:
+            cached = (state, render(*args))
+            self._rendered[key] = cached
+        return cached[1]
+
+    def writeSTL(self, file_name, ascii=False, writer=None):
+        """outputs an STL file. Frozen and undeformed components are rendered
+        once and reused. If an OutputWriter is given, the facets of the rest
+        are copied and the file is formatted and written in the background"""
+
+        if self._already_written(file_name, ('stl', ascii)):
+            return
+
+        parts = []
+        n_facets = 0
         for comp in self._comps:
             if isinstance(comp,Body):
-                facets.extend(comp.stl.get_facets())
+                stls = (comp.stl,)
             else:
-                facets.extend(comp.outer_stl.get_facets())
-                facets.extend(comp.inner_stl.get_facets())
-
-        f = open(file_name,'w')
-        if ascii:
-            lines = self._build_ascii_stl(facets)
-            f.write("\n".join(lines))
+                stls = (comp.outer_stl, comp.inner_stl)
+            for i, stl in enumerate(stls):
+                n_facets += len(stl.facets)
+                part = self._rendered_part(comp, ('stl', ascii, i), lambda: render_stl(stl.get_facets(), ascii))
+                if part is None:
+                    part = stl.get_facets()
+                    if writer is not None: #get_facets reuses its array, so the writer gets a copy
+                        part = part.copy()
+                parts.append(part)
+
+        if writer is None:
+            write_stl(file_name, parts, n_facets, ascii)
+            self._mark_written(file_name, ('stl', ascii))
         else:
-            data = self._build_binary_stl(facets)
-            f.write("".join(data))
-
-        f.close()
+            writer.submit(write_stl, file_name, parts, n_facets, ascii)
 
-    def writeFEPOINT(self, stream):
+    def writeFEPOINT(self, stream, writer=None):
         """writes out a new FEPOINT file with the given name, using the supplied points.
         derivs is of size (3,len(points),len(control_points)), giving matrices of
         X,Y,Z derivatives
 
-        jacobian should have a shape of (len(points),len(control_points))"""
-
-        self.provideJ()
-
-        lines = ['TITLE = "FFD_geom"',]
-        var_line = 'VARIABLES = "X" "Y" "Z" "ID" '
-
-
-        deriv_X_names = []
-        deriv_R_names = []
-        deriv_T_names = []
-
-        deriv_tmpl = string.Template('"dx_d${name}_${type}$i" "dy_d${name}_${type}$i" "dz_d${name}_${type}$i"')
-
-        for comp in self._comps:
-            if isinstance(comp,Body):
-                deriv_X_names.extend([deriv_tmpl.substitute({'name':comp.name,'i':str(i),'type':'X'}) for i in xrange(0,comp.n_controls)]) #x,y,z derivs for each control point
-                deriv_R_names.extend([deriv_tmpl.substitute({'name':comp.name,'i':str(i),'type':'R'}) for i in xrange(0,comp.n_controls)]) #x,y,z derivs for each control point
+        jacobian should have a shape of (len(points),len(control_points))
 
-            else:
-                deriv_X_names.extend([deriv_tmpl.substitute({'name':comp.name,'i':str(i),'type':'X'}) for i in xrange(0,comp.n_c_controls)]) #x,y,z derivs for each control point
-                deriv_R_names.extend([deriv_tmpl.substitute({'name':comp.name,'i':str(i),'type':'R'}) for i in xrange(0,comp.n_c_controls)]) #x,y,z derivs for each control point
-                deriv_T_names.extend([deriv_tmpl.substitute({'name':comp.name,'i':str(i),'type':'T'}) for i in xrange(0,comp.n_t_controls)]) #x,y,z derivs for each control point
+        Frozen and undeformed components are rendered once and reused. If an
+        OutputWriter is given, the points of the rest are copied and the file
+        is formatted and written in the background"""
 
-        var_line += " ".join(deriv_X_names)
-        var_line += " ".join(deriv_R_names)
-        var_line += " ".join(deriv_T_names)
-
-        lines.append(var_line)
+        if self._already_written(stream, 'fepoint'):
+            return
 
-        used_ids = []
-        I_index = 0
+        self.provideJ()
 
-        for i,p in enumerate(self.points):
-            if self.point_ids[i] not in used_ids:
-                used_ids.append(self.point_ids[i])
-                I_index += 1
+        if self._fepoint_layout is None:
+            var_line = 'VARIABLES = "X" "Y" "Z" "ID" '
 
-        lines.append('ZONE T = group0, I = %d, J = %d, F=FEPOINT'%(I_index, self.n_triangles)) #TODO I think this J number depends on the number of variables
 
-        #xyz for each parameter
-        nx = 3*self.dXqdC.shape[1]
-        nr = 3*self.dYqdCr.shape[1]
-        nt = 3*self.dYqdCt.shape[1]
-        j_cols =  (nx+nr+nt)
+            deriv_X_names = []
+            deriv_R_names = []
+            deriv_T_names = []
 
-        used_ids = []
+            deriv_tmpl = string.Template('"dx_d${name}_${type}$i" "dy_d${name}_${type}$i" "dz_d${name}_${type}$i"')
 
-        corrected_triangles = np.array(self.triangles) # --- Used to store repaired connectivity data. Does not remove fully duplicate connectivity lines, but this shouldn't be a problem for our case.
+            for comp in self._comps:
+                if isinstance(comp,Body):
+                    deriv_X_names.extend([deriv_tmpl.substitute({'name':comp.name,'i':str(i),'type':'X'}) for i in xrange(0,comp.n_controls)]) #x,y,z derivs for each control point
+                    deriv_R_names.extend([deriv_tmpl.substitute({'name':comp.name,'i':str(i),'type':'R'}) for i in xrange(0,comp.n_controls)]) #x,y,z derivs for each control point
 
-        for i,p in enumerate(self.points):
+                else:
+                    deriv_X_names.extend([deriv_tmpl.substitute({'name':comp.name,'i':str(i),'type':'X'}) for i in xrange(0,comp.n_c_controls)]) #x,y,z derivs for each control point
+                    deriv_R_names.extend([deriv_tmpl.substitute({'name':comp.name,'i':str(i),'type':'R'}) for i in xrange(0,comp.n_c_controls)]) #x,y,z derivs for each control point
+                    deriv_T_names.extend([deriv_tmpl.substitute({'name':comp.name,'i':str(i),'type':'T'}) for i in xrange(0,comp.n_t_controls)]) #x,y,z derivs for each control point
 
-            if self.point_ids[i] not in used_ids: # --- Make sure point is new
-                line = "%.16f %.16f %.16f %d "%(p[0],p[1],p[2],self.point_ids[i]) # x,y,z,index coordinates of point
+            var_line += " ".join(deriv_X_names)
+            var_line += " ".join(deriv_R_names)
+            var_line += " ".join(deriv_T_names)
 
-                #deriv_values = self.J[i]
-                deriv_values = np.zeros((j_cols,))
-                deriv_values[:nx:3] = self.dXqdC[i]
+            # --- Which points are written, and the triangles between them, only depend on the ids
+            rows, corrected_triangles = fepoint_layout(self.point_ids, self.triangles)
+            header = "\n".join(['TITLE = "FFD_geom"', var_line,
+                                'ZONE T = group0, I = %d, J = %d, F=FEPOINT'%(len(rows), self.n_triangles)]) #TODO I think this J number depends on the number of variables
+            footer = "\n".join(["%d %d %d %d"%(tri[0]+1,tri[1]+1,tri[2]+1,tri[2]+1) for tri in corrected_triangles]) #tecplot wants 1 bias indices
+            comp_rows = [rows[(rows >= self._comp_point_slices[comp.name].start) &
+                              (rows < self._comp_point_slices[comp.name].stop)] for comp in self._comps]
+            self._fepoint_layout = (header, footer, comp_rows, list(corrected_triangles))
 
-                #leave x as zero
-                deriv_values[nx+1:nx+nr:3] = self.dYqdCr[i]
-                deriv_values[nx+2:nx+nr:3] = self.dZqdCr[i]
+        header, footer, comp_rows, corrected_triangles = self._fepoint_layout
 
-                #leave x as zero
-                deriv_values[nx+nr+1::3] = self.dYqdCt[i]
-                deriv_values[nx+nr+2::3] = self.dZqdCt[i]
+        #the jacobians only change when components are added or refined, and
+        #then provideJ makes new arrays, so they can be shared with the writer
+        jacobians = (self.dXqdC, self.dYqdCr, self.dZqdCr, self.dYqdCt, self.dZqdCt)
 
-                line += " ".join(np.char.mod('%.16f',deriv_values))
-                lines.append(line)
-                used_ids.append(self.point_ids[i])
-                corrected_triangles[corrected_triangles==i] = len(used_ids)-1 # --- Correct triangle index
+        points = self.points if writer is None else self.points.copy()
+        parts = [header]
+        for comp, rows in zip(self._comps, comp_rows):
+            part = self._rendered_part(comp, 'fepoint', render_fepoint_rows, points, self.point_ids, rows, jacobians)
+            parts.append((points, self.point_ids, rows, jacobians) if part is None else part)
+        parts.append(footer)
 
+        if writer is None:
+            write_fepoint(stream, parts)
+            self.triangles = corrected_triangles
+            self._mark_written(stream, 'fepoint')
+        else:
+            writer.submit(write_fepoint, stream, parts)
+
+    def _build_profile_layout(self):
+        """finds the rows of points that lie on the profile of each surface, in
+        the z=0 plane. The deformation keeps points on their angles, so this
+        only needs to be done when a component is added. The rows are sorted
+        by x when the profile is projected, since an x deformation that is not
+        monotonic changes their order"""
+
+        rows = []
+        splits = [] #where each surface's profile ends
+        offset = 0
+        for comp in self._comps:
+            if isinstance(comp,Body):
+                stls = (comp.stl,)
             else:
-                corrected_triangles[corrected_triangles==i] = used_ids.index(self.point_ids[i]) # --- Reassign point index to first occurence in used_ids array if its been encountered before
-
-        self.triangles = list(corrected_triangles)
-
-        for tri in self.triangles:
-            line = "%d %d %d %d"%(tri[0]+1,tri[1]+1,tri[2]+1,tri[2]+1) #tecplot wants 1 bias indices
-            lines.append(line)
-
-
-        needs_close = False
-        if isinstance(stream, basestring):
-            stream = open(stream,'w')
-            needs_close = True
-
-        #f.write("\n".join(lines))
-        #f.close()
-
-        print >> stream, "\n".join(lines)
-        if(needs_close):
-            stream.close()
+                stls = (comp.outer_stl, comp.inner_stl)
+            for stl in stls:
+                p = stl.points
+                indecies = np.nonzero(np.logical_and(abs(p[:,2])<2E-6,abs(p[:,1])>0.0))[0]
+                rows.append(indecies+offset)
+                splits.append(len(indecies)+(splits[-1] if splits else 0))
+                offset += len(p)
+        self._profile_rows = np.hstack(rows) if rows else np.zeros((0,), dtype=np.int)
+        self._profile_splits = splits[:-1]
 
     def project_profile(self):
-        self.provideJ()
+        """returns the profile of each surface in the z=0 plane, sorted by the
+        deformed x, as a list of arrays of points"""
 
-        point_sets = []
-        for comp in self._comps:
-            if isinstance(comp,Body):
-                p = comp.stl.points
-                indecies = np.logical_and(abs(p[:,2])<2E-6,abs(p[:,1])>0.0)
-                points = p[indecies]
-                points = points[points[:,0].argsort()]
-                point_sets.append(points)
-            else:
-                p = comp.outer_stl.points
-                indecies = np.logical_and(abs(p[:,2])<2E-6,abs(p[:,1])>0.0)
-                points = p[indecies]
-                points = points[points[:,0].argsort()]
-                point_sets.append(points)
+        profiles = sort_profiles(self.points[self._profile_rows], self._profile_splits)
+        return np.split(profiles, self._profile_splits)
 
-                p = comp.inner_stl.points
-                indecies = np.logical_and(abs(p[:,2])<2E-6,abs(p[:,1])>0.0)
-                points = p[indecies]
-                points = points[points[:,0].argsort()]
-                point_sets.append(points)
+    def project_profiles(self, points):
+        """returns the profiles for many designs at once, as one
+        (n_designs, n_profile_points, 3) array, from their deformed points
+        stacked into an (n_designs, n_points, 3) array, e.g. the results of
+        evaluate_vector or of a DOE. The surfaces are split as in
+        project_profile, and each one is sorted by the deformed x of its design"""
 
-        return point_sets
+        profiles = np.take(np.asarray(points), self._profile_rows, axis=1)
+        return sort_profiles(profiles, self._profile_splits)
 
     #begin methods for OpenMDAO geometry derivatives
     def list_deriv_vars(self):
@@ -260,6 +672,7 @@ class STLGroup(object):
 
         return ins, outs
 
+    @instrument.timed('jacobian.assemble')
     def provideJ(self):
         if not self._needs_linerize:
             return
@@ -279,21 +692,22 @@ class STLGroup(object):
         t_offset = 0
         for comp in self._comps:
             if isinstance(comp, Body):
-                jx.append(comp.dXqdC)
+                dXqdC, dYqdC, dZqdC = comp.jacobians()
+                jx.append(dXqdC)
                 param_name = "%s.X"%comp.name
                 param_J_offset_map[param_name] = x_offset
                 nCx = self.comp_param_count[comp][0]
                 x_offset += nCx
 
-                jyr.append(comp.dYqdC) 
-                jzr.append(comp.dZqdC)
+                jyr.append(dYqdC) 
+                jzr.append(dZqdC)
                 param_name = "%s.R"%comp.name
                 param_J_offset_map[param_name] = yz_offset
                 nCr = self.comp_param_count[comp][1]
                 yz_offset += nCr
 
                 #zeros for thickness n_pointsx1
-                shape = comp.dXqdC.shape
+                shape = dXqdC.shape
                 param_name = "%s.thickness"%comp.name #note: this parameter does not exists, so I'll remove the columns from the jacobian
                 jyt.append(np.zeros((shape[0],1)))
                 jzt.append(np.zeros((shape[0],1)))
@@ -301,30 +715,25 @@ class STLGroup(object):
                 t_offset += 1
 
             else:
-                #inner and outer jacobians
-                #have to stack the outer and inner jacobians
-                stackX = np.vstack((comp.dXoqdCc, comp.dXiqdCc))
-                jx.append(stackX)
+                #inner and outer jacobians, stacked outer over inner
+                dXqdCc, dYqdCc, dZqdCc, dYqdCt, dZqdCt = comp.jacobians()
+                jx.append(dXqdCc)
                 param_name = "%s.X"%comp.name
                 param_J_offset_map[param_name] = x_offset
                 nCx = self.comp_param_count[comp][0]
                 x_offset += nCx
 
                 #centerline
-                stackY = np.vstack((comp.dYoqdCc, comp.dYiqdCc))
-                stackZ = np.vstack((comp.dZoqdCc, comp.dZiqdCc))
-                jyr.append(stackY) #constant tip radius
-                jzr.append(stackZ)
+                jyr.append(dYqdCc) #constant tip radius
+                jzr.append(dZqdCc)
                 param_name = "%s.R"%comp.name
                 param_J_offset_map[param_name] = yz_offset
                 nCr = self.comp_param_count[comp][1]
                 yz_offset += nCr
 
                 #thickness
-                stackY = np.vstack((comp.dYoqdCt, comp.dYiqdCt))
-                stackZ = np.vstack((comp.dZoqdCt, comp.dZiqdCt))
-                jyt.append(stackY) #constant tip radius
-                jzt.append(stackZ)
+                jyt.append(dYqdCt) #constant tip radius
+                jzt.append(dZqdCt)
                 param_name = "%s.thickness"%comp.name
                 param_J_offset_map[param_name] = t_offset
                 nCt = self.comp_param_count[comp][2]
@@ -395,134 +804,201 @@ class STLGroup(object):
     #end methods for OpenMDAO geometry derivatives
 
     #begin methods for IParametricGeometry
-    def list_parameters(self):
-        """ returns a dictionary of parameters sets key'd to component names"""
+    def _build_param_layout(self):
+        """lays out the parameters of all the components in one flat vector,
+        and computes the slice each parameter occupies in it"""
 
-        self.param_name_map = {}
-        self.comp_param_count = {}
-        params = []
-        for comp in self._comps:
-            name = comp.name
+        old_vector = self.param_vector
+        old_slices = self.param_slices
 
-            if isinstance(comp, Body):
-                val = comp.delta_C[:,0] #holds the root x constant
-                meta = {'value':val, 'iotype':'in', 'shape':val.shape,
-                'desc':"axial location of control points for the ffd"}
-                tup = ('%s.X'%name, meta)
-                params.append(tup)
-                self.param_name_map[tup[0]] = val
-                n_X = val.shape[0]
-
-                val = comp.delta_C[:,1] #holds the tip radius constant
-                meta = {'value':val, 'iotype':'in', 'shape':val.shape,
-                'desc':"radial location of control points for the ffd"}
-                tup = ('%s.R'%name, meta)
-                params.append(tup)
-                self.param_name_map[tup[0]] = val
-                n_R = val.shape[0]
-                self.comp_param_count[comp] = (n_X,n_R)
+        #the output layout of the components changes with their parameters
+        self._rendered = {}
+        self._fepoint_layout = None
+        self._vis_buffers = None
+        self._lod = None
 
+        self.param_slices = OrderedDict()
+        self._comp_slices = {}
+        self.comp_param_count = {}
 
+        values = []
+        offset = 0
+        for comp in self._comps:
+            if isinstance(comp, Body):
+                comp_vals = (('X', comp.delta_C[:,0]), ('R', comp.delta_C[:,1]))
             else:
-                val = comp.delta_Cc[:,0] #fixes the x location of the geometry root
-                meta = {'value':val, 'iotype':'in', 'shape':val.shape,
-                'desc':'axial location of the control points for the centerline of the shell'}
-                tup = ('%s.X'%name, meta)
-                params.append(tup)
-                self.param_name_map[tup[0]] = val
-                n_X = val.shape[0]
-
-                val = comp.delta_Cc[:,1] #can vary all centerlines
-                meta = {'value':val, 'iotype':'in', 'shape':val.shape,
-                'desc':'radial location of the control points for the centerline of the shell'}
-                tup = ('%s.R'%name, meta)
-                params.append(tup)
-                self.param_name_map[tup[0]] = val
-                n_R = val.shape[0]
+                comp_vals = (('X', comp.delta_Cc[:,0]), ('R', comp.delta_Cc[:,1]),
+                             ('thickness', comp.delta_Ct[:,1]))
+
+            comp_slices = []
+            for var, val in comp_vals:
+                name = '%s.%s'%(comp.name, var)
+                if name in old_slices: #keep values that were already set
+                    val = old_vector[old_slices[name]]
+                sl = slice(offset, offset+len(val))
+                offset = sl.stop
+
+                self.param_slices[name] = sl
+                comp_slices.append(sl)
+                values.append(val)
+
+            self._comp_slices[comp.name] = tuple(comp_slices)
+            self.comp_param_count[comp] = tuple(sl.stop-sl.start for sl in comp_slices)
+
+        self.param_vector = np.zeros((offset,))
+        if values:
+            self.param_vector[:] = np.hstack(values)
+        self.param_name_map = dict((name, self.param_vector[sl])
+                                   for name, sl in self.param_slices.iteritems())
+        self.n_controls = offset
+
+        #rows of each component in the gathered points array
+        self._comp_point_slices = {}
+        offset = 0
+        for comp in self._comps:
+            if isinstance(comp, Body):
+                n_points = len(comp.stl.points)
+            else:
+                n_points = len(comp.outer_stl.points)+len(comp.inner_stl.points)
+            self._comp_point_slices[comp.name] = slice(offset, offset+n_points)
+            offset += n_points
+        self._n_layout_points = offset
 
-                val = comp.delta_Ct[:,1] #except last R, to keep tip size fixed
-                meta = {'value':val, 'iotype':'in', 'shape':val.shape,
-                'desc':'thickness of the shell at each axial station'}
-                tup = ('%s.thickness'%name, meta)
-                params.append(tup)
-                self.param_name_map[tup[0]] = val
-                n_T = val.shape[0]
-                self.comp_param_count[comp] = (n_X,n_R,n_T)
+    def _update_points(self):
+        """gathers the points and connectivity of all the components"""
 
-        #do some point book keeping here
         points = []
         triangles = []
         point_ids = []
 
         i_offset = 0
-        n_controls = 0
         for comp in self._comps:
-            n_controls += sum(self.comp_param_count[comp])
-
             if isinstance(comp,Body):
-                points.extend(comp.stl.points)
-                point_ids.extend(comp.stl.point_ids)
-                size = len(points)
-                triangles.extend(comp.stl.triangles + i_offset)
-                i_offset = size
+                stls = (comp.stl,)
             else:
-                points.extend(comp.outer_stl.points)
-                point_ids.extend(comp.outer_stl.point_ids)
-                size = len(points)
-                triangles.extend(comp.outer_stl.triangles + i_offset)
-                i_offset = size
-
-                points.extend(comp.inner_stl.points)
-                point_ids.extend(comp.inner_stl.point_ids)
-                size = len(points)
-                triangles.extend(comp.inner_stl.triangles + i_offset)
-                i_offset = size
-
-        self.points = np.array(points)
-        self.point_ids = np.array(point_ids)
-        self.n_controls = n_controls
-        self.n_points = len(points)
+                stls = (comp.outer_stl, comp.inner_stl)
+            for stl in stls:
+                points.append(stl.points)
+                point_ids.append(stl.point_ids)
+                triangles.extend(stl.triangles + i_offset)
+                i_offset += len(stl.points)
+
+        if points:
+            self.points = np.vstack(points)
+            self.point_ids = np.hstack(point_ids)
+        else:
+            self.points = np.zeros((0,3))
+            self.point_ids = np.zeros((0,), dtype=np.int)
+        self.n_points = len(self.points)
         self.triangles = triangles
         self.n_triangles = len(triangles)
 
+    def list_parameters(self):
+        """ returns a dictionary of parameters sets key'd to component names"""
+
+        params = []
+        for comp in self._comps:
+            name = comp.name
+
+            if isinstance(comp, Body):
+                descs = (('X', "axial location of control points for the ffd"),
+                         ('R', "radial location of control points for the ffd"))
+            else:
+                descs = (('X', 'axial location of the control points for the centerline of the shell'),
+                         ('R', 'radial location of the control points for the centerline of the shell'),
+                         ('thickness', 'thickness of the shell at each axial station'))
+
+            for var, desc in descs:
+                param_name = '%s.%s'%(name, var)
+                val = self.param_name_map[param_name]
+                meta = {'value':val, 'iotype':'in', 'shape':val.shape,
+                'desc':desc}
+                params.append((param_name, meta))
+
+        #do some point book keeping here
+        self._update_points()
+
         params.append(
             ('geom_out', {'iotype':'out', 'data_shape':self.points.shape, 'type':IStaticGeometry})
         )
         return params
 
     def set_parameter(self, name, val):
-        self.param_name_map[name] = val
+        self.param_vector[self.param_slices[name]] = val
 
     def get_parameters(self, names):
         return [self.param_name_map[n] for n in names]
 
-    def regen_model(self):
-        for comp in self._comps:
-
-            #print "inside STLGroup.regen_model, plug.R is ", self.meta['plug.R']['value']
-
-            #del_C = np.ones((10,2)) * 123.0
+    def set_vector(self, vector):
+        """sets all the parameters at once from a flat vector, laid out as
+        given by param_slices"""
+
+        vector = np.asarray(vector, dtype=np.float64)
+        if vector.shape != self.param_vector.shape:
+            raise ValueError("expected a parameter vector of shape %s, but got %s"%
+                (self.param_vector.shape, vector.shape))
+        self.param_vector[:] = vector
+
+    def get_vector(self):
+        """returns a copy of the flat parameter vector"""
+
+        return self.param_vector.copy()
+
+    def deform_vector(self, vector):
+        """sets all the parameters from a flat vector and regenerates the
+        geometry. Returns the deformed points"""
+
+        self.set_vector(vector)
+        self.regen_model()
+        return self.points
+
+    def _comp_deltas(self, comp, vector):
+        """returns the control point motions of comp, taken from the given flat
+        parameter vector"""
+
+        slices = self._comp_slices[comp.name]
+
+        if isinstance(comp, Body):
+            del_C = np.zeros(comp.delta_C.shape)
+            del_C[:,0] = vector[slices[0]]
+            del_C[:,1] = vector[slices[1]]
+            return (del_C,)
+
+        del_Cc = np.zeros(comp.delta_Cc.shape)
+        del_Cc[:,0] = vector[slices[0]]
+        del_Cc[:,1] = vector[slices[1]]
+
+        del_Ct = np.zeros(comp.delta_Ct.shape)
+        del_Ct[:,0] = vector[slices[0]]
+        del_Ct[:,1] = vector[slices[2]]
+        # need both delta_Cc and delta_Ct for shells
+        return (del_Cc, del_Ct)
+
+    @instrument.timed('evaluate')
+    def evaluate_vector(self, vector, out=None):
+        """returns the deformed points of all the components for the given flat
+        parameter vector, in the same order as points. Neither the group nor its
+        components are changed, so this can be called from many threads at once.
+        The result is written to out, if given"""
+
+        vector = np.asarray(vector, dtype=np.float64)
+        if vector.shape != self.param_vector.shape:
+            raise ValueError("expected a parameter vector of shape %s, but got %s"%
+                (self.param_vector.shape, vector.shape))
+        if out is None:
+            out = np.empty((self._n_layout_points,3))
 
-            if isinstance(comp, Body):
-                delta_C_shape = comp.delta_C.shape
-                del_C = np.zeros( delta_C_shape )
-                del_C[:,0] = self.param_name_map[ '%s.X' % comp.name ]
-                del_C[:,1] = self.param_name_map[ '%s.R' % comp.name ]
-                comp.deform(delta_C=del_C)
-            else:
-                delta_Cc_shape = comp.delta_Cc.shape
-                del_Cc = np.zeros( delta_Cc_shape )
-                del_Cc[:,0] = self.param_name_map[ '%s.X' % comp.name ]
-                del_Cc[:,1] = self.param_name_map[ '%s.R' % comp.name ]
+        for comp in self._comps:
+            deltas = self._comp_deltas(comp, vector)
+            comp.evaluate(*deltas, out=out[self._comp_point_slices[comp.name]])
 
-                delta_Ct_shape = comp.delta_Ct.shape
-                del_Ct = np.zeros( delta_Ct_shape )
-                del_Ct[:,0] = self.param_name_map[ '%s.X' % comp.name ]
-                del_Ct[:,1] = self.param_name_map[ '%s.thickness' % comp.name ]
-                # need both delta_Cc and delta_Ct for shells
-                comp.deform(delta_Cc=del_Cc, delta_Ct=del_Ct)
+        return out
 
-        self.list_parameters() #needed for book-keeping
+    def regen_model(self):
+        tasks = [(comp, self._comp_deltas(comp, self.param_vector)) for comp in self._comps
+                 if comp.name not in self._frozen]
+        self._deform_comps(tasks)
+        self._update_points() #needed for book-keeping
 
 
     def get_static_geometry(self):
@@ -537,12 +1013,86 @@ class STLGroup(object):
     #end methods for IParametricGeometry
 
     #methods for IStaticGeometry
-    def get_visualization_data(self, wv):
-        self.provideJ()
+    def visualization_buffers(self):
+        """returns the points, as a flat float32 array, and the triangles, as a
+        flat int32 array, for the viewer, along with the names of the
+        components whose points changed, or None if the triangles are new too.
+        The buffers are kept between calls and updated in place: the
+        triangles are only built when the components change, and only the
+        points of the components deformed since the last call are copied in"""
+
+        if self._vis_buffers is None:
+            triangles = [self._comp_triangles(comp)+self._comp_point_slices[comp.name].start
+                         for comp in self._comps]
+            tris = np.vstack(triangles).astype(np.int32).ravel() if triangles else np.zeros((0,), dtype=np.int32)
+            self._vis_buffers = (self.points.astype(np.float32).ravel(), tris)
+            self._vis_dirty = set()
+            return self._vis_buffers+(None,)
+
+        xyzs, tris = self._vis_buffers
+        points = xyzs.reshape((-1,3))
+        changed = [comp.name for comp in self._comps if comp.name in self._vis_dirty]
+        for name in changed:
+            rows = self._comp_point_slices[name]
+            points[rows] = self.points[rows]
+        self._vis_dirty = set()
+        return xyzs, tris, changed
+
+    def _comp_triangles(self, comp):
+        #connectivity of a component, numbered from its first point
+        stls = (comp.stl,) if isinstance(comp, Body) else (comp.outer_stl, comp.inner_stl)
+        triangles = []
+        offset = 0
+        for stl in stls:
+            triangles.append(np.asarray(stl.triangles)+offset)
+            offset += len(stl.points)
+        return np.vstack(triangles)
+
+    def build_lod(self, n_levels=3, coarsest=16):
+        """precomputes n_levels decimated versions of each component by vertex
+        clustering, coarsest first, see lod.build_levels. They are clustered
+        on the current points, and follow the points as they are deformed"""
+
+        self._lod = (n_levels, dict((comp.name, build_levels(self.points[self._comp_point_slices[comp.name]],
+                                                               self._comp_triangles(comp), n_levels, coarsest))
+                                    for comp in self._comps))
+
+    def lod_buffers(self, level):
+        """returns the points, as a flat float32 array, and the triangles, as a
+        flat int32 array, of the given level of detail of the whole group,
+        from 0 for the coarsest up to the number of levels for the full
+        resolution. The levels are built by build_lod on first use"""
+
+        if self._lod is None:
+            self.build_lod()
+        n_levels, levels = self._lod
+        if level >= n_levels:
+            return self.visualization_buffers()[:2]
 
-        xyzs = np.array(self.points).flatten().astype(np.float32)
-        tris = np.array(self.triangles).flatten().astype(np.int32)
+        points = []
+        triangles = []
+        offset = 0
+        for comp in self._comps:
+            mesh = levels[comp.name][level]
+            points.append(mesh.points(self.points[self._comp_point_slices[comp.name]]))
+            triangles.append(mesh.triangles+offset)
+            offset += mesh.n_points
+        return (np.vstack(points).astype(np.float32).ravel(),
+                np.vstack(triangles).astype(np.int32).ravel())
+
+    def get_visualization_data(self, wv, level=None):
+        """sends the geometry to the viewer, at full resolution, or at the
+        given level of detail, see lod_buffers"""
+
+        if level is not None:
+            xyzs, tris = self.lod_buffers(level)
+            wv.set_face_data(xyzs, tris, name="surface")
+            return
 
+        xyzs, tris, _ = self.visualization_buffers()
+
+        #the viewer takes both every time, but the triangles are the same
+        #buffer from one call to the next
         wv.set_face_data(xyzs, tris, name="surface")
 
 
@@ -552,16 +1102,24 @@ class STLGroup(object):
 try:
     class STLGroupSender(STLSender):
         def __init__(self, *args, **kargs):
+            #level of detail to stream, None for the full resolution
+            self.lod_level = kargs.pop('lod_level', None)
             super(STLGroupSender, self).__init__(*args, **kargs)
             self.wv.set_context_bias(0)
 
+        def set_lod_level(self, level):
+            """sets the level of detail of the next updates, from 0 for the
+            coarsest, so a coarse version can be streamed at once and refined
+            on demand. None goes back to the full resolution"""
+            self.lod_level = level
+
         @staticmethod
         def supports(obj):
             return isinstance(obj, STLGroup)
 
         def geom_from_obj(self, obj):
             if isinstance(obj, STLGroup):
-                obj.get_visualization_data(self.wv)
+                obj.get_visualization_data(self.wv, level=self.lod_level)
             else:
                 raise RuntimeError("object must be a Geometry but is a '%s' instead"%(str(type(obj))))
 except NameError:
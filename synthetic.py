@@ -0,0 +1,106 @@
+""" Synthetic surfaces of revolution, written in the same ASCII STL flavor as
+the MASSOUD surface files (with a point id after each vertex) and as binary
+STL, so the pipeline can be exercised without the real nozzle geometry """
+
+import os
+
+import numpy as np
+
+#same layout as BINARY_FACET in stl, packed so every facet is 50 bytes
+_BINARY_FACET_DTYPE = np.dtype([('facet', '<f4', (12,)), ('attribute', '<u2')])
+
+ASCII_FACET = """  facet normal %.16e %.16e %.16e
+    outer loop
+      vertex %.16e %.16e %.16e %d
+      vertex %.16e %.16e %.16e %d
+      vertex %.16e %.16e %.16e %d
+    endloop
+  endfacet"""
+
+
+def revolve_profile(x, r, n_theta, first_id=1):
+    """returns the facets, as an n_facets x 12 array of the normal and the
+    three vertices of each one, and the point ids of the vertices, as an
+    n_facets x 3 array, of the surface made by revolving the profile (x, r)
+    around the x axis at n_theta evenly spaced angles. Every quad between two
+    stations and two angles is split into two facets"""
+
+    x = np.asarray(x, dtype=np.float64)
+    r = np.asarray(r, dtype=np.float64)
+    n_x = len(x)
+
+    theta = 2*np.pi*np.arange(n_theta)/n_theta
+    points = np.empty((n_x, n_theta, 3))
+    points[:,:,0] = x[:,np.newaxis]
+    points[:,:,1] = r[:,np.newaxis]*np.sin(theta)
+    points[:,:,2] = r[:,np.newaxis]*np.cos(theta)
+    ids = first_id+np.arange(n_x*n_theta).reshape((n_x, n_theta))
+
+    i, j = np.meshgrid(np.arange(n_x-1), np.arange(n_theta), indexing='ij')
+    i, j = i.ravel(), j.ravel()
+    j2 = (j+1)%n_theta
+    #corners of the two facets of each quad, interleaved
+    corner_i = np.stack(((i, i+1, i+1), (i, i+1, i)), axis=1).transpose(2, 1, 0).reshape((-1, 3))
+    corner_j = np.stack(((j, j, j2), (j, j2, j2)), axis=1).transpose(2, 1, 0).reshape((-1, 3))
+
+    vertices = points[corner_i, corner_j] #n_facets x 3 x 3
+    normals = np.cross(vertices[:,1]-vertices[:,0], vertices[:,2]-vertices[:,0])
+    length = np.sqrt((normals**2).sum(axis=1))
+    normals /= np.where(length > 0, length, 1.)[:,np.newaxis]
+
+    facets = np.hstack((normals, vertices.reshape((-1, 9))))
+    return facets, ids[corner_i, corner_j]
+
+def write_ascii_stl(file_name, facets, ids):
+    """writes facets and their point ids as an ASCII STL file that STL can read"""
+
+    with open(file_name, 'w') as f:
+        f.write("solid synthetic\n")
+        for facet, facet_ids in zip(facets, ids):
+            values = tuple(facet[:3])+tuple(facet[3:6])+(facet_ids[0],)+ \
+                     tuple(facet[6:9])+(facet_ids[1],)+tuple(facet[9:])+(facet_ids[2],)
+            f.write(ASCII_FACET%values)
+            f.write("\n")
+        f.write("endsolid synthetic\n")
+
+def write_binary_stl(file_name, facets):
+    """writes facets as a binary STL file"""
+
+    data = np.zeros(len(facets), dtype=_BINARY_FACET_DTYPE)
+    data['facet'] = facets
+    with open(file_name, 'wb') as f:
+        f.write("synthetic".ljust(80, " "))
+        f.write(np.array([len(facets)], dtype='<u4').tostring())
+        f.write(data.tostring())
+
+
+def nozzle_profiles(n_x):
+    """returns the (x, r) profiles, with n_x stations each, of a plug nozzle:
+    a center body and the outer and inner surfaces of a cowl around it"""
+
+    x_body = np.linspace(0., 8., n_x)
+    x_cowl = np.linspace(0.7, 4.1, n_x)
+    s = (x_cowl-0.7)/3.4
+    return {'centerbody': (x_body, 0.05+0.6*np.sin(np.pi*x_body/8.)),
+            'outer_cowl': (x_cowl, 1.3+0.1*np.sin(np.pi*s)),
+            'inner_cowl': (x_cowl, 1.2-0.15*np.sin(np.pi*s))}
+
+def write_nozzle(folder, n_x, n_theta):
+    """writes the surfaces of a synthetic plug nozzle, with n_x stations along
+    the axis and n_theta points around it, to folder as ASCII and binary STL.
+    Returns a dictionary of surface name: (ascii file, binary file)"""
+
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    files = {}
+    first_id = 1
+    for name, (x, r) in sorted(nozzle_profiles(n_x).iteritems()):
+        facets, ids = revolve_profile(x, r, n_theta, first_id)
+        first_id += n_x*n_theta
+        ascii_file = os.path.join(folder, "%s_%dx%d_ASCII.stl"%(name, n_x, n_theta))
+        binary_file = os.path.join(folder, "%s_%dx%d.stl"%(name, n_x, n_theta))
+        write_ascii_stl(ascii_file, facets, ids)
+        write_binary_stl(binary_file, facets)
+        files[name] = (ascii_file, binary_file)
+    return files
@@ -0,0 +1,57 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+#the modules live flat in the root of the repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stl import STL
+from ffd_axisymetric import Body, Shell
+from stl_group import STLGroup
+from synthetic import write_nozzle
+
+
+def build_nozzle(folder, n_x=12, n_theta=8, n_controls=5):
+    """returns an STLGroup of a synthetic plug nozzle, a body called plug and
+    a shell called cowl, with meshes of n_x stations and n_theta angles
+    written to folder"""
+
+    files = write_nozzle(folder, n_x, n_theta)
+    surfaces = dict((name, STL(ascii_file)) for name, (ascii_file, _) in files.iteritems())
+
+    body_controls = np.array(zip(np.linspace(0., 8., n_controls), np.zeros(n_controls)))
+    cowl_controls = np.array(zip(np.linspace(0.7, 4.1, n_controls), np.zeros(n_controls)))
+    plug = Body(surfaces['centerbody'], body_controls, x_ref=0.15, r_ref=0.025)
+    cowl = Shell(surfaces['outer_cowl'], surfaces['inner_cowl'], cowl_controls, cowl_controls.copy(),
+                 x_ref=0.15, r_ref=0.02)
+
+    geom = STLGroup()
+    geom.add(plug, name='plug')
+    geom.add(cowl, name='cowl')
+    return geom
+
+def random_design(geom, seed=0, scale=0.5):
+    """returns a random parameter vector for geom, with the end control points
+    kept at their axial locations"""
+
+    rand = np.random.RandomState(seed)
+    vector = rand.uniform(-scale, scale, len(geom.param_vector))
+    for name, sl in geom.param_slices.iteritems():
+        if name.endswith('.X'):
+            vector[sl.start] = vector[sl.stop-1] = 0.
+    return vector
+
+
+@pytest.fixture
+def workdir(tmpdir, monkeypatch):
+    """a temporary folder to work in, so the b-spline and stl pickles don't
+    end up in the repo"""
+
+    monkeypatch.chdir(tmpdir)
+    return str(tmpdir)
+
+@pytest.fixture
+def nozzle(workdir):
+    return build_nozzle(os.path.join(workdir, "meshes"))
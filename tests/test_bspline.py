@@ -0,0 +1,51 @@
+import os
+import glob
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from bspline import Bspline
+
+
+def _inputs(n_points=200, n_controls=5):
+    X = np.linspace(0., 8., n_points)
+    points = np.vstack((X, 0.5+0.1*np.sin(X), np.zeros(n_points))).T
+    controls = np.array(zip(np.linspace(0., 8., n_controls), np.zeros(n_controls)))
+    return controls, points
+
+
+def test_concurrent_builds_share_one_pickle(workdir):
+    controls, points = _inputs()
+    pool = ThreadPool(8)
+    try:
+        splines = pool.map(lambda i: Bspline(controls, points), range(16))
+    finally:
+        pool.close()
+        pool.join()
+
+    C = controls+0.1
+    for bs in splines:
+        assert np.array_equal(bs.evaluate(C), splines[0].evaluate(C))
+    assert len(glob.glob(os.path.join("pyBspline_pkl", "*.bspline_pkl"))) == 1
+    assert not glob.glob(os.path.join("pyBspline_pkl", "*.tmp"))
+
+
+def test_broken_pickle_is_rebuilt(workdir):
+    controls, points = _inputs()
+    expected = Bspline(controls, points).evaluate(controls+0.1)
+    pkl_file, = glob.glob(os.path.join("pyBspline_pkl", "*.bspline_pkl"))
+    with open(pkl_file, 'r+b') as f:
+        f.truncate(10)
+
+    #the first one is gone, so this one can't get its basis from the registry
+    assert np.array_equal(Bspline(controls, points).evaluate(controls+0.1), expected)
+
+
+def test_only_the_station_basis_is_kept(workdir):
+    controls, points = _inputs()
+    points = np.vstack((points, points*(1., -1., 1.))) #two points on each station
+    bs = Bspline(controls, points)
+
+    assert 'B' not in vars(bs)
+    assert bs.B_stations.shape == (len(points)/2, len(controls))
+    assert np.array_equal(bs.B, np.asarray(bs.B_stations)[bs.station_index])
@@ -0,0 +1,86 @@
+import os
+
+import numpy as np
+import pytest
+
+from conftest import build_nozzle, random_design
+
+
+def test_cached_points_match_a_fresh_deform(nozzle):
+    fresh = build_nozzle("fresh")
+    nozzle.enable_cache()
+    for seed in (0, 1, 0):
+        vector = random_design(nozzle, seed)
+        nozzle.deform_vector(vector)
+        fresh.deform_vector(vector)
+        assert np.array_equal(nozzle.points, fresh.points)
+    assert nozzle.cache_stats()['hits'] == 2
+
+
+def test_shared_cache_dir_keeps_geometries_apart(workdir):
+    cache_dir = os.path.join(workdir, "cache")
+
+    coarse = build_nozzle("coarse", n_x=12)
+    coarse.enable_cache(cache_dir=cache_dir)
+    coarse.deform_vector(random_design(coarse))
+
+    #same component names and parameter layout, but another mesh
+    fine = build_nozzle("fine", n_x=16)
+    fine.enable_cache(cache_dir=cache_dir)
+    fine.deform_vector(random_design(fine))
+    assert fine.cache_stats()['disk_hits'] == 0
+
+    fresh = build_nozzle("fresh", n_x=16)
+    fresh.deform_vector(random_design(fresh))
+    assert np.array_equal(fine.points, fresh.points)
+
+
+def test_set_precision_does_not_reuse_float64_states(workdir):
+    cache_dir = os.path.join(workdir, "cache")
+    single = build_nozzle("single")
+    single.set_precision(np.float32)
+    single.deform_vector(random_design(single))
+
+    geom = build_nozzle("geom")
+    geom.enable_cache(cache_dir=cache_dir)
+    geom.deform_vector(random_design(geom))
+    geom.set_precision(np.float32)
+    assert np.array_equal(geom.points, single.points)
+    assert geom.cache_stats()['hits']+geom.cache_stats()['disk_hits'] == 0
+
+
+def test_files_are_rewritten_after_set_precision(workdir):
+    geom = build_nozzle("geom")
+    geom.enable_cache()
+    geom.deform_vector(random_design(geom))
+    geom.writeSTL("out.stl", ascii=True)
+    before = open("out.stl").read()
+
+    geom.set_precision(np.float32)
+    geom.writeSTL("out.stl", ascii=True)
+    assert open("out.stl").read() != before
+
+
+def test_only_finished_writes_are_skipped(nozzle):
+    nozzle.enable_cache()
+    nozzle.deform_vector(random_design(nozzle))
+    nozzle.writeSTL("out.stl", ascii=True)
+    written = open("out.stl").read()
+
+    #deleted or changed by something else, so written again
+    os.remove("out.stl")
+    nozzle.writeSTL("out.stl", ascii=True)
+    assert open("out.stl").read() == written
+    with open("out.stl", "w") as f:
+        f.write("changed")
+    nozzle.writeSTL("out.stl", ascii=True)
+    assert open("out.stl").read() == written
+
+    #a write that fails is not taken for a finished one
+    os.remove("out.stl")
+    os.mkdir("out.stl")
+    with pytest.raises(IOError):
+        nozzle.writeSTL("out.stl", ascii=True)
+    os.rmdir("out.stl")
+    nozzle.writeSTL("out.stl", ascii=True)
+    assert open("out.stl").read() == written
@@ -0,0 +1,156 @@
+import numpy as np
+
+from conftest import build_nozzle, random_design
+
+
+def check_jacobians(geom, vector, step=1e-6):
+    """compares the jacobians of geom at vector with central differences of
+    evaluate_vector, which are exact up to rounding, since the points are
+    linear in the parameters"""
+
+    geom.deform_vector(vector)
+    geom._needs_linerize = True
+    geom.provideJ()
+    for name, sl in geom.param_slices.iteritems():
+        J = geom.param_J_map[name]
+        for k, i in enumerate(range(sl.start, sl.stop)):
+            up, down = vector.copy(), vector.copy()
+            up[i] += step
+            down[i] -= step
+            diff = (geom.evaluate_vector(up)-geom.evaluate_vector(down))/(2*step)
+            for axis in range(3):
+                expected = 0. if J[axis] is False else np.asarray(J[axis])[:,k]
+                assert np.allclose(diff[:,axis], expected, rtol=0, atol=1e-7), (name, k, axis)
+
+
+def test_jacobians_match_finite_differences(nozzle):
+    check_jacobians(nozzle, random_design(nozzle))
+
+
+def test_components_keep_no_full_size_derivatives(nozzle):
+    for comp in nozzle._comps:
+        n_points = len(nozzle.points[nozzle._comp_point_slices[comp.name]])
+        for attr, value in vars(comp).iteritems():
+            if isinstance(value, np.ndarray) and value.ndim == 2 and attr.startswith('d'):
+                assert value.shape[0] < n_points, (comp.name, attr, value.shape)
+
+
+def test_displacement_constraints_match_finite_differences(nozzle):
+    vector = random_design(nozzle)
+    nozzle.deform_vector(vector)
+    step = 1e-6
+    t = np.linspace(0.05, 0.95, 7)
+
+    for comp in nozzle._comps:
+        slices = nozzle._comp_slices[comp.name]
+        flat = np.hstack([vector[sl] for sl in slices])
+        def constraints(values):
+            v = vector.copy()
+            v[np.hstack([np.arange(sl.start, sl.stop) for sl in slices])] = values
+            return comp.displacement_constraints(*nozzle._comp_deltas(comp, v), t=t)
+
+        result = constraints(flat)
+        for name, (values, J) in result.iteritems():
+            for j in range(len(flat)):
+                up, down = flat.copy(), flat.copy()
+                up[j] += step
+                down[j] -= step
+                diff = (constraints(up)[name][0]-constraints(down)[name][0])/(2*step)
+                assert np.allclose(J[:,j], diff, rtol=1e-5, atol=1e-6), (comp.name, name, j)
+
+    #the slope is the one of the displacement curve, not of the surface
+    plug = nozzle._comps[0]
+    dx, dr = plug.bs.derivative(t, C=plug.C_bar).T
+    slope = plug.displacement_constraints(t=t)['displacement_slope'][0]
+    assert np.allclose(slope, plug.r_mag*dr/dx)
+
+
+def test_incremental_edits_match_a_full_deform(workdir):
+    full = build_nozzle("full")
+    incremental = build_nozzle("incremental")
+    incremental.set_incremental()
+
+    #the end control points keep their axial locations
+    ends = [i for name, sl in full.param_slices.iteritems() if name.endswith('.X') for i in (sl.start, sl.stop-1)]
+    free = np.setdiff1d(np.arange(len(full.param_vector)), ends)
+
+    rand = np.random.RandomState(1)
+    vector = random_design(full)
+    for step in range(12):
+        #one parameter at a time, then a few at once
+        moved = rand.choice(free, 1 if step < 8 else 3, replace=False)
+        vector[moved] += rand.uniform(-0.1, 0.1, len(moved))
+        assert np.array_equal(incremental.deform_vector(vector), full.deform_vector(vector)), step
+
+    #a new precision starts over with a full deform
+    full.set_precision(np.float32)
+    incremental.set_precision(np.float32)
+    assert np.array_equal(incremental.points, full.points)
+
+
+def test_refine_keeps_the_shape(nozzle):
+    vector = random_design(nozzle)
+    before = nozzle.deform_vector(vector).copy()
+    n_params = len(nozzle.param_vector)
+
+    nozzle.refine('plug', knots=[0.3, 0.6])
+    nozzle.refine('cowl', elevate=1)
+    plug, cowl = nozzle._comps
+    n_cowl = cowl.n_c_controls
+    assert plug.n_controls == 7 and n_cowl > 5 and cowl.n_t_controls == n_cowl
+    assert len(nozzle.param_vector) == n_params+2*2+3*(n_cowl-5)
+
+    vector = nozzle.param_vector.copy()
+    assert np.allclose(nozzle.deform_vector(vector), before, rtol=0, atol=1e-12)
+
+    #the jacobians grow with the control points, and still match the points
+    nozzle._needs_linerize = True
+    nozzle.provideJ()
+    assert np.asarray(nozzle.param_J_map['plug.X'][0]).shape == (len(before), 7)
+    assert np.asarray(nozzle.param_J_map['cowl.thickness'][1]).shape == (len(before), n_cowl)
+    check_jacobians(nozzle, vector)
+
+
+def test_single_precision_products(nozzle):
+    vector = random_design(nozzle)
+    errors = nozzle.check_precision(vectors=[vector])
+    assert errors['points_relative'] < 1e-6 and errors['jacobian_relative'] < 1e-6
+
+    nozzle.set_precision(np.float32)
+    plug = nozzle._comps[0]
+    #the basis is not upcast for the products with the float64 control points
+    assert plug.bs.evaluate(plug.C).dtype == np.float32
+    assert plug.bs.evaluate_rows(plug.C, [0, 1]).dtype == np.float32
+    assert nozzle.deform_vector(vector).dtype == np.float64
+
+
+def test_clones_leave_the_original_alone(nozzle):
+    nozzle.deform_vector(random_design(nozzle))
+    for comp in nozzle._comps:
+        stls = [comp.stl] if hasattr(comp, 'stl') else [comp.outer_stl, comp.inner_stl]
+        splines = [comp.bs] if hasattr(comp, 'bs') else [comp.bsc_o, comp.bsc_i, comp.bst_o, comp.bst_i]
+        points = [stl.points.copy() for stl in stls]
+        facets = [stl.get_facets().copy() for stl in stls]
+        bases = [np.array(bs.B_stations) for bs in splines]
+        state = comp.deformed_state()
+
+        clone = comp.clone()
+        if hasattr(comp, 'bs'):
+            clone.deform(np.ones(comp.C.shape))
+            moved = [clone.stl]
+            clone_splines = [clone.bs]
+        else:
+            clone.deform(np.ones(comp.Cc.shape), np.ones(comp.Ct.shape))
+            moved = [clone.outer_stl, clone.inner_stl]
+            clone_splines = [clone.bsc_o, clone.bsc_i, clone.bst_o, clone.bst_i]
+
+        assert np.array_equal(comp.deformed_state(), state)
+        for stl, clone_stl, p, f in zip(stls, moved, points, facets):
+            assert not np.array_equal(clone_stl.get_facets(), f)
+            assert np.array_equal(stl.points, p)
+            assert np.array_equal(stl.get_facets(), f)
+        #the bases are shared, read-only, and unchanged
+        for bs, clone_bs, B in zip(splines, clone_splines, bases):
+            assert clone_bs.B_stations is bs.B_stations
+            assert not bs.B_stations.flags.writeable
+            assert np.array_equal(bs.B_stations, B)
@@ -0,0 +1,25 @@
+import numpy as np
+
+import kernels
+from bspline import basis_functions, insertion_matrix
+
+
+def _knots(degree=3, n_controls=6):
+    knots = np.hstack(([0.]*degree, np.linspace(0., 1., n_controls-degree+1), [1.]*degree))
+    #a refined spline has a repeated interior knot too
+    knots, _ = insertion_matrix(knots, degree, knots[degree+1])
+    return knots
+
+def test_basis_loop_matches_basis_functions():
+    #run as plain python, so this holds whether numba is installed or not
+    for degree in (1, 2, 3):
+        knots = _knots(degree)
+        t = np.hstack(([-0.5, -1e-12, 1.+1e-12, 1.5], np.unique(knots), np.linspace(0., 1., 23)))
+        out = np.empty((len(t), len(knots)-degree-1))
+        kernels._basis_loop(knots, degree, t, out)
+        expected = basis_functions(knots, degree, t)
+
+        assert np.allclose(out, expected, rtol=0., atol=1e-14)
+        assert np.array_equal(out != 0., expected != 0.)
+        assert not np.any(out[:4])
+        assert out[t == 1., -1].tolist() == [1., 1.]
@@ -0,0 +1,36 @@
+from multiprocessing.pool import ThreadPool
+
+import memory
+from conftest import build_nozzle
+
+
+def _peaks(geom):
+    return [c['construction'] and c['construction']['peak'] for c in geom.memory_report()['components'].values()]
+
+
+def test_construction_is_not_tracked_by_default(workdir, monkeypatch):
+    def reset_peak():
+        raise AssertionError("the peak was reset without tracking")
+    monkeypatch.setattr(memory, '_reset_peak', reset_peak)
+
+    geom = build_nozzle("meshes")
+    assert _peaks(geom) == [None, None]
+    assert geom.memory_report()['construction_peak'] is None
+
+
+def test_tracking_in_threads(workdir):
+    with memory.tracking():
+        pool = ThreadPool(4)
+        try:
+            geoms = pool.map(lambda i: build_nozzle("meshes_%d"%i), range(4))
+        finally:
+            pool.close()
+            pool.join()
+    assert not memory._tracking[0]
+
+    for geom in geoms:
+        #each thread keeps the peak of its outermost constructions only
+        assert all(peak > 0 for peak in _peaks(geom))
+        for comp in geom._comps:
+            bs = comp.bs if hasattr(comp, 'bs') else comp.bsc_o
+            assert bs._construction_memory['peak'] is None
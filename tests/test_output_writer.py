@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from conftest import random_design
+from output_writer import OutputWriter, OutputWriterError
+
+
+def _fail(file_name):
+    raise IOError("disk full writing %s"%file_name)
+
+def _touch(file_name):
+    open(file_name, 'w').close()
+
+
+@pytest.mark.parametrize('processes', [False, True])
+def test_background_files_match_synchronous_ones(nozzle, processes):
+    writer = OutputWriter(max_pending=1, processes=processes)
+    try:
+        for seed in range(3):
+            nozzle.deform_vector(random_design(nozzle, seed))
+            nozzle.writeSTL("sync_%d.stl"%seed, ascii=True)
+            nozzle.writeSTL("sync_%d.stlb"%seed)
+            nozzle.writeFEPOINT("sync_%d.tec"%seed)
+            #the writer gets copies, so the next design can't leak into these
+            nozzle.writeSTL("async_%d.stl"%seed, ascii=True, writer=writer)
+            nozzle.writeSTL("async_%d.stlb"%seed, writer=writer)
+            nozzle.writeFEPOINT("async_%d.tec"%seed, writer=writer)
+        writer.flush()
+    finally:
+        writer.close()
+
+    assert writer.stats()['written'] == 9
+    for seed in range(3):
+        for ext in ("stl", "stlb", "tec"):
+            sync = open("sync_%d.%s"%(seed, ext), 'rb').read()
+            assert open("async_%d.%s"%(seed, ext), 'rb').read() == sync
+
+
+@pytest.mark.parametrize('processes', [False, True])
+def test_errors_come_back_through_flush(workdir, processes):
+    writer = OutputWriter(processes=processes)
+    try:
+        writer.submit(_fail, "out.stl")
+        with pytest.raises(OutputWriterError) as error:
+            writer.flush()
+        assert "disk full writing out.stl" in str(error.value)
+
+        #reported once, then the writer carries on
+        writer.submit(_touch, "after.txt")
+        writer.flush()
+        assert os.path.exists("after.txt")
+    finally:
+        writer.close()
@@ -0,0 +1,35 @@
+import os
+
+import numpy as np
+import pytest
+
+from conftest import random_design
+from parallel_doe import share_geometry, attach_geometry, run_cases, profile_post
+
+
+def test_attached_geometry_deforms_like_the_source(nozzle, workdir):
+    folder = share_geometry(nozzle, os.path.join(workdir, "shared"))
+    attached = attach_geometry(folder)
+
+    vectors = [random_design(nozzle, seed) for seed in range(3)]
+    for vector in vectors:
+        assert np.array_equal(attached.evaluate_vector(vector), nozzle.evaluate_vector(vector))
+
+    #memory mapped, and nobody gets to write to them
+    arrays = []
+    for comp in attached._comps:
+        for value in vars(comp).values():
+            values = vars(value).values() if hasattr(value, 'B_stations') else [value]
+            arrays.extend(a for a in values if isinstance(a, np.ndarray))
+    assert len(arrays) > 20
+    for array in arrays:
+        assert isinstance(array, np.memmap) and not array.flags.writeable
+        with pytest.raises(ValueError):
+            array.flat[0] = 1.
+
+    results = run_cases(folder, vectors, n_procs=2)
+    for vector, points in zip(vectors, results):
+        assert np.array_equal(points, nozzle.deform_vector(vector))
+    points = nozzle.deform_vector(vectors[0])
+    assert np.array_equal(run_cases(nozzle, vectors[:1], n_procs=2, post=profile_post)[0],
+                          nozzle.project_profiles(points[np.newaxis])[0])
@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+import pytest
+
+import snapshot
+from conftest import random_design
+
+
+def test_loaded_geometry_deforms_like_the_source(nozzle, workdir):
+    snapshot.save_snapshot(nozzle, "snap")
+    loaded = snapshot.load_snapshot("snap")
+
+    for seed in range(3):
+        vector = random_design(nozzle, seed)
+        assert np.array_equal(loaded.deform_vector(vector), nozzle.deform_vector(vector))
+    loaded._needs_linerize = nozzle._needs_linerize = True
+    loaded.provideJ()
+    nozzle.provideJ()
+    assert np.array_equal(loaded.dXqdC, nozzle.dXqdC)
+
+    #copy-on-write, so writing to the loaded arrays leaves the snapshot alone
+    plug = loaded._comps[0]
+    assert isinstance(plug.P, np.memmap) and plug.P.mode == 'c'
+    plug.P[:] = 0.
+    again = snapshot.load_snapshot("snap", mmap=False)
+    assert np.array_equal(again._comps[0].P, nozzle._comps[0].P)
+
+
+def test_snapshot_is_stale_when_the_build_changes(nozzle, workdir):
+    controls = np.linspace(0., 8., 5)
+    build = [('plug', type(nozzle._comps[0]), ['centerbody.stl'], {'controls': controls, 'x_ref': 0.15})]
+    snapshot.save_snapshot(nozzle, "snap", build=build)
+
+    assert snapshot.is_current("snap")
+    assert snapshot.is_current("snap", build=build)
+    build[0][3]['x_ref'] = 0.2
+    assert not snapshot.is_current("snap", build=build)
+    build[0][3]['x_ref'] = 0.15
+    controls[1] += 0.1
+    assert not snapshot.is_current("snap", build=build)
+
+
+def test_failed_save_leaves_nothing_behind(nozzle, workdir, monkeypatch):
+    snapshot.save_snapshot(nozzle, "snap")
+    def save(*args):
+        raise IOError("read-only file system")
+    monkeypatch.setattr(np, 'save', save)
+
+    with pytest.raises(IOError):
+        snapshot.save_snapshot(nozzle, "snap")
+    assert not os.path.exists("snap.tmp")
+    assert snapshot.is_current("snap")
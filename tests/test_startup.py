@@ -0,0 +1,33 @@
+import os
+
+import numpy as np
+
+from conftest import build_nozzle
+from ffd_axisymetric import Body, Shell
+from startup import build_components
+from synthetic import write_nozzle
+
+
+def _specs(folder):
+    files = write_nozzle(folder, 12, 8)
+    controls = np.array(zip(np.linspace(0., 8., 5), np.zeros(5)))
+    cowl_controls = np.array(zip(np.linspace(0.7, 4.1, 5), np.zeros(5)))
+    return [('plug', Body, [files['centerbody'][0]], dict(controls=controls, x_ref=0.15, r_ref=0.025)),
+            ('cowl', Shell, [files['outer_cowl'][0], files['inner_cowl'][0]],
+             dict(center_line_controls=cowl_controls, thickness_controls=cowl_controls.copy(),
+                  x_ref=0.15, r_ref=0.02))]
+
+
+def test_components_share_their_bases(workdir):
+    reference = build_nozzle("meshes")
+    for processes in (False, True):
+        comps, timings = build_components(_specs("meshes"), n_workers=2, processes=processes)
+        assert list(comps) == ['plug', 'cowl']
+        assert timings['total'] > 0
+
+        #the bases are the ones of the components built in this process
+        assert comps['plug'].bs.B_stations is reference._comps[0].bs.B_stations
+        assert comps['cowl'].bsc_o.station_index is reference._comps[1].bsc_o.station_index
+        assert not comps['plug'].bs.B_stations.flags.writeable
+        assert np.array_equal(comps['plug'].evaluate(np.ones((5, 2))),
+                              reference._comps[0].evaluate(np.ones((5, 2))))
@@ -0,0 +1,91 @@
+import numpy as np
+
+from conftest import build_nozzle, random_design
+from deform_cache import digest
+from parallel_doe import profile_post
+from results_store import ResultsStore
+
+
+def _folded_design(geom):
+    #pushes the second x control point of the plug past the third one, so the
+    #deformed x is no longer monotonic along the plug
+    vector = random_design(geom, scale=0.1)
+    vector[geom.param_slices['plug.X'].start+1] = 30.
+    return vector
+
+def _extract_profiles(geom):
+    #how the profiles were extracted before they were precomputed
+    profiles = []
+    for comp in geom._comps:
+        stls = (comp.stl,) if hasattr(comp, 'stl') else (comp.outer_stl, comp.inner_stl)
+        for stl in stls:
+            p = stl.points
+            points = p[np.logical_and(abs(p[:,2])<2E-6, abs(p[:,1])>0.0)]
+            profiles.append(points[points[:,0].argsort()])
+    return profiles
+
+
+def test_profiles_follow_a_folded_deformation(nozzle, workdir):
+    vector = _folded_design(nozzle)
+    points = nozzle.deform_vector(vector).copy()
+    assert np.any(np.diff(nozzle.points[nozzle._profile_rows][:,0]) < 0)
+
+    expected = _extract_profiles(nozzle)
+    profiles = nozzle.project_profile()
+    assert len(profiles) == len(expected)
+    for profile, ref in zip(profiles, expected):
+        assert np.array_equal(profile, ref)
+
+    expected = np.vstack(expected)
+    assert np.array_equal(nozzle.project_profiles(points[np.newaxis])[0], expected)
+    assert np.array_equal(profile_post(nozzle, points), expected)
+
+    store = ResultsStore("results", nozzle)
+    store.append(vector, points)
+    store.flush()
+    assert np.array_equal(np.vstack(store.profiles(0)), expected)
+
+def _outputs(geom):
+    #a digest, so a failure doesn't diff two whole files
+    geom.writeSTL("out.stl", ascii=True)
+    geom.writeFEPOINT("out.tec")
+    return digest(open("out.stl").read(), open("out.tec").read())
+
+def test_undeformed_render_follows_the_points(nozzle, workdir):
+    zeros = np.zeros(len(nozzle.param_vector))
+    _outputs(nozzle) #renders the raw stl points of the undeformed components
+    nozzle.deform_vector(random_design(nozzle))
+    nozzle.deform_vector(zeros)
+    assert not np.array_equal(nozzle.points, build_nozzle("raw").points)
+
+    fresh = build_nozzle("fresh")
+    fresh.deform_vector(random_design(fresh))
+    fresh.deform_vector(zeros)
+    assert _outputs(nozzle) == _outputs(fresh)
+
+    #frozen components are reused too
+    nozzle.freeze('plug')
+    fresh.freeze('plug')
+    nozzle.deform_vector(random_design(nozzle, seed=1))
+    fresh.deform_vector(random_design(fresh, seed=1))
+    assert _outputs(nozzle) == _outputs(fresh)
+
+
+def test_threaded_deform_matches_serial(workdir):
+    serial = build_nozzle("serial")
+    threaded = build_nozzle("threaded")
+    threaded.set_threads(4)
+    cached = build_nozzle("cached")
+    cached.set_threads(4)
+    cached.enable_cache()
+    try:
+        for seed in (0, 1, 0):
+            vector = random_design(serial, seed)
+            expected = serial.deform_vector(vector).copy()
+            assert np.array_equal(threaded.deform_vector(vector), expected)
+            assert np.array_equal(cached.deform_vector(vector), expected)
+            assert list(threaded.deform_timings) == ['plug', 'cowl', 'total']
+        assert cached.cache_stats()['hits'] == 2
+    finally:
+        threaded.set_threads(1)
+        cached.set_threads(1)